@@ -1,176 +1,276 @@
 import os
-import json
-import time
-from datetime import datetime, timedelta
 from flask import Flask, request, Response
 from twilio.twiml.messaging_response import MessagingResponse
+from twilio.rest import Client as TwilioClient
 from openai import OpenAI
 from dotenv import load_dotenv
 from database import db_connection
+from conversation_store import append_messages, load_conversation
 import bot_tools
-import traceback
+import inbound_dedupe
+import intent_router
+import message_pipeline
+import metrics
+import reminders
+import resilience
+from message_coalescer import MESSAGE_COALESCE_SECONDS, MessageCoalescer
+from calendar_watch import CalendarWatchManager
+from message_queue import create_queue
+from tool_dispatcher import run_tool_calls
 
 load_dotenv()
 app = Flask(__name__)
 
 db = db_connection
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-tools = [
-    {
-        "type": "function", "function": {
-            "name": "get_available_slots", "description": "Trova gli orari disponibili per un servizio in una data specifica.",
-            "parameters": { "type": "object", "properties": { "service_name": {"type": "string"}, "date": {"type": "string"} }, "required": ["service_name", "date"] },
-        },
-    },
-    {
-        "type": "function", "function": {
-            "name": "get_next_available_slot", "description": "Trova il primo orario disponibile per un servizio, partendo da oggi. Da usare quando l'utente chiede 'il prima possibile', 'quando puoi', o non specifica una data.",
-            "parameters": { "type": "object", "properties": { "service_name": {"type": "string"} }, "required": ["service_name"] },
-        },
-    },
-    {
-        "type": "function", "function": {
-            "name": "create_or_update_booking", "description": "Crea o aggiorna un appuntamento. Usala SOLO quando hai la conferma esplicita del servizio, della data e dell'ora.",
-            "parameters": { "type": "object", "properties": { "service_name": {"type": "string"}, "date": {"type": "string"}, "time": {"type": "string"} }, "required": ["service_name", "date", "time"] },
-        },
-    },
-    {
-        "type": "function", "function": {
-            "name": "cancel_booking", "description": "Cancella l'ultimo appuntamento confermato di un utente.",
-            "parameters": {"type": "object", "properties": {}},
-        },
-    },
-    {
-        "type": "function", "function": {
-            "name": "get_business_info", "description": "Recupera informazioni generali sul business (orari, indirizzo, lista servizi).",
-            "parameters": {"type": "object", "properties": {}},
-        }
-    }
-]
+# I retry verso OpenAI li gestisce resilience, entro il tempo del messaggio
+openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+twilio_client = None
+
+# Crea/verifica gli indici all'avvio (idempotente); ENSURE_INDEXES=0 per saltare il passaggio
+if os.getenv("ENSURE_INDEXES", "1") == "1":
+    db.ensure_indexes()
+
+# Percorso veloce senza modello per gli intenti più comuni (INTENT_ROUTER=0 per disattivarlo)
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+
+# Modalità asincrona: il webhook mette il messaggio in coda e risponde subito a Twilio
+ASYNC_WEBHOOK = os.getenv("ASYNC_WEBHOOK", "0") == "1"
+
+# Le consegne ripetute dello stesso MessageSid non vengono rielaborate (INBOUND_DEDUPE=0 per disattivare)
+INBOUND_DEDUPE = os.getenv("INBOUND_DEDUPE", "1") == "1"
+
+# Messaggi ravvicinati dello stesso utente uniti in un solo turno (opzionale: MESSAGE_COALESCE_SECONDS > 0)
+message_coalescer = MessageCoalescer() if MESSAGE_COALESCE_SECONDS > 0 else None
+if message_coalescer and not ASYNC_WEBHOOK:
+    print("⚠️ MESSAGE_COALESCE_SECONDS senza ASYNC_WEBHOOK: con worker sincroni i messaggi non si sovrappongono, la finestra aggiunge solo attesa")
 
 def create_twilio_response(message):
     resp = MessagingResponse()
     resp.message(message)
     return Response(str(resp), mimetype='text/xml', status=200)
 
+def create_empty_twilio_response():
+    """Ack immediato a Twilio: la risposta vera arriverà tramite API REST."""
+    return Response(str(MessagingResponse()), mimetype='text/xml', status=200)
+
+def get_twilio_client():
+    global twilio_client
+    if twilio_client is None:
+        twilio_client = TwilioClient(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+    return twilio_client
+
+def send_reply(from_number, to_number, message):
+    """Invia la risposta al cliente tramite Twilio REST (usato in modalità asincrona)."""
+    try:
+        sent = get_twilio_client().messages.create(from_=from_number, to=to_number, body=message)
+        print(f"📨 Risposta inviata via REST ({sent.sid})")
+        return True
+    except Exception as e:
+        print(f"❌ Errore invio risposta Twilio: {e}")
+        return False
+
+def claim_inbound(message_sid, from_number, to_number):
+    """None se il messaggio va elaborato, altrimenti il documento della consegna precedente (vedi inbound_dedupe)."""
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return None
+    try:
+        return inbound_dedupe.claim(db.inbound_messages, message_sid, from_number, to_number)
+    except Exception as e:
+        print(f"⚠️ Deduplica MessageSid non disponibile, elaboro comunque: {e}")
+        return None
+
+def complete_inbound(message_sid, reply):
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return
+    try:
+        inbound_dedupe.complete(db.inbound_messages, message_sid, reply)
+    except Exception as e:
+        print(f"⚠️ Errore salvataggio risposta per {message_sid}: {e}")
+
+def release_inbound(message_sid):
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return
+    try:
+        inbound_dedupe.release(db.inbound_messages, message_sid)
+    except Exception as e:
+        print(f"⚠️ Errore rilascio {message_sid}: {e}")
+
+def process_burst(incoming_msg, from_number, to_number, user_name):
+    """
+    Elabora il messaggio insieme a quelli che lo stesso utente invia subito dopo (vedi message_coalescer).
+    Restituisce None se il messaggio è stato unito al turno guidato da un'altra richiesta.
+    """
+    if not message_coalescer:
+        return process_message(incoming_msg, from_number, to_number, user_name)
+    burst = message_coalescer.join((from_number, to_number), incoming_msg)
+    if burst is None:
+        print("🧩 Messaggio unito al turno in attesa dello stesso utente")
+        return None
+    with burst:
+        return process_message(burst.text, from_number, to_number, user_name, received_at=burst.processing_at)
+
+def inbound_done(message_sid):
+    """True se la deduplica registra il messaggio come già elaborato."""
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return False
+    try:
+        return inbound_dedupe.is_done(db.inbound_messages, message_sid)
+    except Exception as e:
+        print(f"⚠️ Deduplica MessageSid non disponibile, elaboro comunque: {e}")
+        return False
+
+def handle_queued_message(job):
+    """Elabora un messaggio preso dalla coda e recapita la risposta."""
+    # Job ripreso da un altro worker: se la risposta è già partita non va rifatto
+    if job.get('deliveries', 1) > 1 and inbound_done(job.get('message_sid')):
+        print(f"♻️ Job {job.get('message_sid')} già elaborato: non lo rieseguo")
+        return
+    try:
+        reply = process_burst(job['body'], job['from_number'], job['to_number'], job['user_name'])
+    except Exception:
+        release_inbound(job.get('message_sid'))
+        raise
+    if reply is not None:
+        send_reply(from_number=job['to_number'], to_number=job['from_number'], message=reply)
+    complete_inbound(job.get('message_sid'), reply)
+
+message_queue = create_queue(
+    os.getenv("WEBHOOK_QUEUE_BACKEND", "thread"),
+    handle_queued_message,
+    workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+    collection=db.inbound_jobs
+) if ASYNC_WEBHOOK else None
+
+# Notifiche push di Google Calendar: attive solo se CALENDAR_WEBHOOK_URL è impostato
+calendar_watch = CalendarWatchManager(db.calendar_channels, db.calendar_changes)
+calendar_watch.add_change_listener(bot_tools.invalidate_calendar_availability)
+
+# Statistiche già raccolte dai moduli, esposte su /metrics accanto agli istogrammi di latenza
+metrics.register_stats("remindly_business_cache", "Cache delle configurazioni business", lambda: dict(bot_tools.business_configs.stats, size=len(bot_tools.business_configs)), gauges=("size",))
+metrics.register_stats("remindly_intent_router", "Percorso veloce senza modello", lambda: intent_router.stats, label_name="intent")
+metrics.register_stats("remindly_calendar_registry", "CalendarService in memoria per business", lambda: dict(bot_tools.calendar_services.stats, size=len(bot_tools.calendar_services)), gauges=("size",))
+metrics.register_stats("remindly_calendar_mirror", "Mirror locale dei calendari", bot_tools.calendar_mirror_stats, gauges=("mirrors", "calendars", "events"))
+metrics.register_stats("remindly_inbound_dedupe", "Consegne Twilio per MessageSid", lambda: inbound_dedupe.stats)
+metrics.register_stats("remindly_message_coalescer", "Messaggi ravvicinati uniti in un turno", lambda: message_coalescer.pending_stats() if message_coalescer else {}, gauges=("users",))
+metrics.register_stats("remindly_dependency", "Chiamate a OpenAI e Google Calendar", resilience.stats, label_name="dependency", gauges=("open",))
+metrics.register_stats("remindly_calendar_watch", "Notifiche push di Google Calendar", lambda: calendar_watch.stats)
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    start_time = time.time()
-    final_response_text = "Mi dispiace, non sono riuscito a elaborare la tua richiesta. Potresti riprovare a scriverla in modo diverso?"
-    
+    inbound = message_pipeline.parse_webhook(request.values)
+    if not inbound:
+        return create_twilio_response(message_pipeline.INVALID_MESSAGE_REPLY)
+
+    calendar_watch.ensure_renewer(bot_tools.get_calendar_service)
+
+    # Consegna ripetuta da Twilio: risposta già pronta, oppure ack vuoto se l'elaborazione è in corso
+    message_sid = inbound["message_sid"]
+    previous = claim_inbound(message_sid, inbound["from_number"], inbound["to_number"])
+    if previous is not None:
+        # In modalità coda la risposta è già partita via REST
+        reply = message_pipeline.duplicate_reply(previous, reply_sent_separately=bool(message_queue))
+        return create_twilio_response(reply) if reply is not None else create_empty_twilio_response()
+
+    if message_queue:
+        if message_queue.enqueue(inbound):
+            return create_empty_twilio_response()
+        print("⚠️ Coda piena: elaboro il messaggio in modo sincrono")
+
     try:
-        incoming_msg = request.values.get('Body', '').strip()
-        from_number = request.values.get('From', '')
-        to_number = request.values.get('To', '')
-        user_name = request.values.get('ProfileName', 'Cliente')
-
-        if not all([incoming_msg, from_number, to_number]):
-            return create_twilio_response("Errore nel messaggio ricevuto.")
-
-        business = db.businesses.find_one({"twilio_phone_number": to_number})
-        if not business: 
-            return create_twilio_response("Questo numero non è configurato per le prenotazioni.")
-        
-        business_id = business['_id']
-        print(f"✅ Richiesta per: {business.get('business_name')}")
-
-        conversation = db.conversations.find_one({"user_id": from_number, "business_id": business_id})
-        messages_history = conversation.get('messages', [])[-6:] if conversation else [] # Aumentata la cronologia
-
-        # Estrae i servizi per il prompt
-        services_list = []
-        services_data = business.get("services")
-        if isinstance(services_data, list): services_list = services_data
-        elif isinstance(services_data, str) and services_data.strip(): services_list = json.loads(services_data)
-        service_names = [s.get('name') for s in services_list if s.get('name')]
-        services_prompt_part = f"I servizi disponibili sono: {', '.join(service_names)}." if service_names else ""
-
-        system_prompt = f"""
-Sei un assistente AI per '{business.get('business_name')}', la tua specialità è prenotare appuntamenti in modo efficiente e naturale.
-Data e ora attuali: {datetime.now().strftime('%Y-%m-%d %H:%M')}.
-
-**MEMORIA E CONTESTO (REGOLA FONDAMENTALE):**
-- **Ricorda sempre i messaggi precedenti!** Se l'utente ha già specificato un servizio (es. "taglio capelli") e poi dice "il prima possibile", devi capire che sta chiedendo il primo orario per il servizio di taglio. NON chiedere di nuovo il servizio.
-- **Deduci il servizio:** Se l'utente chiede "per tagliare i capelli", devi associarlo al servizio più pertinente (es. "Taglio" o "Taglio uomo") e usarlo per la funzione `get_next_available_slot`.
-- **Riempi le informazioni mancanti:** Il tuo obiettivo è raccogliere `service_name`, `date` e `time`. Usa la conversazione per ottenere le informazioni una per una. Se hai già il servizio, chiedi la data. Se hai entrambi, propon gli orari.
-
-**FLUSSO DI LAVORO:**
-1.  L'utente esprime un'intenzione (es. "vorrei un appuntamento").
-2.  Identifica il `service_name` dalla sua richiesta. Se non è chiaro, chiediglielo.
-3.  Una volta ottenuto il servizio, cerca la disponibilità usando `get_next_available_slot` (se non dà una data) o `get_available_slots` (se la dà).
-4.  Proponi gli orari all'utente.
-5.  Quando l'utente conferma un orario, e SOLO ALLORA, usa `create_or_update_booking`.
-
-{services_prompt_part}
-Sii sempre conciso e vai dritto al punto.
-"""
-        
-        api_messages = [{"role": "system", "content": system_prompt}] + messages_history + [{"role": "user", "content": incoming_msg}]
-
-        for i in range(3): # Aumentato a 3 iterazioni per conversazioni più complesse
-            response = openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=api_messages, 
-                tools=tools, 
-                tool_choice="auto",
-                temperature=0.0
-            )
-            response_message = response.choices[0].message
-
-            if not response_message.tool_calls:
-                final_response_text = response_message.content
-                break
-            
-            api_messages.append(response_message)
-            tool_calls = response_message.tool_calls
-
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                function_args.update({'business_id': business_id, 'user_id': from_number, 'user_name': user_name})
-                
-                print(f"🛠️ Iter. {i+1}: Eseguo {function_name}({function_args.get('service_name', '')}, {function_args.get('date', '')})")
-                
-                function_to_call = getattr(bot_tools, function_name)
-                function_response = function_to_call(**function_args)
-                
-                api_messages.append({
-                    "tool_call_id": tool_call.id, 
-                    "role": "tool",
-                    "name": function_name, 
-                    "content": str(function_response),
-                })
-        
-        # Chiamata finale per generare una risposta testuale basata sul risultato dei tool
-        if response_message.tool_calls:
-            final_response = openai_client.chat.completions.create(
-                model="gpt-4o-mini", 
-                messages=api_messages,
-                temperature=0.1
-            )
-            final_response_text = final_response.choices[0].message.content
+        reply = process_burst(inbound["body"], inbound["from_number"], inbound["to_number"], inbound["user_name"])
+    except Exception:
+        release_inbound(message_sid)
+        raise
+    complete_inbound(message_sid, reply)
+    # Messaggio unito al turno di una richiesta precedente: risponde quella
+    return create_twilio_response(reply) if reply is not None else create_empty_twilio_response()
 
+@app.route('/calendar/notifications', methods=['POST'])
+def calendar_notifications():
+    """Riceve le notifiche events.watch di Google Calendar. Rispondiamo sempre 200 per non far ripetere l'invio."""
+    calendar_watch.ensure_renewer(bot_tools.get_calendar_service)
+    try:
+        calendar_watch.handle_notification(request.headers)
     except Exception as e:
-        print(f"💥 ERRORE GLOBALE nel webhook: {e}\n{traceback.format_exc()}")
-        final_response_text = "Si è verificato un errore generale. Il nostro team è stato notificato. Riprova tra qualche istante."
+        print(f"❌ Errore notifica calendario: {e}")
+    return Response(status=200)
 
-    # Salvataggio conversazione (logica invariata)
+@app.route('/reminders/status', methods=['POST'])
+def reminder_status():
+    """Status callback di Twilio per i promemoria (REMINDER_STATUS_CALLBACK_URL): registra quelli non recapitati."""
     try:
-        updated_history = messages_history + [
-            {"role": "user", "content": incoming_msg},
-            {"role": "assistant", "content": final_response_text}
-        ]
-        db.conversations.update_one(
-            {"user_id": from_number, "business_id": business_id},
-            {"$set": {"messages": updated_history[-8:], "last_interaction": datetime.now().isoformat()}},
-            upsert=True
+        if reminders.record_delivery_status(db.bookings, request.values):
+            print(f"⚠️ Promemoria {request.values.get('MessageSid')} non recapitato: {request.values.get('MessageStatus')}")
+    except Exception as e:
+        print(f"❌ Errore stato promemoria: {e}")
+    return Response(status=200)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE, status=200)
+
+def create_chat_completion(**kwargs):
+    """chat.completions con timeout entro il tempo del messaggio, retry e circuit breaker."""
+    with metrics.span("llm", "chat.completions"):
+        return resilience.call(
+            "openai", lambda timeout: openai_client.chat.completions.create(timeout=timeout, **kwargs),
+            resilience.is_transient_openai_error, resilience.OPENAI_TIMEOUT_SECONDS, min_seconds=resilience.LLM_MIN_SECONDS
         )
+
+def generate_model_reply(api_messages, turn):
+    """Ciclo modello + tool: restituisce il testo della risposta e registra i tool eseguiti nel turno."""
+    for iteration in range(1, message_pipeline.MAX_TOOL_ITERATIONS + 2):
+        response = create_chat_completion(**message_pipeline.model_request(api_messages, iteration))
+        tool_calls = message_pipeline.read_model_response(response, api_messages, iteration)
+        if tool_calls is None:
+            return message_pipeline.reply_text(response)
+        # Tool indipendenti dello stesso turno in parallelo, risultati nell'ordine originale
+        tool_messages = run_tool_calls(tool_calls, bot_tools, turn.tool_context(), iteration=iteration)
+        turn.add_tool_results(api_messages, tool_calls, tool_messages)
+
+def process_message(incoming_msg, from_number, to_number, user_name, received_at=None):
+    """
+    Pipeline completa di un messaggio in arrivo: restituisce il testo della risposta.
+    received_at: time.monotonic() da cui contare il tempo massimo (di default adesso), es. l'avvio della raffica.
+    """
+    with message_pipeline.message_scope(incoming_msg, received_at):
+        return _process_message(incoming_msg, from_number, to_number, user_name)
+
+def _process_message(incoming_msg, from_number, to_number, user_name):
+    turn = message_pipeline.MessageTurn(incoming_msg, from_number, user_name)
+    try:
+        business = bot_tools.business_configs.get_by_phone(to_number)
+        if not business:
+            return turn.unknown_business()
+        turn.start(business)
+
+        # Solo gli ultimi messaggi: la proiezione evita di trasferire l'intera cronologia
+        turn.set_conversation(load_conversation(db.conversations, from_number, turn.business_id))
+
+        # Estrae i servizi per il prompt (già parsati nella cache)
+        config, _ = bot_tools.business_configs.get_config(turn.business_id)
+
+        # Intenti frequenti riconosciuti con regole: risposta diretta senza chiamare il modello
+        fast_reply = intent_router.route(
+            incoming_msg, turn.business_id, from_number, user_name, config, turn.history, bot_tools,
+            tool_events=turn.tool_events
+        ) if INTENT_ROUTER and config else None
+
+        if fast_reply is not None:
+            turn.fast_reply(fast_reply)
+        else:
+            turn.model_reply(generate_model_reply(turn.model_prompt(business, config), turn))
+    except Exception as e:
+        turn.fail(e)
+
+    # Salvataggio conversazione: append atomico, il limite di cronologia lo applica MongoDB
+    try:
+        messages, new_state = turn.conversation_update()
+        append_messages(db.conversations, from_number, turn.business_id, messages, state=new_state)
     except Exception as e:
         print(f"⚠️ Errore salvataggio DB (non critico): {e}")
 
-    print(f"📤 Risposta finale: '{final_response_text[:80]}...'")
-    return create_twilio_response(final_response_text)
+    return turn.finish()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,266 @@
+# async_app.py - Pipeline /webhook nativa asyncio (ASGI)
+#
+# Avvio: uvicorn async_app:app --host 0.0.0.0 --port $PORT
+# Un solo processo gestisce centinaia di conversazioni in parallelo mentre attende il
+# modello: AsyncOpenAI, motor per MongoDB e httpx per Google Calendar non bloccano il loop.
+
+import os
+from urllib.parse import parse_qs
+from wsgiref.headers import Headers
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from twilio.twiml.messaging_response import MessagingResponse
+
+load_dotenv()
+
+import async_bot_tools
+import inbound_dedupe
+import intent_router
+import message_pipeline
+import metrics
+import reminders
+import resilience
+from message_coalescer import MESSAGE_COALESCE_SECONDS, AsyncMessageCoalescer
+from async_database import async_db_connection
+from calendar_watch import CalendarWatchManager
+from conversation_store import aappend_messages, aload_conversation
+from tool_dispatcher import arun_tool_calls
+
+adb = async_db_connection
+# I retry verso OpenAI li gestisce resilience, entro il tempo del messaggio
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+INBOUND_DEDUPE = os.getenv("INBOUND_DEDUPE", "1") == "1"
+# Messaggi ravvicinati dello stesso utente uniti in un solo turno (opzionale: MESSAGE_COALESCE_SECONDS > 0)
+message_coalescer = AsyncMessageCoalescer() if MESSAGE_COALESCE_SECONDS > 0 else None
+
+metrics.register_stats("remindly_business_cache", "Cache delle configurazioni business", lambda: dict(async_bot_tools.business_configs.stats, size=len(async_bot_tools.business_configs)), gauges=("size",))
+metrics.register_stats("remindly_calendar_registry", "CalendarService in memoria per business", lambda: dict(async_bot_tools.calendar_services.stats, size=len(async_bot_tools.calendar_services)), gauges=("size",))
+metrics.register_stats("remindly_inbound_dedupe", "Consegne Twilio per MessageSid", lambda: inbound_dedupe.stats)
+metrics.register_stats("remindly_message_coalescer", "Messaggi ravvicinati uniti in un turno", lambda: message_coalescer.pending_stats() if message_coalescer else {}, gauges=("users",))
+metrics.register_stats("remindly_dependency", "Chiamate a OpenAI e Google Calendar", resilience.stats, label_name="dependency", gauges=("open",))
+metrics.register_stats("remindly_intent_router", "Percorso veloce senza modello", lambda: intent_router.stats, label_name="intent")
+
+# Notifiche push di Google Calendar (CALENDAR_WEBHOOK_URL): qui non c'è un mirror da invalidare, la
+# modifica viene registrata in calendar_changes per i worker che ne hanno uno. Il rinnovo dei canali
+# gira nei worker Flask (app.py), che hanno i client Calendar sincroni.
+calendar_watch = CalendarWatchManager(adb.calendar_channels, adb.calendar_changes)
+metrics.register_stats("remindly_calendar_watch", "Notifiche push di Google Calendar", lambda: calendar_watch.stats)
+
+
+def twilio_response_body(message):
+    resp = MessagingResponse()
+    resp.message(message)
+    return str(resp)
+
+
+async def create_chat_completion(**kwargs):
+    """chat.completions con timeout entro il tempo del messaggio, retry e circuit breaker."""
+    with metrics.span("llm", "chat.completions"):
+        return await resilience.acall(
+            "openai", lambda timeout: openai_client.chat.completions.create(timeout=timeout, **kwargs),
+            resilience.is_transient_openai_error, resilience.OPENAI_TIMEOUT_SECONDS, min_seconds=resilience.LLM_MIN_SECONDS
+        )
+
+
+async def generate_model_reply(api_messages, turn):
+    """Come in app.py: ciclo modello + tool, con i tool asyncio di async_bot_tools."""
+    for iteration in range(1, message_pipeline.MAX_TOOL_ITERATIONS + 2):
+        response = await create_chat_completion(**message_pipeline.model_request(api_messages, iteration))
+        tool_calls = message_pipeline.read_model_response(response, api_messages, iteration)
+        if tool_calls is None:
+            return message_pipeline.reply_text(response)
+        # Tool indipendenti dello stesso turno in parallelo, risultati nell'ordine originale
+        tool_messages = await arun_tool_calls(tool_calls, async_bot_tools, turn.tool_context(), iteration=iteration)
+        turn.add_tool_results(api_messages, tool_calls, tool_messages)
+
+
+async def process_message(incoming_msg, from_number, to_number, user_name, received_at=None):
+    """
+    Pipeline completa di un messaggio in arrivo: restituisce il testo della risposta.
+    received_at: time.monotonic() da cui contare il tempo massimo (di default adesso), es. l'avvio della raffica.
+    """
+    # Ogni richiesta gira nel proprio task, quindi traccia e tempo massimo (contextvars) non si mescolano con le altre
+    with message_pipeline.message_scope(incoming_msg, received_at):
+        return await _process_message(incoming_msg, from_number, to_number, user_name)
+
+
+async def _process_message(incoming_msg, from_number, to_number, user_name):
+    turn = message_pipeline.MessageTurn(incoming_msg, from_number, user_name)
+    try:
+        business = await async_bot_tools.business_configs.aget_by_phone(to_number)
+        if not business:
+            return turn.unknown_business()
+        turn.start(business)
+
+        turn.set_conversation(await aload_conversation(adb.conversations, from_number, turn.business_id))
+
+        config, _ = await async_bot_tools.business_configs.aget_config(turn.business_id)
+
+        # Intenti frequenti riconosciuti con regole: risposta diretta senza chiamare il modello
+        fast_reply = await intent_router.aroute(
+            incoming_msg, turn.business_id, from_number, user_name, config, turn.history, async_bot_tools,
+            tool_events=turn.tool_events
+        ) if INTENT_ROUTER and config else None
+
+        if fast_reply is not None:
+            turn.fast_reply(fast_reply)
+        else:
+            turn.model_reply(await generate_model_reply(turn.model_prompt(business, config), turn))
+    except Exception as e:
+        turn.fail(e)
+
+    try:
+        messages, new_state = turn.conversation_update()
+        await aappend_messages(adb.conversations, from_number, turn.business_id, messages, state=new_state)
+    except Exception as e:
+        print(f"⚠️ Errore salvataggio DB (non critico): {e}")
+
+    return turn.finish()
+
+
+async def process_burst(incoming_msg, from_number, to_number, user_name):
+    """Come in app.py: None se il messaggio è stato unito al turno guidato da un'altra richiesta."""
+    if not message_coalescer:
+        return await process_message(incoming_msg, from_number, to_number, user_name)
+    burst = await message_coalescer.join((from_number, to_number), incoming_msg)
+    if burst is None:
+        print("🧩 Messaggio unito al turno in attesa dello stesso utente")
+        return None
+    async with burst:
+        return await process_message(burst.text, from_number, to_number, user_name, received_at=burst.processing_at)
+
+
+async def claim_inbound(message_sid, from_number, to_number):
+    """None se il messaggio va elaborato, altrimenti il documento della consegna precedente (vedi inbound_dedupe)."""
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return None
+    try:
+        return await inbound_dedupe.aclaim(adb.inbound_messages, message_sid, from_number, to_number)
+    except Exception as e:
+        print(f"⚠️ Deduplica MessageSid non disponibile, elaboro comunque: {e}")
+        return None
+
+
+async def complete_inbound(message_sid, reply):
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return
+    try:
+        await inbound_dedupe.acomplete(adb.inbound_messages, message_sid, reply)
+    except Exception as e:
+        print(f"⚠️ Errore salvataggio risposta per {message_sid}: {e}")
+
+
+async def release_inbound(message_sid):
+    if not message_pipeline.dedupe_enabled(INBOUND_DEDUPE, message_sid):
+        return
+    try:
+        await inbound_dedupe.arelease(adb.inbound_messages, message_sid)
+    except Exception as e:
+        print(f"⚠️ Errore rilascio {message_sid}: {e}")
+
+
+async def webhook(form):
+    inbound = message_pipeline.parse_webhook(form)
+    if not inbound:
+        return twilio_response_body(message_pipeline.INVALID_MESSAGE_REPLY)
+
+    # Consegna ripetuta da Twilio: risposta già pronta, oppure ack vuoto se l'elaborazione è in corso
+    message_sid = inbound["message_sid"]
+    previous = await claim_inbound(message_sid, inbound["from_number"], inbound["to_number"])
+    if previous is not None:
+        reply = message_pipeline.duplicate_reply(previous)
+        return twilio_response_body(reply) if reply is not None else str(MessagingResponse())
+
+    try:
+        reply = await process_burst(inbound["body"], inbound["from_number"], inbound["to_number"], inbound["user_name"])
+    except Exception:
+        await release_inbound(message_sid)
+        raise
+    await complete_inbound(message_sid, reply)
+    # Messaggio unito al turno di una richiesta precedente: risponde quella
+    return twilio_response_body(reply) if reply is not None else str(MessagingResponse())
+
+
+async def calendar_notifications(headers):
+    """Come in app.py: notifiche events.watch di Google Calendar, si risponde sempre 200."""
+    try:
+        await calendar_watch.ahandle_notification(headers)
+    except Exception as e:
+        print(f"❌ Errore notifica calendario: {e}")
+
+
+async def reminder_status(form):
+    """Come in app.py: registra i promemoria che Twilio segnala come non recapitati."""
+    try:
+        if await reminders.arecord_delivery_status(adb.bookings, form):
+            print(f"⚠️ Promemoria {form.get('MessageSid')} non recapitato: {form.get('MessageStatus')}")
+    except Exception as e:
+        print(f"❌ Errore stato promemoria: {e}")
+
+
+async def _read_form(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return {key: values[0] for key, values in parse_qs(body.decode('utf-8'), keep_blank_values=True).items()}
+
+
+async def _send(send, status, body, content_type='text/xml'):
+    payload = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(payload)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await adb.ping()
+                if os.getenv("ENSURE_INDEXES", "1") == "1":
+                    await adb.ensure_indexes()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': f"Impossibile connettersi a MongoDB: {e}"})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if async_bot_tools._calendar_client:
+                await async_bot_tools._calendar_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """Applicazione ASGI minimale: POST /webhook, /calendar/notifications e /reminders/status, GET /metrics, come la versione Flask."""
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/metrics' and scope['method'] == 'GET':
+        return await _send(send, 200, metrics.render(), metrics.PROMETHEUS_CONTENT_TYPE)
+
+    if scope['path'] == '/calendar/notifications' and scope['method'] == 'POST':
+        await calendar_notifications(Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]))
+        return await _send(send, 200, '', 'text/plain')
+
+    if scope['path'] == '/reminders/status' and scope['method'] == 'POST':
+        await reminder_status(await _read_form(receive))
+        return await _send(send, 200, '', 'text/plain')
+
+    if scope['path'] != '/webhook':
+        return await _send(send, 404, 'Not Found', 'text/plain')
+    if scope['method'] != 'POST':
+        return await _send(send, 405, 'Method Not Allowed', 'text/plain')
+
+    form = await _read_form(receive)
+    await _send(send, 200, await webhook(form))
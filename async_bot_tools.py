@@ -0,0 +1,211 @@
+# async_bot_tools.py - Versioni asyncio dei tool di bot_tools
+#
+# Stessa logica e stessi messaggi (booking_logic), ma con motor e AsyncCalendarService:
+# nessuna chiamata blocca l'event loop.
+
+import os
+import traceback
+from datetime import datetime
+
+import booking_logic
+import slot_reservations
+import booking_store
+from async_calendar import AsyncCalendarClient, AsyncCalendarService
+from async_database import async_db_connection
+from business_cache import BusinessConfigCache
+from calendar_registry import CalendarServiceRegistry
+
+adb = async_db_connection
+business_configs = BusinessConfigCache(
+    adb.businesses,
+    ttl_seconds=int(os.getenv("BUSINESS_CACHE_TTL_SECONDS", "300")),
+    use_change_stream=os.getenv("BUSINESS_CACHE_CHANGE_STREAM", "1") == "1"
+)
+_calendar_client = None
+
+def get_calendar_client():
+    global _calendar_client
+    if _calendar_client is None and os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY"):
+        _calendar_client = AsyncCalendarClient(os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY"))
+    return _calendar_client
+
+def _build_calendar_service(business):
+    client = get_calendar_client()
+    if not business.get("google_calendar_id") or not client:
+        return None
+    return AsyncCalendarService(calendar_id=booking_logic.get_calendar_ids(business), client=client)
+
+calendar_services = CalendarServiceRegistry(_build_calendar_service)
+
+async def get_calendar_service(business_id):
+    return calendar_services.get(business_id, await business_configs.aget_by_id(business_id))
+
+async def _find_slots_for_service(business_id, config, selected_service, date):
+    request_date, error = booking_logic.validate_request_date(date)
+    if error: return None, error
+
+    calendar_service = await get_calendar_service(business_id)
+    if not calendar_service:
+        return None, "Il calendario non è configurato. Contatta l'assistenza."
+
+    available_slots = await calendar_service.get_available_slots(**booking_logic.slots_request(config, selected_service, date))
+    return booking_logic.filter_available_slots(request_date, available_slots, selected_service, date)
+
+async def _hold_proposed_slot(business_id, user_id, selected_service, date, slot):
+    if not user_id:
+        return
+    try:
+        await slot_reservations.areserve(
+            adb.pending_bookings, business_id, slot['calendar_ids'], user_id,
+            selected_service['name'], date, slot['start'], selected_service.get('duration', 60)
+        )
+    except Exception as e:
+        print(f"⚠️ Impossibile tenere lo slot proposto: {e}")
+
+async def get_available_slots(business_id: str, service_name: str, date: str, hold_time: str = None, user_id: str = None, **kwargs):
+    print(f"🔍 get_available_slots per '{service_name}' il {date}")
+    try:
+        config, error = await business_configs.aget_config(business_id)
+        if error: return error
+
+        selected_service = booking_logic.find_best_service_match(service_name, config)
+        if not selected_service:
+            return f"Servizio '{service_name}' non riconosciuto. Per favore, scegli tra: {booking_logic.service_names_text(config)}."
+
+        available_slots, error = await _find_slots_for_service(business_id, config, selected_service, date)
+        if error: return error
+
+        proposed = next((s for s in available_slots if s['start'] == hold_time), None) if hold_time else None
+        if proposed:
+            await _hold_proposed_slot(business_id, user_id, selected_service, date, proposed)
+        return booking_logic.format_slot_starts(available_slots)
+
+    except Exception as e:
+        traceback.print_exc()
+        return booking_logic.tool_error_message(e, "Si è verificato un errore imprevisto. Riprova a formulare la richiesta.")
+
+async def get_next_available_slot(business_id: str, service_name: str, **kwargs):
+    print(f"🔍 get_next_available_slot per '{service_name}'")
+    try:
+        config, error = await business_configs.aget_config(business_id)
+        if error: return error
+
+        selected_service = booking_logic.find_best_service_match(service_name, config)
+        if not selected_service:
+            return f"Per trovare il primo orario disponibile, dimmi quale servizio desideri tra: {booking_logic.service_names_text(config)}."
+
+        calendar_service = await get_calendar_service(business_id)
+        if not calendar_service:
+            return "Il calendario non è configurato. Contatta l'assistenza."
+
+        now = datetime.now()
+        first_available = await calendar_service.get_available_slots_range(
+            **booking_logic.next_slot_request(config, selected_service, calendar_service.timezone, now)
+        )
+        # Nessuna hold: chiedere il primo orario libero non è una proposta (vedi hold_time in get_available_slots)
+        return booking_logic.format_next_available(first_available, selected_service, now)
+
+    except Exception as e:
+        traceback.print_exc()
+        return booking_logic.tool_error_message(e, "Si è verificato un errore imprevisto. Riprova a formulare la richiesta.")
+
+async def create_or_update_booking(business_id: str, user_id: str, user_name: str, service_name: str, date: str, time: str, **kwargs):
+    print(f"📝 Creazione booking: {service_name} per {date} alle {time}")
+    try:
+        config, error = await business_configs.aget_config(business_id)
+        if error: return error
+
+        selected_service = booking_logic.find_best_service_match(service_name, config)
+        if not selected_service:
+            return f"Servizio '{service_name}' non riconosciuto. Impossibile prenotare. Scegli tra: {booking_logic.service_names_text(config)}."
+
+        calendar_service = await get_calendar_service(business_id)
+        if not calendar_service: return "Servizio calendario non configurato."
+        duration = selected_service.get('duration', 60)
+
+        hold = await slot_reservations.afind_hold(adb.pending_bookings, business_id, user_id, date, time, duration)
+        if hold:
+            print(f"🔒 Slot {date} {time} già tenuto per l'utente su {hold['calendar_id']}")
+        else:
+            available_slots, error = await _find_slots_for_service(business_id, config, selected_service, date)
+            if error:
+                return f"Impossibile verificare la disponibilità per il {date}. Motivo: {error}"
+            chosen_slot, error = booking_logic.pick_requested_slot(available_slots, time, date)
+            if error: return error
+
+            hold = await slot_reservations.areserve(
+                adb.pending_bookings, business_id, chosen_slot['calendar_ids'], user_id, selected_service['name'], date, time, duration
+            )
+            if not hold:
+                print(f"🚫 Slot {date} {time} tenuto da un altro cliente")
+                return booking_logic.slot_taken_message(date, time)
+
+        event_id = None
+        try:
+            event_id = await calendar_service.create_appointment(
+                **booking_logic.appointment_request(selected_service, hold['calendar_id'], user_id, user_name, date, time)
+            )
+        finally:
+            await slot_reservations.arelease(adb.pending_bookings, hold, booked=bool(event_id))
+
+        if not event_id:
+            return "Creazione appuntamento fallita. L'orario potrebbe essere stato appena occupato. Riprova."
+
+        try:
+            await booking_store.asave_booking(adb.bookings, booking_store.booking_document(
+                business_id, user_id, user_name, selected_service['name'], date, time, duration,
+                hold['calendar_id'], event_id, calendar_service.timezone
+            ))
+        except Exception as e:
+            print(f"❌ Errore salvataggio prenotazione {event_id}: {e}")
+
+        return booking_logic.booking_confirmed_message(selected_service, date, time)
+
+    except Exception as e:
+        traceback.print_exc()
+        return booking_logic.tool_error_message(e, "Si è verificato un errore imprevisto durante la prenotazione.")
+
+async def get_business_info(business_id: str, **kwargs):
+    try:
+        config, error = await business_configs.aget_config(business_id)
+        if error: return error
+
+        return booking_logic.format_business_info(config)
+
+    except Exception:
+        traceback.print_exc()
+        return "Non riesco a recuperare le informazioni al momento."
+
+async def get_next_booking(business_id: str, user_id: str, **kwargs):
+    """Prossima prenotazione dell'utente, senza toccarla: il percorso veloce la propone prima di cancellarla."""
+    try:
+        booking = await booking_store.anext_booking(adb.bookings, business_id, user_id)
+        if not booking:
+            return booking_logic.no_upcoming_booking_message()
+        return booking_logic.booking_summary(booking)
+    except Exception as e:
+        traceback.print_exc()
+        return booking_logic.tool_error_message(e, "Non riesco a recuperare la tua prenotazione al momento.")
+
+async def cancel_booking(business_id: str, user_id: str, date: str = None, time: str = None, **kwargs):
+    """date/time: appuntamento confermato dall'utente (percorso veloce); se il prossimo è un altro non si cancella nulla."""
+    print(f"🗑️ Cancellazione della prossima prenotazione di {user_id}")
+    try:
+        booking = await booking_store.anext_booking(adb.bookings, business_id, user_id)
+        if not booking:
+            return booking_logic.no_upcoming_booking_message()
+        if date and (booking['date'], booking['time']) != (date, time):
+            return booking_logic.booking_changed_message()
+
+        calendar_service = await get_calendar_service(business_id)
+        if not calendar_service or not await calendar_service.cancel_appointment(booking['event_id'], booking['calendar_id']):
+            return "Non sono riuscito a cancellare la prenotazione. Contatta direttamente il negozio."
+
+        await booking_store.amark_cancelled(adb.bookings, booking['_id'])
+        await slot_reservations.afree_slot(
+            adb.pending_bookings, business_id, booking['calendar_id'], booking['date'], booking['time'], booking['duration']
+        )
+        return booking_logic.booking_cancelled_message(booking)
+    except Exception as e:
+        traceback.print_exc()
+        return booking_logic.tool_error_message(e, "Non sono riuscito a cancellare la prenotazione. Contatta direttamente il negozio.")
@@ -0,0 +1,225 @@
+# async_calendar.py - Google Calendar non bloccante per la pipeline asyncio
+#
+# Stessa logica di CalendarService (classificazione eventi, motore slot), ma le chiamate
+# HTTP passano da httpx.AsyncClient verso le API REST di Calendar v3.
+
+import asyncio
+import json
+from urllib.parse import quote
+
+import httpx
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.oauth2.service_account import Credentials as ServiceCredentials
+
+import metrics
+import resilience
+from calendar_service import CALENDAR_TIMEOUT_SECONDS, TRANSIENT_HTTP_STATUSES, CalendarService
+
+GOOGLE_CALENDAR_API = "https://www.googleapis.com/calendar/v3"
+
+
+def is_transient_http_error(error):
+    """Come is_transient_google_error, per le eccezioni di httpx."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status in TRANSIENT_HTTP_STATUSES or (status == 403 and 'ateLimitExceeded' in error.response.text)
+    return isinstance(error, httpx.TransportError)
+
+
+class AsyncCalendarClient:
+    """Credenziali e connessioni HTTP condivise da tutti gli AsyncCalendarService del processo."""
+
+    def __init__(self, service_account_key, http_client=None, base_url=GOOGLE_CALENDAR_API):
+        creds_info = json.loads(service_account_key) if isinstance(service_account_key, str) and service_account_key.startswith('{') else service_account_key
+        self.credentials = ServiceCredentials.from_service_account_info(
+            creds_info, scopes=['https://www.googleapis.com/auth/calendar']
+        )
+        self.http_client = http_client or httpx.AsyncClient(timeout=10.0)
+        self.base_url = base_url
+        self._token_lock = asyncio.Lock()
+
+    async def _auth_headers(self):
+        if not self.credentials.valid:
+            async with self._token_lock:
+                if not self.credentials.valid:
+                    # Il refresh del token è sincrono ma raro (circa una volta l'ora)
+                    await asyncio.to_thread(self.credentials.refresh, GoogleAuthRequest())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def _send(self, method, path, timeout, **kwargs):
+        response = await self.http_client.request(
+            method, self.base_url + path, headers=await self._auth_headers(), timeout=timeout, **kwargs
+        )
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    async def request(self, method, path, **kwargs):
+        """Richiesta con timeout pari al tempo rimasto al messaggio, retry ed eventuale DependencyUnavailable."""
+        # La creazione di un evento non viene ritentata: una risposta persa non dice se è avvenuta
+        attempts = 1 if method == "POST" and path.endswith('/events') else resilience.RETRY_MAX_ATTEMPTS
+        # Nome della metrica senza gli id di calendario ed evento (es. "GET events", "POST freeBusy")
+        with metrics.span("calendar", f"{method} {'events' if '/events' in path else path.strip('/')}"):
+            return await resilience.acall(
+                "calendar", lambda timeout: self._send(method, path, timeout, **kwargs),
+                is_transient_http_error, CALENDAR_TIMEOUT_SECONDS, attempts=attempts
+            )
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+
+class AsyncCalendarService(CalendarService):
+    """
+    Versione asyncio di CalendarService: i metodi pubblici sono coroutine con la stessa
+    firma e lo stesso risultato. Più calendari vengono letti in parallelo.
+    """
+
+    def __init__(self, calendar_id=None, client=None):
+        super().__init__(calendar_id=calendar_id)
+        self.client = client
+
+    def _is_available(self):
+        return bool(self.client and self.calendar_ids)
+
+    def _events_path(self, calendar_id):
+        return f"/calendars/{quote(calendar_id, safe='')}/events"
+
+    async def _list_events(self, calendar_id, time_min, time_max):
+        events = []
+        params = {
+            "timeMin": time_min.isoformat(),
+            "timeMax": time_max.isoformat(),
+            "singleEvents": "true",
+            "orderBy": "startTime",
+        }
+        while True:
+            events_result = await self.client.request("GET", self._events_path(calendar_id), params=params)
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                return events
+            params = dict(params, pageToken=page_token)
+
+    async def _list_events_multi(self, calendar_ids, time_min, time_max):
+        results = await asyncio.gather(
+            *[self._list_events(calendar_id, time_min, time_max) for calendar_id in calendar_ids],
+            return_exceptions=True
+        )
+        events_by_calendar = {}
+        for index, (calendar_id, result) in enumerate(zip(calendar_ids, results)):
+            if isinstance(result, Exception):
+                if index == 0:
+                    raise result
+                print(f"⚠️ Calendario {calendar_id} non leggibile: {result}")
+                result = [self._unavailable_marker(time_min, time_max)]
+            events_by_calendar[calendar_id] = result
+        return events_by_calendar
+
+    async def _scan_dates(self, dates):
+        range_start, range_end = self._range_bounds(dates)
+        events_by_calendar = await self._list_events_multi(self.calendar_ids, range_start, range_end)
+        return self._build_days(dates, events_by_calendar)
+
+    async def scan_day(self, date_str):
+        if not self._is_available():
+            return None
+        try:
+            target_date = self._horizon_dates(date_str, 1)[0]
+            return (await self._scan_dates([target_date]))[target_date]
+        except Exception as e:
+            print(f"❌ Errore lettura calendario per il {date_str}: {e}")
+            return None
+
+    async def get_working_hours_for_date(self, date_str):
+        day_info = await self.scan_day(date_str)
+        if not day_info or day_info['closed'] or not day_info['hours']:
+            return None, None
+        return day_info['hours']
+
+    async def is_day_closed(self, date_str):
+        day_info = await self.scan_day(date_str)
+        return bool(day_info and day_info['closed'])
+
+    async def check_business_hours_override(self, date_str):
+        day_info = await self.scan_day(date_str)
+        if not day_info:
+            return None, None, None
+        if day_info['closed']:
+            return False, None, None
+        if day_info['hours']:
+            return True, day_info['hours'][0].hour, day_info['hours'][1].hour
+        return None, None, None
+
+    async def get_available_slots(self, date: str, duration_minutes: int, start_hour: int, end_hour: int, slot_interval: int = 30):
+        return (await self.get_day_overview(date, duration_minutes, start_hour, end_hour, slot_interval))[1]
+
+    async def get_day_overview(self, date: str, duration_minutes: int, start_hour: int, end_hour: int, slot_interval: int = 30):
+        if not self._is_available():
+            print("❌ Servizio calendar non disponibile")
+            return (None, None, None), []
+        try:
+            target_date = self._horizon_dates(date, 1)[0]
+            day_info = (await self._scan_dates([target_date]))[target_date]
+            return self._day_overview(target_date, day_info, duration_minutes, start_hour, end_hour, slot_interval)
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore ricerca slot: {e}")
+            return (None, None, None), []
+
+    async def get_available_slots_for_durations(self, date: str, durations, start_hour: int, end_hour: int, slot_interval: int = 30):
+        durations = sorted(set(durations))
+        if not self._is_available():
+            print("❌ Servizio calendar non disponibile")
+            return {duration: [] for duration in durations}
+        try:
+            target_date = self._horizon_dates(date, 1)[0]
+            day_info = (await self._scan_dates([target_date]))[target_date]
+            return self._slots_for_day_multi(target_date, day_info, durations, start_hour, end_hour, slot_interval)
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore ricerca slot: {e}")
+            return {duration: [] for duration in durations}
+
+    async def get_available_slots_range(self, start_date: str, days: int, duration_minutes: int, start_hour: int, end_hour: int,
+                                        slot_interval: int = 30, first_only: bool = False, not_before=None):
+        if not self._is_available():
+            print("❌ Servizio calendar non disponibile")
+            return []
+        try:
+            dates = self._horizon_dates(start_date, days)
+            classified = await self._scan_dates(dates)
+            return self._range_results(dates, classified, duration_minutes, start_hour, end_hour, slot_interval, first_only, not_before)
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore ricerca slot su intervallo: {e}")
+            return []
+
+    async def create_appointment(self, date, start_time, duration_minutes, customer_name, customer_phone, service_type="Appuntamento", notes="", calendar_id=None):
+        if not self._is_available(): return None
+        try:
+            _, _, event = self._appointment_event(date, start_time, duration_minutes, customer_name, customer_phone, service_type, notes)
+            calendar_id = calendar_id or self.calendar_ids[0]
+
+            created_event = await self.client.request("POST", self._events_path(calendar_id), json=event)
+            print(f"✅ Appuntamento creato con ID: {created_event.get('id')} su {calendar_id}")
+            return created_event.get('id')
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore creazione appuntamento: {e}")
+            return None
+
+    async def cancel_appointment(self, event_id, calendar_id=None):
+        if not self._is_available(): return False
+        try:
+            await self.client.request("DELETE", f"{self._events_path(calendar_id or self.calendar_ids[0])}/{quote(event_id, safe='')}")
+            print(f"✅ Appuntamento {event_id} cancellato")
+            return True
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore cancellazione: {e}")
+            return False
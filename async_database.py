@@ -0,0 +1,58 @@
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.server_api import ServerApi
+from db_indexes import INDEX_SPECS, missing_indexes
+from metrics import mongo_listener
+
+class AsyncMongoClientWrapper:
+    """Controparte asyncio (motor) di MongoClientWrapper, con le stesse collection."""
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(AsyncMongoClientWrapper, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, db_uri: str = None):
+        if hasattr(self, 'client') and self.client:
+            return
+
+        uri = db_uri or os.getenv("MONGO_URI")
+        if not uri:
+            raise Exception("ERRORE CRITICO: La variabile d'ambiente MONGO_URI non è stata impostata.")
+
+        # motor si collega al primo utilizzo: il ping avviene all'avvio dell'app (vedi async_app)
+        self.client = AsyncIOMotorClient(uri, server_api=ServerApi('1'), event_listeners=[mongo_listener])
+        db = self.client.remindly
+        self.businesses = db.businesses
+        self.conversations = db.conversations
+        self.customers = db.customers
+        self.bookings = db.bookings
+        self.pending_bookings = db.pending_bookings
+        self.inbound_jobs = db.inbound_jobs
+        self.inbound_messages = db.inbound_messages
+        self.calendar_channels = db.calendar_channels
+        self.calendar_changes = db.calendar_changes
+
+    async def ping(self):
+        await self.client.admin.command('ping')
+        print("--- CONNESSIONE ASYNC A MONGODB STABILITA CON SUCCESSO! ---")
+
+    async def ensure_indexes(self):
+        """Come MongoClientWrapper.ensure_indexes, con motor."""
+        all_present = True
+        for collection_name, models in INDEX_SPECS.items():
+            collection = getattr(self, collection_name)
+            try:
+                await collection.create_indexes(models)
+            except Exception as e:
+                print(f"⚠️ Impossibile creare gli indici di {collection_name}: {e}")
+            missing = missing_indexes(collection_name, await collection.index_information())
+            if missing:
+                all_present = False
+                print(f"❌ Indici mancanti su {collection_name}: {', '.join(missing)}")
+        if all_present:
+            print("✅ Indici MongoDB verificati")
+        return all_present
+
+async_db_connection = AsyncMongoClientWrapper()
@@ -0,0 +1,113 @@
+# bench_mirror.py - Ricerca slot dal mirror locale contro la lettura diretta da Google Calendar
+#
+# Usa la finta API di fake_calendar.py con una latenza simulata e misura le ricerche, le letture
+# incrementali dopo modifiche e cancellazioni e la risincronizzazione dopo un syncToken invalidato.
+# Che mirror e lettura diretta diano gli stessi slot lo verifica tests/test_calendar_mirror.py.
+# Uso: python bench_mirror.py [--calendars 3] [--events 300] [--latency-ms 80] [--queries 20]
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from calendar_mirror import MirroredCalendarService
+from calendar_service import CalendarService
+from fake_calendar import FakeCalendarAPI
+
+TIMEZONE = pytz.timezone('Europe/Rome')
+
+
+def random_events(calendars, events, days, seed):
+    rng = random.Random(seed)
+    today = datetime.now(TIMEZONE).date()
+    events_by_calendar = {}
+    for c in range(calendars):
+        calendar_events = []
+        for _ in range(events):
+            day = today + timedelta(days=rng.randrange(days))
+            start = TIMEZONE.localize(datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(8 * 60, 19 * 60, 15)))
+            end = start + timedelta(minutes=rng.choice([15, 30, 45, 60, 90]))
+            calendar_events.append({'summary': 'Appuntamento', 'start': {'dateTime': start.isoformat()}, 'end': {'dateTime': end.isoformat()}})
+        # Qualche evento "di sistema" sul calendario principale
+        if c == 0:
+            closed_day = today + timedelta(days=3)
+            calendar_events.append({'summary': 'CHIUSO', 'start': {'date': closed_day.isoformat()}, 'end': {'date': (closed_day + timedelta(days=1)).isoformat()}})
+            special_start = TIMEZONE.localize(datetime.combine(today + timedelta(days=5), datetime.min.time()) + timedelta(hours=10))
+            calendar_events.append({'summary': 'ORARI', 'start': {'dateTime': special_start.isoformat()}, 'end': {'dateTime': (special_start + timedelta(hours=6)).isoformat()}})
+        events_by_calendar[f"staff{c}"] = calendar_events
+    return events_by_calendar
+
+
+def make_service(service_class, api, calendar_ids):
+    calendar_service = service_class(calendar_id=calendar_ids)
+    calendar_service.service = api
+    return calendar_service
+
+
+def query_all(calendar_service, dates):
+    return [calendar_service.get_day_overview(d, 45, 9, 18) for d in dates]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calendars', type=int, default=3)
+    parser.add_argument('--events', type=int, default=300, help="eventi per calendario")
+    parser.add_argument('--days', type=int, default=30, help="giorni coperti dagli eventi")
+    parser.add_argument('--latency-ms', type=float, default=80, help="latenza simulata di ogni chiamata a Google")
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    api = FakeCalendarAPI(random_events(args.calendars, args.events, args.days, seed=42), latency_seconds=args.latency_ms / 1000)
+    calendar_ids = [f"staff{c}" for c in range(args.calendars)]
+    live = make_service(CalendarService, api, calendar_ids)
+    mirrored = make_service(MirroredCalendarService, api, calendar_ids)
+
+    today = datetime.now(TIMEZONE).date()
+    dates = [(today + timedelta(days=i % args.days)).isoformat() for i in range(args.queries)]
+
+    # Prima lettura: sincronizzazione completa del mirror
+    started = time.perf_counter()
+    mirrored.mirror.sync_all()
+    full_sync_time = time.perf_counter() - started
+
+    round_trips = api.round_trips
+    started = time.perf_counter()
+    query_all(live, dates)
+    live_time = time.perf_counter() - started
+    live_round_trips = api.round_trips - round_trips
+
+    round_trips = api.round_trips
+    started = time.perf_counter()
+    query_all(mirrored, dates)
+    mirror_time = time.perf_counter() - started
+    mirror_round_trips = api.round_trips - round_trips
+
+    # Modifiche fatte "da Google": il mirror le recupera con una lettura incrementale
+    new_event = api.add_event('staff0', {
+        'summary': 'Appuntamento', 'start': {'dateTime': TIMEZONE.localize(datetime.combine(today + timedelta(days=1), datetime.min.time()) + timedelta(hours=9)).isoformat()},
+        'end': {'dateTime': TIMEZONE.localize(datetime.combine(today + timedelta(days=1), datetime.min.time()) + timedelta(hours=12)).isoformat()},
+    })
+    api.delete_event('staff1', next(iter(api._events['staff1'])))
+    started = time.perf_counter()
+    mirrored.mirror.sync_all()
+    incremental_sync_time = time.perf_counter() - started
+
+    # syncToken invalidato da Google (410): risincronizzazione completa automatica
+    api.invalidate_sync_tokens()
+    api.delete_event('staff0', new_event['id'])
+    started = time.perf_counter()
+    mirrored.mirror.sync_all()
+    resync_time = time.perf_counter() - started
+
+    print(f"📐 {args.calendars} calendari × {args.events} eventi, latenza simulata {args.latency_ms:.0f} ms, {args.queries} ricerche")
+    print(f"📥 sincronizzazione completa iniziale: {full_sync_time * 1000:.1f} ms")
+    print(f"🐢 lettura diretta: {live_time / args.queries * 1000:.2f} ms per ricerca ({live_round_trips} chiamate)")
+    print(f"⚡ mirror:          {mirror_time / args.queries * 1000:.2f} ms per ricerca ({mirror_round_trips} chiamate)")
+    print(f"🔄 lettura incrementale: {incremental_sync_time * 1000:.1f} ms, risincronizzazione dopo il 410: {resync_time * 1000:.1f} ms")
+    print(f"🔁 sincronizzazioni: {mirrored.mirror.stats}")
+
+
+if __name__ == '__main__':
+    main()
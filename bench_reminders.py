@@ -0,0 +1,124 @@
+# bench_reminders.py - Promemoria per decine di migliaia di prenotazioni con più scheduler in parallelo
+#
+# Crea le prenotazioni in un database di prova sul MONGO_URI indicato (di default 'remindly_bench',
+# svuotato all'inizio; senza MONGO_URI usa mongomock in memoria), fa girare più ReminderScheduler
+# insieme con il finto invio di fake_twilio.py e verifica che ogni prenotazione riceva un solo
+# promemoria, nel rispetto del rate limit.
+# Uso: [MONGO_URI=...] python bench_reminders.py [--bookings 20000] [--schedulers 2] [--rate 400] [--latency-ms 50]
+
+import argparse
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+from db_indexes import INDEX_SPECS
+from fake_twilio import FakeTwilioSender
+from reminders import ReminderScheduler
+
+TEMPLATE_SID = "HXbench"
+
+
+def mongomock_database(db_name):
+    """Database mongomock in memoria, reso utilizzabile dagli scheduler che girano in parallelo."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("Imposta MONGO_URI (verrà usato il database di prova) oppure installa mongomock")
+    print("🧪 MONGO_URI non impostato: database mongomock in memoria")
+    # Le UpdateOne di pymongo recenti passano anche sort, che mongomock non conosce
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    mongomock.collection.BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+    # mongomock non è thread-safe: letture e scritture degli scheduler passano una alla volta
+    lock = threading.RLock()
+    for owner, name in ((mongomock.collection.Collection, "update_many"), (mongomock.collection.Collection, "bulk_write"),
+                        (mongomock.collection.Collection, "insert_many"), (mongomock.collection.Collection, "count_documents"),
+                        (mongomock.collection.Cursor, "_compute_results")):
+        original = getattr(owner, name)
+
+        def locked(self, *args, _original=original, **kwargs):
+            with lock:
+                return _original(self, *args, **kwargs)
+        setattr(owner, name, locked)
+    return mongomock.MongoClient()[db_name]
+
+
+def make_database(db_name):
+    uri = os.getenv("MONGO_URI")
+    database = MongoClient(uri)[db_name] if uri else mongomock_database(db_name)
+    for name in ("bookings", "businesses"):
+        database[name].drop()
+    database.bookings.create_indexes(INDEX_SPECS["bookings"])
+    return database
+
+
+def seed(database, bookings, businesses):
+    now = datetime.utcnow()
+    database.businesses.insert_many([
+        {"_id": f"business{b}", "business_name": f"Salone {b}", "twilio_phone_number": f"whatsapp:+3900000{b:04d}",
+         "reminder_content_sid": TEMPLATE_SID}
+        for b in range(businesses)
+    ])
+    documents = []
+    for i in range(bookings):
+        # Metà dovute adesso (entro 24 ore), metà oltre la finestra: non devono partire
+        start = now + timedelta(hours=2, seconds=i * 2) if i % 2 == 0 else now + timedelta(days=3, seconds=i)
+        documents.append({
+            "business_id": f"business{i % businesses}", "user_id": f"whatsapp:+39333{i:07d}", "user_name": f"Cliente {i}",
+            "service": "Taglio", "date": start.strftime('%Y-%m-%d'), "time": start.strftime('%H:%M'),
+            "start": start, "status": "confirmed" if i % 10 else "cancelled",
+            "reminder_status": "pending" if i % 10 else "cancelled",
+        })
+    for offset in range(0, len(documents), 5000):
+        database.bookings.insert_many(documents[offset:offset + 5000], ordered=False)
+    return sum(1 for i in range(bookings) if i % 2 == 0 and i % 10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--businesses', type=int, default=20)
+    parser.add_argument('--schedulers', type=int, default=2, help="processi scheduler simulati in parallelo")
+    parser.add_argument('--rate', type=float, default=400, help="messaggi al secondo per scheduler")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50, help="durata simulata di ogni chiamata a Twilio")
+    parser.add_argument('--db', default=os.getenv("BENCH_DB", "remindly_bench"))
+    args = parser.parse_args()
+
+    database = make_database(args.db)
+    expected = seed(database, args.bookings, args.businesses)
+    sender = FakeTwilioSender(latency_seconds=args.latency_ms / 1000)
+    schedulers = [
+        ReminderScheduler(database.bookings, database.businesses, sender, concurrency=args.concurrency, rate_per_second=args.rate)
+        for _ in range(args.schedulers)
+    ]
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=scheduler.run_once) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    per_user = Counter(message["to"] for message in sender.sent)
+    duplicates = sum(1 for count in per_user.values() if count > 1)
+    marked = database.bookings.count_documents({"reminder_status": "sent"})
+    ok = len(sender.sent) == expected == marked and not duplicates
+
+    print(f"{'✅' if ok else '❌'} {len(sender.sent)} promemoria (attesi {expected}, segnati inviati {marked}, duplicati {duplicates})")
+    print(f"   {elapsed:.1f}s con {args.schedulers} scheduler: {len(sender.sent) / elapsed:.0f} msg/s, "
+          f"~{len(sender.sent) / elapsed * 3600:.0f} all'ora, max {sender.max_in_flight} invii contemporanei")
+    for scheduler in schedulers:
+        print(f"   {scheduler.stats}")
+
+    for name in ("bookings", "businesses"):
+        database[name].drop()
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
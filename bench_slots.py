@@ -0,0 +1,97 @@
+# bench_slots.py - Micro-benchmark del motore slot (sweep) contro il vecchio scan slot × eventi
+#
+# Che le due implementazioni diano lo stesso risultato lo verifica tests/test_slot_engine.py.
+# Uso: python bench_slots.py [--events 40] [--calendars 3] [--step 5] [--runs 200]
+
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta, time as dtime
+
+import pytz
+
+import slot_engine
+
+TIMEZONE = pytz.timezone('Europe/Rome')
+
+
+def legacy_slots(target_date, busy_by_calendar, duration_minutes, start_hour, end_hour, slot_interval):
+    """Implementazione precedente: per ogni slot controlla tutti gli eventi e formatta con strftime."""
+    work_start = TIMEZONE.localize(datetime.combine(target_date, dtime(hour=start_hour)))
+    work_end = TIMEZONE.localize(datetime.combine(target_date, dtime(hour=end_hour)))
+    available_slots = []
+    current_time = work_start
+    slot_duration = timedelta(minutes=duration_minutes)
+    slot_step = timedelta(minutes=slot_interval)
+    while current_time + slot_duration <= work_end:
+        slot_end = current_time + slot_duration
+        free_calendars = [
+            calendar_id for calendar_id, busy_intervals in busy_by_calendar.items()
+            if all(current_time >= busy['end'] or slot_end <= busy['start'] for busy in busy_intervals)
+        ]
+        if free_calendars:
+            available_slots.append({'start': current_time.strftime('%H:%M'), 'end': slot_end.strftime('%H:%M'), 'calendar_ids': free_calendars})
+        current_time += slot_step
+    return available_slots
+
+
+def sweep_slots(busy_minutes, durations, start_hour, end_hour, slot_interval):
+    free = slot_engine.find_free_slots(start_hour * 60, end_hour * 60, busy_minutes, durations, slot_interval)
+    return {
+        duration: [
+            {'start': slot_engine.format_minutes(start), 'end': slot_engine.format_minutes(start + duration), 'calendar_ids': calendar_ids}
+            for start, calendar_ids in free[duration]
+        ]
+        for duration in durations
+    }
+
+
+def random_day(target_date, calendars, events, start_hour, end_hour, seed):
+    rng = random.Random(seed)
+    busy_dt, busy_min = {}, {}
+    for c in range(calendars):
+        calendar_id = f"staff{c}"
+        busy_dt[calendar_id], busy_min[calendar_id] = [], []
+        for _ in range(events):
+            start = rng.randrange(start_hour * 60, end_hour * 60 - 15, 5)
+            end = min(start + rng.choice([15, 30, 45, 60, 90]), end_hour * 60)
+            busy_min[calendar_id].append((start, end))
+            busy_dt[calendar_id].append({
+                'start': TIMEZONE.localize(datetime.combine(target_date, dtime(*divmod(start, 60)))),
+                'end': TIMEZONE.localize(datetime.combine(target_date, dtime(*divmod(end, 60)))),
+            })
+    return busy_dt, busy_min
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=40, help="eventi per calendario")
+    parser.add_argument('--calendars', type=int, default=3)
+    parser.add_argument('--step', type=int, default=5, help="passo degli slot in minuti")
+    parser.add_argument('--start-hour', type=int, default=8)
+    parser.add_argument('--end-hour', type=int, default=21)
+    parser.add_argument('--durations', default="30,45,60,90", help="durate dei servizi, separate da virgola")
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    target_date = datetime.now().date()
+    durations = [int(d) for d in args.durations.split(',')]
+    busy_dt, busy_min = random_day(target_date, args.calendars, args.events, args.start_hour, args.end_hour, seed=42)
+
+    legacy_time = timeit.timeit(
+        lambda: [legacy_slots(target_date, busy_dt, d, args.start_hour, args.end_hour, args.step) for d in durations],
+        number=args.runs
+    )
+    sweep_time = timeit.timeit(
+        lambda: sweep_slots(busy_min, durations, args.start_hour, args.end_hour, args.step),
+        number=args.runs
+    )
+
+    print(f"📐 {args.calendars} calendari × {args.events} eventi, passo {args.step} min, durate {durations}")
+    print(f"🐢 scan slot × eventi: {legacy_time / args.runs * 1000:.3f} ms per richiesta")
+    print(f"⚡ sweep:              {sweep_time / args.runs * 1000:.3f} ms per richiesta")
+    print(f"🚀 speedup: {legacy_time / sweep_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# booking_logic.py - Logica dei tool di prenotazione, senza I/O
+#
+# Condivisa tra bot_tools (sincrono) e async_bot_tools (asyncio): qui stanno validazioni
+# e messaggi per l'utente, mentre DB e Google Calendar restano nei due moduli chiamanti.
+
+import json
+from datetime import datetime
+
+import resilience
+
+NEXT_SLOT_HORIZON_DAYS = 7
+
+# Inizio dei messaggi di esito: conversation_state li usa per capire se il tool è riuscito
+BOOKING_CONFIRMED_PREFIX = "Perfetto, appuntamento confermato!"
+BOOKING_CANCELLED_PREFIX = "La tua prenotazione è stata cancellata"
+
+SERVICE_BUSY_MESSAGE = "In questo momento il sistema di prenotazione risponde lentamente. Riprova tra qualche minuto, per favore."
+
+
+def get_calendar_ids(business):
+    """Calendario principale del business seguito dagli eventuali calendari dello staff."""
+    calendar_ids = business.get("google_calendar_id")
+    calendar_ids = list(calendar_ids) if isinstance(calendar_ids, list) else [calendar_ids] if calendar_ids else []
+    for staff_calendar in business.get("staff_calendar_ids") or []:
+        if staff_calendar and staff_calendar not in calendar_ids:
+            calendar_ids.append(staff_calendar)
+    return calendar_ids
+
+
+def find_best_service_match(query: str, config: dict):
+    """Trova il servizio migliore con il matcher precompilato del business (alias, parole chiave, fuzzy)."""
+    return config["matcher"].match(query)
+
+
+def service_names_text(config):
+    return ", ".join([s['name'] for s in config["services"]])
+
+
+def validate_request_date(date):
+    """Restituisce (data, None) oppure (None, messaggio di errore per l'utente)."""
+    try:
+        request_date = datetime.strptime(date, '%Y-%m-%d').date()
+        if request_date < datetime.now().date():
+            return None, f"La data {date} è già passata. Scegli una data futura."
+        return request_date, None
+    except ValueError:
+        return None, f"Il formato della data '{date}' non è valido. Usa AAAA-MM-GG."
+
+
+def slots_request(config, selected_service, date):
+    """Argomenti per CalendarService.get_available_slots."""
+    start_hour, end_hour = config["booking_hours"]
+    return {
+        "date": date,
+        "duration_minutes": selected_service.get('duration', 60),
+        "start_hour": start_hour,
+        "end_hour": end_hour,
+    }
+
+
+def filter_available_slots(request_date, available_slots, selected_service, date):
+    """Scarta gli slot già passati di oggi. Restituisce (slot, None) oppure (None, messaggio)."""
+    if not available_slots:
+        return None, f"Mi dispiace, non ci sono orari disponibili per '{selected_service['name']}' il {date}."
+
+    if request_date == datetime.now().date():
+        future_slots = [s for s in available_slots if datetime.strptime(s['start'], '%H:%M').time() > datetime.now().time()]
+        if not future_slots:
+            return None, f"Non ci sono più orari disponibili per oggi per '{selected_service['name']}'. Prova domani."
+        available_slots = future_slots
+
+    return available_slots, None
+
+
+def format_slot_starts(available_slots):
+    return json.dumps([s['start'] for s in available_slots])
+
+
+def next_slot_request(config, selected_service, timezone, now):
+    """Argomenti per CalendarService.get_available_slots_range nella ricerca del primo slot libero."""
+    start_hour, end_hour = config["booking_hours"]
+    return {
+        "start_date": now.strftime('%Y-%m-%d'),
+        "days": NEXT_SLOT_HORIZON_DAYS,
+        "duration_minutes": selected_service.get('duration', 60),
+        "start_hour": start_hour,
+        "end_hour": end_hour,
+        "first_only": True,
+        "not_before": timezone.localize(now),
+    }
+
+
+def format_next_available(first_available, selected_service, now):
+    if first_available:
+        date_found, slots = first_available[0]
+        days_ahead = (datetime.strptime(date_found, '%Y-%m-%d').date() - now.date()).days
+        day_name = "Oggi" if days_ahead == 0 else "Domani" if days_ahead == 1 else f"il {date_found}"
+        return json.dumps({
+            "date": date_found,
+            "time": slots[0]['start'],
+            "message": f"Il primo orario disponibile per '{selected_service['name']}' è {day_name} alle {slots[0]['start']}."
+        })
+
+    return f"Non ho trovato disponibilità per '{selected_service['name']}' nei prossimi {NEXT_SLOT_HORIZON_DAYS} giorni. Vuoi provare a specificare una data più lontana?"
+
+
+def pick_requested_slot(available_slots, time, date):
+    """Restituisce (slot, None) se l'orario è libero, altrimenti (None, messaggio con alternative)."""
+    chosen_slot = next((s for s in available_slots if s['start'] == time), None)
+    if not chosen_slot:
+        starts = [s['start'] for s in available_slots]
+        alt = f"Scegli tra questi: {', '.join(starts[:4])}..." if starts else "Prova un altro giorno."
+        return None, f"L'orario delle {time} del {date} non è più disponibile. {alt}"
+    return chosen_slot, None
+
+
+def slot_taken_message(date, time):
+    return f"L'orario delle {time} del {date} è appena stato prenotato da un altro cliente. Vuoi che cerchi un altro orario?"
+
+
+def appointment_request(selected_service, calendar_id, user_id, user_name, date, time):
+    """Argomenti per CalendarService.create_appointment sul calendario riservato per lo slot."""
+    return {
+        "date": date,
+        "start_time": time,
+        "duration_minutes": selected_service.get('duration', 60),
+        "customer_name": user_name,
+        "customer_phone": user_id,
+        "service_type": selected_service.get('name'),
+        "calendar_id": calendar_id,
+    }
+
+
+def booking_confirmed_message(selected_service, date, time):
+    return f"{BOOKING_CONFIRMED_PREFIX} Ti aspetto per '{selected_service['name']}' il {date} alle {time}."
+
+
+def booking_cancelled_message(booking):
+    return f"{BOOKING_CANCELLED_PREFIX}: '{booking['service']}' il {booking['date']} alle {booking['time']}."
+
+
+def booking_summary(booking):
+    """Prenotazione trovata, come JSON (servizio, data, ora) da proporre per la cancellazione."""
+    return json.dumps({"service": booking['service'], "date": booking['date'], "time": booking['time']}, ensure_ascii=False)
+
+
+def booking_changed_message():
+    return "Il tuo prossimo appuntamento non è più quello che ti avevo indicato: non ho cancellato nulla. Dimmi quale vuoi disdire."
+
+
+def no_upcoming_booking_message():
+    return "Non trovo prenotazioni future a tuo nome. Se hai prenotato di persona, contatta direttamente il negozio."
+
+
+def tool_error_message(error, default):
+    """Messaggio di un tool finito in errore: se Calendar o OpenAI non rispondono in tempo lo diciamo chiaramente."""
+    return SERVICE_BUSY_MESSAGE if isinstance(error, resilience.DependencyUnavailable) else default
+
+
+def degraded_reply(tool_events):
+    """
+    Risposta senza modello quando il tempo del messaggio è finito o OpenAI non è raggiungibile.
+    Una prenotazione o cancellazione appena eseguita va comunque confermata all'utente.
+    """
+    for _, _, content in reversed(tool_events):
+        if str(content).startswith((BOOKING_CONFIRMED_PREFIX, BOOKING_CANCELLED_PREFIX)):
+            return content
+    return SERVICE_BUSY_MESSAGE
+
+
+def reminder_variables(booking, business_name):
+    """
+    Variabili del template WhatsApp approvato per i promemoria (content_variables di Twilio), ad es.
+    "Ciao {{1}}! Ti ricordiamo l'appuntamento per '{{2}}' da {{3}} il {{4}} alle {{5}}.
+    Se non puoi venire rispondi "annulla"."
+    """
+    return {
+        "1": booking.get('user_name') or "Cliente",
+        "2": booking['service'],
+        "3": business_name,
+        "4": booking['date'],
+        "5": booking['time'],
+    }
+
+
+def format_business_info(config):
+    business = config["business_info"]
+    services = config["services"]
+    start_h, end_h = config["booking_hours"]
+
+    services_text = "\n".join([f"- {s['name']} ({s['duration']} min)" for s in services])
+    return (
+        f"Ecco le informazioni su {business.get('business_name', 'questo business')}:\n"
+        f"📍 Indirizzo: {business.get('address', 'Non specificato')}\n"
+        f"🕒 Orari di riferimento: {business.get('opening_hours', f'dalle {start_h} alle {end_h}')}\n"
+        f"ℹ️ {business.get('description', '')}\n\n"
+        f"Servizi offerti:\n{services_text}"
+    )
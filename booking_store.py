@@ -0,0 +1,68 @@
+# booking_store.py - Prenotazioni confermate (collection bookings)
+#
+# Ogni appuntamento creato su Google Calendar viene salvato anche qui: start/end in UTC servono
+# alla cancellazione ("la mia prossima prenotazione") e allo scheduler dei promemoria (reminders),
+# che scorre le prenotazioni in arrivo con l'indice su reminder_status e start.
+
+from datetime import datetime, timedelta
+
+import pytz
+
+from reminders import initial_reminder_status
+
+
+def booking_document(business_id, user_id, user_name, service_name, date, time, duration_minutes,
+                     calendar_id, event_id, timezone):
+    local_start = timezone.localize(datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M'))
+    start = local_start.astimezone(pytz.utc).replace(tzinfo=None)
+    now = datetime.utcnow()
+    return {
+        "business_id": business_id,
+        "user_id": user_id,
+        "user_name": user_name,
+        "service": service_name,
+        "date": date,
+        "time": time,
+        "duration": duration_minutes,
+        "calendar_id": calendar_id,
+        "event_id": event_id,
+        "start": start,
+        "end": start + timedelta(minutes=duration_minutes),
+        "status": "confirmed",
+        "reminder_status": initial_reminder_status(start, now),
+        "created_at": now,
+    }
+
+
+def _upcoming_filter(business_id, user_id):
+    return {"business_id": business_id, "user_id": user_id, "status": "confirmed", "start": {"$gt": datetime.utcnow()}}
+
+
+def _cancel_update():
+    return {"$set": {"status": "cancelled", "reminder_status": "cancelled", "cancelled_at": datetime.utcnow()}}
+
+
+def save_booking(collection, booking):
+    """Salva la prenotazione e restituisce il suo _id."""
+    return collection.insert_one(booking).inserted_id
+
+
+def next_booking(collection, business_id, user_id):
+    """Prossima prenotazione confermata dell'utente presso il business, o None."""
+    return collection.find_one(_upcoming_filter(business_id, user_id), sort=[("start", 1)])
+
+
+def mark_cancelled(collection, booking_id):
+    collection.update_one({"_id": booking_id}, _cancel_update())
+
+
+async def asave_booking(collection, booking):
+    return (await collection.insert_one(booking)).inserted_id
+
+
+async def anext_booking(collection, business_id, user_id):
+    return await collection.find_one(_upcoming_filter(business_id, user_id), sort=[("start", 1)])
+
+
+async def amark_cancelled(collection, booking_id):
+    await collection.update_one({"_id": booking_id}, _cancel_update())
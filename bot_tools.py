@@ -1,117 +1,127 @@
-import json
-from datetime import datetime, timedelta
+from datetime import datetime
 from database import db_connection
-from calendar_service import CalendarService
+from calendar_service import CalendarService, shared_calendar_client
+from calendar_mirror import MirroredCalendarService
+from business_cache import BusinessConfigCache
+from calendar_registry import CalendarServiceRegistry
+import booking_logic
+import slot_reservations
+import booking_store
 import os
 import traceback
-from thefuzz import process
 
 db = db_connection
-calendar_services = {}
+# Disponibilità lette dal mirror locale sincronizzato con syncToken (CALENDAR_MIRROR=1; di default si legge
+# sempre da Google). Senza notifiche push (CALENDAR_WEBHOOK_URL) il mirror si riallinea prima di rispondere.
+CALENDAR_MIRROR = os.getenv("CALENDAR_MIRROR", "0") == "1"
+CALENDAR_PUSH_NOTIFICATIONS = bool(os.getenv("CALENDAR_WEBHOOK_URL"))
+business_configs = BusinessConfigCache(
+    db.businesses,
+    ttl_seconds=int(os.getenv("BUSINESS_CACHE_TTL_SECONDS", "300")),
+    use_change_stream=os.getenv("BUSINESS_CACHE_CHANGE_STREAM", "1") == "1"
+)
+
+def get_calendar_client():
+    """Client Google Calendar condiviso da tutti i business (credenziali, discovery e connessioni)."""
+    if not os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY"):
+        return None
+    try:
+        return shared_calendar_client(os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY"))
+    except Exception as e:
+        print(f"❌ Errore connessione Google Calendar: {e}")
+        return None
+
+def _build_calendar_service(business):
+    client = get_calendar_client() if business.get("google_calendar_id") else None
+    if not client:
+        return None
+    calendar_ids = booking_logic.get_calendar_ids(business)
+    if CALENDAR_MIRROR:
+        return MirroredCalendarService(calendar_id=calendar_ids, client=client, background_refresh=CALENDAR_PUSH_NOTIFICATIONS)
+    return CalendarService(calendar_id=calendar_ids, client=client)
+
+# Un CalendarService per business, limitato in numero e ricostruito se cambiano i calendari del business
+calendar_services = CalendarServiceRegistry(_build_calendar_service)
 
 def get_calendar_service(business_id):
-    if business_id not in calendar_services:
-        business = db.businesses.find_one({"_id": business_id})
-        if business and business.get("google_calendar_id") and os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY"):
-            calendar_id = business["google_calendar_id"]
-            service_account_key = os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY")
-            calendar_services[business_id] = CalendarService(
-                calendar_id=calendar_id, 
-                service_account_key=service_account_key
-            )
-    return calendar_services.get(business_id)
+    return calendar_services.get(business_id, business_configs.get_by_id(business_id))
+
+def invalidate_calendar_availability(business_id):
+    """Una modifica al business (o al suo calendario, segnalata dalle notifiche push di calendar_watch) rende obsoleto il mirror."""
+    services = calendar_services.values() if business_id is None else [calendar_services.get_cached(business_id)]
+    for calendar_service in services:
+        if isinstance(calendar_service, MirroredCalendarService):
+            calendar_service.mirror.invalidate()
+
+business_configs.add_invalidation_listener(invalidate_calendar_availability)
+
+def calendar_mirror_stats():
+    """Statistiche dei mirror di tutti i business, sommate (per /metrics); mirrors, calendars ed events sono istantanei."""
+    totals = {"mirrors": 0, "calendars": 0, "events": 0}
+    for calendar_service in calendar_services.values():
+        if isinstance(calendar_service, MirroredCalendarService):
+            totals["mirrors"] += 1
+            for key, value in list(calendar_service.mirror.stats.items()) + list(calendar_service.mirror.sizes().items()):
+                totals[key] = totals.get(key, 0) + value
+    return totals
 
 def _get_business_config(business_id):
-    """Helper unificato per recuperare configurazione, servizi e orari dal DB."""
-    business = db.businesses.find_one({"_id": business_id})
-    if not business:
-        return None, "Impossibile trovare le impostazioni del business."
-
-    # Carica e valida i servizi
-    services_data = business.get("services")
-    services = []
-    if isinstance(services_data, list):
-        services = services_data
-    elif isinstance(services_data, str) and services_data.strip():
-        try:
-            services = json.loads(services_data)
-        except json.JSONDecodeError:
-            return None, "Errore nella configurazione dei servizi."
-    if not services:
-        return None, "Nessun servizio è stato configurato per questo business."
-
-    # Carica e valida gli orari di base
-    booking_hours_str = business.get("booking_hours")
-    if not booking_hours_str or "-" not in booking_hours_str:
-        return None, "Gli orari di apertura non sono configurati correttamente."
+    """Helper unificato per recuperare configurazione, servizi e orari (dalla cache o dal DB)."""
+    return business_configs.get_config(business_id)
+
+def _find_best_service_match(query: str, config: dict):
+    """Trova il servizio migliore con il matcher precompilato del business (alias, parole chiave, fuzzy)."""
+    return booking_logic.find_best_service_match(query, config)
+
+def _find_slots_for_service(business_id, config, selected_service, date):
+    """
+    Calcola gli slot liberi (dict con 'start', 'end', 'calendar_ids') per un servizio già
+    riconosciuto. Restituisce (slot, None) oppure (None, messaggio di errore per l'utente).
+    """
+    request_date, error = booking_logic.validate_request_date(date)
+    if error: return None, error
+
+    calendar_service = get_calendar_service(business_id)
+    if not calendar_service:
+        return None, "Il calendario non è configurato. Contatta l'assistenza."
+
+    available_slots = calendar_service.get_available_slots(**booking_logic.slots_request(config, selected_service, date))
+    return booking_logic.filter_available_slots(request_date, available_slots, selected_service, date)
+
+def _hold_proposed_slot(business_id, user_id, selected_service, date, slot):
+    """Tiene per l'utente lo slot che gli stiamo proponendo; se non riesce la conferma rifarà la verifica."""
+    if not user_id:
+        return
     try:
-        start_hour, end_hour = map(int, booking_hours_str.split('-'))
-        booking_hours = (start_hour, end_hour)
-    except (ValueError, TypeError):
-        return None, "Il formato degli orari nel database non è valido."
-
-    config = {
-        "services": services,
-        "booking_hours": booking_hours,
-        "business_info": business
-    }
-    return config, None
-
-def _find_best_service_match(query: str, services: list):
-    """Trova il servizio migliore usando la ricerca fuzzy."""
-    if not query: return None
-    service_names = [s['name'] for s in services]
-    best_match, score = process.extractOne(query, service_names)
-    
-    # Imposta una soglia di confidenza per evitare match errati
-    if score >= 75:
-        return next((s for s in services if s['name'] == best_match), None)
-    return None
-
-def get_available_slots(business_id: str, service_name: str, date: str, **kwargs):
+        slot_reservations.reserve(
+            db.pending_bookings, business_id, slot['calendar_ids'], user_id,
+            selected_service['name'], date, slot['start'], selected_service.get('duration', 60)
+        )
+    except Exception as e:
+        print(f"⚠️ Impossibile tenere lo slot proposto: {e}")
+
+def get_available_slots(business_id: str, service_name: str, date: str, hold_time: str = None, user_id: str = None, **kwargs):
+    """hold_time: orario che verrà proposto all'utente (percorso veloce), da tenere per lui se libero."""
     print(f"🔍 get_available_slots per '{service_name}' il {date}")
     try:
         config, error = _get_business_config(business_id)
         if error: return error
         
-        selected_service = _find_best_service_match(service_name, config["services"])
+        selected_service = _find_best_service_match(service_name, config)
         if not selected_service:
-            service_names = ", ".join([s['name'] for s in config["services"]])
-            return f"Servizio '{service_name}' non riconosciuto. Per favore, scegli tra: {service_names}."
+            return f"Servizio '{service_name}' non riconosciuto. Per favore, scegli tra: {booking_logic.service_names_text(config)}."
 
-        try:
-            request_date = datetime.strptime(date, '%Y-%m-%d').date()
-            if request_date < datetime.now().date():
-                return f"La data {date} è già passata. Scegli una data futura."
-        except ValueError:
-            return f"Il formato della data '{date}' non è valido. Usa AAAA-MM-GG."
-
-        calendar_service = get_calendar_service(business_id)
-        if not calendar_service:
-            return "Il calendario non è configurato. Contatta l'assistenza."
+        available_slots, error = _find_slots_for_service(business_id, config, selected_service, date)
+        if error: return error
 
-        start_hour, end_hour = config["booking_hours"]
-        available_slots = calendar_service.get_available_slots(
-            date=date, 
-            duration_minutes=selected_service.get('duration', 60), 
-            start_hour=start_hour,
-            end_hour=end_hour
-        )
-
-        if not available_slots:
-            return f"Mi dispiace, non ci sono orari disponibili per '{selected_service['name']}' il {date}."
-        
-        if request_date == datetime.now().date():
-            future_slots = [s for s in available_slots if datetime.strptime(s['start'], '%H:%M').time() > datetime.now().time()]
-            if not future_slots:
-                return f"Non ci sono più orari disponibili per oggi per '{selected_service['name']}'. Prova domani."
-            available_slots = future_slots
-        
-        return json.dumps([s['start'] for s in available_slots])
+        proposed = next((s for s in available_slots if s['start'] == hold_time), None) if hold_time else None
+        if proposed:
+            _hold_proposed_slot(business_id, user_id, selected_service, date, proposed)
+        return booking_logic.format_slot_starts(available_slots)
 
     except Exception as e:
         traceback.print_exc()
-        return "Si è verificato un errore imprevisto. Riprova a formulare la richiesta."
+        return booking_logic.tool_error_message(e, "Si è verificato un errore imprevisto. Riprova a formulare la richiesta.")
 
 def get_next_available_slot(business_id: str, service_name: str, **kwargs):
     print(f"🔍 get_next_available_slot per '{service_name}'")
@@ -119,32 +129,25 @@ def get_next_available_slot(business_id: str, service_name: str, **kwargs):
         config, error = _get_business_config(business_id)
         if error: return error
         
-        selected_service = _find_best_service_match(service_name, config["services"])
+        selected_service = _find_best_service_match(service_name, config)
         if not selected_service:
-            service_names = ", ".join([s['name'] for s in config["services"]])
-            return f"Per trovare il primo orario disponibile, dimmi quale servizio desideri tra: {service_names}."
-
-        # Cerca slot per i prossimi 7 giorni
-        for i in range(7):
-            date_to_check = (datetime.now() + timedelta(days=i)).strftime('%Y-%m-%d')
-            slots_json = get_available_slots(business_id, selected_service['name'], date_to_check)
-            try:
-                slots = json.loads(slots_json)
-                if isinstance(slots, list) and slots:
-                    day_name = "Oggi" if i == 0 else "Domani" if i == 1 else f"il {date_to_check}"
-                    return json.dumps({
-                        "date": date_to_check,
-                        "time": slots[0],
-                        "message": f"Il primo orario disponibile per '{selected_service['name']}' è {day_name} alle {slots[0]}."
-                    })
-            except (json.JSONDecodeError, TypeError):
-                continue
-        
-        return f"Non ho trovato disponibilità per '{selected_service['name']}' nei prossimi 7 giorni. Vuoi provare a specificare una data più lontana?"
+            return f"Per trovare il primo orario disponibile, dimmi quale servizio desideri tra: {booking_logic.service_names_text(config)}."
+
+        calendar_service = get_calendar_service(business_id)
+        if not calendar_service:
+            return "Il calendario non è configurato. Contatta l'assistenza."
+
+        # Cerca slot per i prossimi 7 giorni con un'unica lettura del calendario
+        now = datetime.now()
+        first_available = calendar_service.get_available_slots_range(
+            **booking_logic.next_slot_request(config, selected_service, calendar_service.timezone, now)
+        )
+        # Nessuna hold: chiedere il primo orario libero non è una proposta (vedi hold_time in get_available_slots)
+        return booking_logic.format_next_available(first_available, selected_service, now)
 
     except Exception as e:
         traceback.print_exc()
-        return "Si è verificato un errore imprevisto. Riprova a formulare la richiesta."
+        return booking_logic.tool_error_message(e, "Si è verificato un errore imprevisto. Riprova a formulare la richiesta.")
 
 
 def create_or_update_booking(business_id: str, user_id: str, user_name: str, service_name: str, date: str, time: str, **kwargs):
@@ -153,68 +156,100 @@ def create_or_update_booking(business_id: str, user_id: str, user_name: str, ser
         config, error = _get_business_config(business_id)
         if error: return error
 
-        selected_service = _find_best_service_match(service_name, config["services"])
+        selected_service = _find_best_service_match(service_name, config)
         if not selected_service:
-            service_names = ", ".join([s['name'] for s in config["services"]])
-            return f"Servizio '{service_name}' non riconosciuto. Impossibile prenotare. Scegli tra: {service_names}."
-
-        # Validazione finale della disponibilità
-        slots_json = get_available_slots(business_id, selected_service['name'], date)
-        try:
-            available_slots = json.loads(slots_json)
-            if time not in available_slots:
-                alt = f"Scegli tra questi: {', '.join(available_slots[:4])}..." if available_slots else "Prova un altro giorno."
-                return f"L'orario delle {time} del {date} non è più disponibile. {alt}"
-        except (json.JSONDecodeError, TypeError):
-            return f"Impossibile verificare la disponibilità per il {date}. Motivo: {slots_json}"
+            return f"Servizio '{service_name}' non riconosciuto. Impossibile prenotare. Scegli tra: {booking_logic.service_names_text(config)}."
 
         calendar_service = get_calendar_service(business_id)
         if not calendar_service: return "Servizio calendario non configurato."
+        duration = selected_service.get('duration', 60)
+
+        # Slot appena proposto a questo utente e ancora tenuto per lui: nessuna nuova verifica
+        hold = slot_reservations.find_hold(db.pending_bookings, business_id, user_id, date, time, duration)
+        if hold:
+            print(f"🔒 Slot {date} {time} già tenuto per l'utente su {hold['calendar_id']}")
+        else:
+            available_slots, error = _find_slots_for_service(business_id, config, selected_service, date)
+            if error:
+                return f"Impossibile verificare la disponibilità per il {date}. Motivo: {error}"
+            chosen_slot, error = booking_logic.pick_requested_slot(available_slots, time, date)
+            if error: return error
+
+            # Con più calendari (staff) tiene il primo che risultava libero per quello slot
+            hold = slot_reservations.reserve(
+                db.pending_bookings, business_id, chosen_slot['calendar_ids'], user_id, selected_service['name'], date, time, duration
+            )
+            if not hold:
+                print(f"🚫 Slot {date} {time} tenuto da un altro cliente")
+                return booking_logic.slot_taken_message(date, time)
 
-        event_id = calendar_service.create_appointment(
-            date=date, start_time=time, duration_minutes=selected_service.get('duration', 60),
-            customer_name=user_name, customer_phone=user_id, service_type=selected_service.get('name')
-        )
+        event_id = None
+        try:
+            event_id = calendar_service.create_appointment(
+                **booking_logic.appointment_request(selected_service, hold['calendar_id'], user_id, user_name, date, time)
+            )
+        finally:
+            slot_reservations.release(db.pending_bookings, hold, booked=bool(event_id))
 
         if not event_id:
             return "Creazione appuntamento fallita. L'orario potrebbe essere stato appena occupato. Riprova."
 
-        # Salva su DB (la tua logica qui era corretta)
-        
-        return f"Perfetto, appuntamento confermato! Ti aspetto per '{selected_service['name']}' il {date} alle {time}."
+        try:
+            booking_store.save_booking(db.bookings, booking_store.booking_document(
+                business_id, user_id, user_name, selected_service['name'], date, time, duration,
+                hold['calendar_id'], event_id, calendar_service.timezone
+            ))
+        except Exception as e:
+            # L'appuntamento è già sul calendario: l'utente riceve comunque la conferma
+            print(f"❌ Errore salvataggio prenotazione {event_id}: {e}")
+
+        return booking_logic.booking_confirmed_message(selected_service, date, time)
 
     except Exception as e:
         traceback.print_exc()
-        return "Si è verificato un errore imprevisto durante la prenotazione."
+        return booking_logic.tool_error_message(e, "Si è verificato un errore imprevisto durante la prenotazione.")
 
 def get_business_info(business_id: str, **kwargs):
     try:
         config, error = _get_business_config(business_id)
         if error: return error
         
-        business = config["business_info"]
-        services = config["services"]
-        start_h, end_h = config["booking_hours"]
-        
-        services_text = "\n".join([f"- {s['name']} ({s['duration']} min)" for s in services])
-        info = (
-            f"Ecco le informazioni su {business.get('business_name', 'questo business')}:\n"
-            f"📍 Indirizzo: {business.get('address', 'Non specificato')}\n"
-            f"🕒 Orari di riferimento: {business.get('opening_hours', f'dalle {start_h} alle {end_h}')}\n"
-            f"ℹ️ {business.get('description', '')}\n\n"
-            f"Servizi offerti:\n{services_text}"
-        )
-        return info
+        return booking_logic.format_business_info(config)
 
     except Exception as e:
         traceback.print_exc()
         return "Non riesco a recuperare le informazioni al momento."
 
-def cancel_booking(business_id: str, user_id: str, **kwargs):
-    # Logica invariata, ma con gestione errori migliore
+def get_next_booking(business_id: str, user_id: str, **kwargs):
+    """Prossima prenotazione dell'utente, senza toccarla: il percorso veloce la propone prima di cancellarla."""
     try:
-        # ... la tua logica di cancellazione qui ...
-        return "La tua prenotazione è stata cancellata con successo."
+        booking = booking_store.next_booking(db.bookings, business_id, user_id)
+        if not booking:
+            return booking_logic.no_upcoming_booking_message()
+        return booking_logic.booking_summary(booking)
+    except Exception as e:
+        traceback.print_exc()
+        return booking_logic.tool_error_message(e, "Non riesco a recuperare la tua prenotazione al momento.")
+
+def cancel_booking(business_id: str, user_id: str, date: str = None, time: str = None, **kwargs):
+    """date/time: appuntamento confermato dall'utente (percorso veloce); se il prossimo è un altro non si cancella nulla."""
+    print(f"🗑️ Cancellazione della prossima prenotazione di {user_id}")
+    try:
+        booking = booking_store.next_booking(db.bookings, business_id, user_id)
+        if not booking:
+            return booking_logic.no_upcoming_booking_message()
+        if date and (booking['date'], booking['time']) != (date, time):
+            return booking_logic.booking_changed_message()
+
+        calendar_service = get_calendar_service(business_id)
+        if not calendar_service or not calendar_service.cancel_appointment(booking['event_id'], booking['calendar_id']):
+            return "Non sono riuscito a cancellare la prenotazione. Contatta direttamente il negozio."
+
+        booking_store.mark_cancelled(db.bookings, booking['_id'])
+        slot_reservations.free_slot(
+            db.pending_bookings, business_id, booking['calendar_id'], booking['date'], booking['time'], booking['duration']
+        )
+        return booking_logic.booking_cancelled_message(booking)
     except Exception as e:
         traceback.print_exc()
-        return "Non sono riuscito a cancellare la prenotazione. Contatta direttamente il negozio."
\ No newline at end of file
+        return booking_logic.tool_error_message(e, "Non sono riuscito a cancellare la prenotazione. Contatta direttamente il negozio.")
\ No newline at end of file
@@ -0,0 +1,281 @@
+# business_cache.py - Cache in-process delle configurazioni dei business
+
+import asyncio
+import json
+import os
+import threading
+import time
+from service_matcher import ServiceMatcher
+
+# Cache registrate in questo processo, avvisate da notify_business_changed()
+_registered_caches = []
+
+
+def parse_business_config(business):
+    """
+    Valida e converte il documento del business in configurazione pronta all'uso.
+    Restituisce (config, None) oppure (None, messaggio di errore per l'utente).
+    """
+    if not business:
+        return None, "Impossibile trovare le impostazioni del business."
+
+    # Carica e valida i servizi
+    services_data = business.get("services")
+    services = []
+    if isinstance(services_data, list):
+        services = services_data
+    elif isinstance(services_data, str) and services_data.strip():
+        try:
+            services = json.loads(services_data)
+        except json.JSONDecodeError:
+            return None, "Errore nella configurazione dei servizi."
+    if not services:
+        return None, "Nessun servizio è stato configurato per questo business."
+
+    # Carica e valida gli orari di base
+    booking_hours_str = business.get("booking_hours")
+    if not booking_hours_str or "-" not in booking_hours_str:
+        return None, "Gli orari di apertura non sono configurati correttamente."
+    try:
+        start_hour, end_hour = map(int, booking_hours_str.split('-'))
+        booking_hours = (start_hour, end_hour)
+    except (ValueError, TypeError):
+        return None, "Il formato degli orari nel database non è valido."
+
+    config = {
+        "services": services,
+        "booking_hours": booking_hours,
+        "business_info": business,
+        "matcher": ServiceMatcher(services)
+    }
+    return config, None
+
+
+class BusinessConfigCache:
+    """
+    Cache per-worker dei business, indicizzata per _id e per numero Twilio.
+    Ogni voce contiene il documento e la configurazione già parsata; scade dopo
+    ttl_seconds e può essere invalidata esplicitamente o da un change stream MongoDB.
+    """
+
+    def __init__(self, collection, ttl_seconds=300, use_change_stream=True):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.use_change_stream = use_change_stream
+        self._lock = threading.Lock()
+        self._entries = {}      # business_id -> voce
+        self._phone_index = {}  # twilio_phone_number -> business_id
+        self._watcher_pid = None
+        self._listeners = []
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        _registered_caches.append(self)
+
+    def _build_entry(self, business):
+        config, error = parse_business_config(business)
+        return {
+            "business": business,
+            "config": config,
+            "error": error,
+            "expires_at": time.monotonic() + self.ttl_seconds,
+        }
+
+    def _store(self, business):
+        entry = self._build_entry(business)
+        with self._lock:
+            self._entries[business["_id"]] = entry
+            if business.get("twilio_phone_number"):
+                self._phone_index[business["twilio_phone_number"]] = business["_id"]
+        return entry
+
+    def _lookup(self, business_id):
+        with self._lock:
+            entry = self._entries.get(business_id)
+            if entry and entry["expires_at"] > time.monotonic():
+                self.stats["hits"] += 1
+                return entry
+            self.stats["misses"] += 1
+            return None
+
+    def get_entry_by_id(self, business_id):
+        self._ensure_watcher()
+        entry = self._lookup(business_id)
+        if entry:
+            return entry
+        business = self.collection.find_one({"_id": business_id})
+        return self._store(business) if business else None
+
+    def _lookup_phone(self, phone_number):
+        with self._lock:
+            business_id = self._phone_index.get(phone_number)
+        entry = self._lookup(business_id) if business_id is not None else None
+        if entry and entry["business"].get("twilio_phone_number") == phone_number:
+            return entry
+        if business_id is None:
+            with self._lock:
+                self.stats["misses"] += 1
+        return None
+
+    def get_entry_by_phone(self, phone_number):
+        self._ensure_watcher()
+        entry = self._lookup_phone(phone_number)
+        if entry:
+            return entry
+        business = self.collection.find_one({"twilio_phone_number": phone_number})
+        return self._store(business) if business else None
+
+    def get_by_id(self, business_id):
+        """Documento del business (o None)."""
+        entry = self.get_entry_by_id(business_id)
+        return entry["business"] if entry else None
+
+    def get_by_phone(self, phone_number):
+        """Documento del business associato al numero Twilio (o None)."""
+        entry = self.get_entry_by_phone(phone_number)
+        return entry["business"] if entry else None
+
+    def get_config(self, business_id):
+        """Configurazione parsata: (config, None) oppure (None, messaggio di errore)."""
+        entry = self.get_entry_by_id(business_id)
+        if not entry:
+            return parse_business_config(None)
+        return entry["config"], entry["error"]
+
+    # Varianti asyncio: stessa cache, ma la collection è di motor e find_one va atteso
+
+    async def aget_entry_by_id(self, business_id):
+        self._ensure_async_watcher()
+        entry = self._lookup(business_id)
+        if entry:
+            return entry
+        business = await self.collection.find_one({"_id": business_id})
+        return self._store(business) if business else None
+
+    async def aget_entry_by_phone(self, phone_number):
+        self._ensure_async_watcher()
+        entry = self._lookup_phone(phone_number)
+        if entry:
+            return entry
+        business = await self.collection.find_one({"twilio_phone_number": phone_number})
+        return self._store(business) if business else None
+
+    async def aget_by_id(self, business_id):
+        entry = await self.aget_entry_by_id(business_id)
+        return entry["business"] if entry else None
+
+    async def aget_by_phone(self, phone_number):
+        entry = await self.aget_entry_by_phone(phone_number)
+        return entry["business"] if entry else None
+
+    async def aget_config(self, business_id):
+        entry = await self.aget_entry_by_id(business_id)
+        if not entry:
+            return parse_business_config(None)
+        return entry["config"], entry["error"]
+
+    def add_invalidation_listener(self, callback):
+        """
+        Registra callback(business_id) chiamata a ogni invalidazione, anche da change stream;
+        business_id è None quando viene svuotata tutta la cache.
+        """
+        self._listeners.append(callback)
+
+    def invalidate(self, business_id=None, phone_number=None):
+        """Rimuove un business dalla cache (per _id e/o numero); senza argomenti svuota tutto."""
+        with self._lock:
+            self.stats["invalidations"] += 1
+            if business_id is None and phone_number is None:
+                self._entries.clear()
+                self._phone_index.clear()
+            else:
+                if phone_number is not None and business_id is None:
+                    business_id = self._phone_index.get(phone_number)
+                entry = self._entries.pop(business_id, None) if business_id is not None else None
+                if entry and entry["business"].get("twilio_phone_number"):
+                    self._phone_index.pop(entry["business"]["twilio_phone_number"], None)
+                if phone_number is not None:
+                    self._phone_index.pop(phone_number, None)
+                if business_id is None:
+                    # Numero sconosciuto: nessun business da notificare
+                    return
+
+        for callback in self._listeners:
+            try:
+                callback(business_id)
+            except Exception as e:
+                print(f"⚠️ Errore listener invalidazione cache: {e}")
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _ensure_watcher(self):
+        """Avvia il change stream una volta per processo (i thread non sopravvivono al fork di gunicorn)."""
+        if not self.use_change_stream or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch_changes, name="business-cache-watcher", daemon=True).start()
+
+    def _watch_changes(self):
+        """Invalida le voci modificate da altri processi. Richiede un replica set (es. Atlas)."""
+        while True:
+            started = False
+            try:
+                with self.collection.watch() as stream:
+                    started = True
+                    print("👀 Change stream businesses attivo per la cache")
+                    for change in stream:
+                        operation = change.get("operationType")
+                        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+                            self.invalidate()
+                        elif change.get("documentKey"):
+                            self.invalidate(business_id=change["documentKey"]["_id"])
+            except Exception as e:
+                if not started:
+                    # Es. MongoDB standalone: restano TTL e invalidazione esplicita
+                    print(f"⚠️ Change stream businesses non disponibile, uso solo il TTL: {e}")
+                    return
+                print(f"⚠️ Change stream businesses interrotto, riconnessione: {e}")
+            # Durante la disconnessione potremmo aver perso modifiche
+            self.invalidate()
+            time.sleep(5)
+
+
+    def _ensure_async_watcher(self):
+        """Come _ensure_watcher, ma come task sull'event loop corrente (collection motor)."""
+        if not self.use_change_stream or self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        asyncio.get_running_loop().create_task(self._awatch_changes())
+
+    async def _awatch_changes(self):
+        while True:
+            started = False
+            try:
+                async with self.collection.watch() as stream:
+                    started = True
+                    print("👀 Change stream businesses attivo per la cache (async)")
+                    async for change in stream:
+                        operation = change.get("operationType")
+                        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+                            self.invalidate()
+                        elif change.get("documentKey"):
+                            self.invalidate(business_id=change["documentKey"]["_id"])
+            except Exception as e:
+                if not started:
+                    print(f"⚠️ Change stream businesses non disponibile, uso solo il TTL: {e}")
+                    return
+                print(f"⚠️ Change stream businesses interrotto, riconnessione: {e}")
+            self.invalidate()
+            await asyncio.sleep(5)
+
+
+def notify_business_changed(business_id=None, phone_number=None):
+    """Hook da chiamare dopo ogni inserimento/modifica di un business in questo processo."""
+    for cache in _registered_caches:
+        cache.invalidate(business_id=business_id, phone_number=phone_number)
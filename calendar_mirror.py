@@ -0,0 +1,202 @@
+# calendar_mirror.py - Copia locale degli eventi Google Calendar aggiornata con syncToken
+#
+# Le domande di disponibilità leggono dal mirror in memoria invece di chiamare events().list:
+# la prima lettura di un calendario fa una sincronizzazione completa, poi bastano letture
+# incrementali (syncToken) che riportano solo le modifiche. Se Google invalida il token (410)
+# il calendario viene riscaricato da zero. La lettura completa parte da oggi: gli appuntamenti
+# passati non servono alle ricerche di disponibilità.
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from googleapiclient.errors import HttpError
+
+from calendar_service import CalendarService
+
+# Oltre questa età il mirror viene riallineato alla lettura successiva: prima di rispondere, o in
+# background se le notifiche push (calendar_watch) segnalano già le modifiche fatte su Google
+CALENDAR_MIRROR_REFRESH_SECONDS = int(os.getenv("CALENDAR_MIRROR_REFRESH_SECONDS", "60"))
+
+
+class CalendarMirror:
+    """
+    Eventi dei calendari di un CalendarService, indicizzati per id, con il syncToken di ciascuno.
+    Con background_refresh le letture non chiamano mai Google, salvo la primissima sincronizzazione
+    di un calendario; senza, un mirror più vecchio di refresh_seconds si riallinea prima di rispondere.
+    """
+
+    def __init__(self, calendar_service, refresh_seconds=CALENDAR_MIRROR_REFRESH_SECONDS, background_refresh=False):
+        self.calendar_service = calendar_service
+        self.refresh_seconds = refresh_seconds
+        self.background_refresh = background_refresh
+        self._lock = threading.Lock()
+        self._calendars = {}
+        self.stats = {"full_syncs": 0, "incremental_syncs": 0, "background_refreshes": 0}
+
+    def _state(self, calendar_id):
+        with self._lock:
+            return self._calendars.setdefault(calendar_id, {
+                "events": {}, "sync_token": None, "synced_at": None,
+                "sync_lock": threading.Lock(), "refreshing": False, "stale": False,
+            })
+
+    def _list_changes(self, calendar_id, sync_token):
+        """
+        Tutte le pagine di una lettura completa (sync_token None, dagli eventi di oggi in poi) o
+        incrementale (Google non accetta timeMin insieme al syncToken: vale quello della lettura completa).
+        """
+        service = self.calendar_service
+        time_min = None
+        if not sync_token:
+            today = datetime.now(service.timezone).date()
+            time_min = service.timezone.localize(datetime.combine(today, datetime.min.time())).isoformat()
+        items = []
+        page_token = None
+        while True:
+            result = service._execute(service.service.events().list(
+                calendarId=calendar_id,
+                singleEvents=True,
+                showDeleted=bool(sync_token),
+                syncToken=sync_token,
+                timeMin=time_min,
+                pageToken=page_token
+            ))
+            items.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return items, result.get('nextSyncToken')
+
+    def sync(self, calendar_id):
+        """Allinea un calendario: incrementale se c'è un syncToken valido, altrimenti completo."""
+        state = self._state(calendar_id)
+        with state["sync_lock"]:
+            # Una notifica che arriva durante la lettura rimette stale a True per la prossima
+            state["stale"] = False
+            sync_token = state["sync_token"]
+            try:
+                items, next_token = self._list_changes(calendar_id, sync_token)
+            except HttpError as e:
+                if not sync_token or e.resp.status != 410:
+                    raise
+                print(f"🔄 syncToken scaduto per {calendar_id}: risincronizzazione completa")
+                sync_token = None
+                items, next_token = self._list_changes(calendar_id, None)
+
+            events = {} if sync_token is None else dict(state["events"])
+            today = datetime.now(self.calendar_service.timezone).date()
+            for event in items:
+                if event.get('status') == 'cancelled':
+                    events.pop(event['id'], None)
+                    continue
+                try:
+                    span = self.calendar_service._event_span(event)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                # Gli eventi già conclusi non servono più alle ricerche di disponibilità
+                if span[3] < today:
+                    events.pop(event['id'], None)
+                    continue
+                events[event['id']] = (span[2], span[3], event)
+
+            with self._lock:
+                state["events"] = events
+                state["sync_token"] = next_token
+                state["synced_at"] = time.monotonic()
+                self.stats["incremental_syncs" if sync_token else "full_syncs"] += 1
+
+    def sync_all(self):
+        for calendar_id in self.calendar_service.calendar_ids:
+            try:
+                self.sync(calendar_id)
+            except Exception as e:
+                print(f"⚠️ Sincronizzazione mirror fallita per {calendar_id}: {e}")
+
+    def invalidate(self, calendar_id=None, refresh=True):
+        """
+        Segna come non aggiornati un calendario (o tutti): la lettura successiva si riallinea
+        con Google prima di rispondere. Con refresh=True il riallineamento parte subito in background.
+        """
+        calendar_ids = [calendar_id] if calendar_id else list(self.calendar_service.calendar_ids)
+        for cal_id in calendar_ids:
+            state = self._state(cal_id)
+            state["stale"] = True
+            if refresh and state["synced_at"] is not None:
+                self._refresh_in_background(cal_id, state)
+
+    def _refresh_in_background(self, calendar_id, state):
+        with self._lock:
+            if state["refreshing"]:
+                return
+            state["refreshing"] = True
+            self.stats["background_refreshes"] += 1
+
+        def _run():
+            try:
+                self.sync(calendar_id)
+            except Exception as e:
+                print(f"⚠️ Aggiornamento mirror fallito per {calendar_id}: {e}")
+            finally:
+                with self._lock:
+                    state["refreshing"] = False
+
+        threading.Thread(target=_run, name=f"calendar-mirror-{calendar_id}", daemon=True).start()
+
+    def sizes(self):
+        """Calendari ed eventi attualmente nel mirror (valori istantanei per /metrics)."""
+        with self._lock:
+            states = list(self._calendars.values())
+        return {"calendars": len(states), "events": sum(len(state["events"]) for state in states)}
+
+    def events_between(self, calendar_id, time_min, time_max):
+        """Eventi del mirror che toccano i giorni dell'intervallo [time_min, time_max]."""
+        state = self._state(calendar_id)
+        if state["synced_at"] is None or state["stale"]:
+            self.sync(calendar_id)
+        elif time.monotonic() - state["synced_at"] > self.refresh_seconds:
+            if self.background_refresh:
+                self._refresh_in_background(calendar_id, state)
+            else:
+                self.sync(calendar_id)
+
+        first_date, last_date = time_min.date(), time_max.date()
+        with self._lock:
+            events = state["events"]
+        return [event for first_day, last_day, event in events.values() if first_day <= last_date and last_day >= first_date]
+
+
+class MirroredCalendarService(CalendarService):
+    """
+    CalendarService che risponde alle domande di disponibilità dal mirror locale.
+    Le scritture (creazione e cancellazione) vanno su Google e poi riallineano subito il mirror.
+    """
+
+    def __init__(self, calendar_id=None, service_account_key=None, refresh_seconds=CALENDAR_MIRROR_REFRESH_SECONDS,
+                 client=None, background_refresh=False):
+        super().__init__(calendar_id=calendar_id, service_account_key=service_account_key, client=client)
+        self.mirror = CalendarMirror(self, refresh_seconds, background_refresh)
+
+    def _list_events_multi(self, calendar_ids, time_min, time_max):
+        events_by_calendar = {}
+        for index, calendar_id in enumerate(calendar_ids):
+            try:
+                events_by_calendar[calendar_id] = self.mirror.events_between(calendar_id, time_min, time_max)
+            except Exception as e:
+                if index == 0:
+                    raise
+                print(f"⚠️ Calendario {calendar_id} non leggibile: {e}")
+                events_by_calendar[calendar_id] = [self._unavailable_marker(time_min, time_max)]
+        return events_by_calendar
+
+    def create_appointment(self, *args, **kwargs):
+        event_id = super().create_appointment(*args, **kwargs)
+        if event_id:
+            self.mirror.sync_all()
+        return event_id
+
+    def cancel_appointment(self, event_id, calendar_id=None):
+        cancelled = super().cancel_appointment(event_id, calendar_id)
+        if cancelled:
+            self.mirror.sync_all()
+        return cancelled
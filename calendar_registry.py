@@ -0,0 +1,103 @@
+# calendar_registry.py - CalendarService per business, in una cache limitata (LRU + TTL)
+#
+# Su un worker che serve migliaia di numeri non tutti i business possono restare in memoria:
+# oltre max_size viene scartato quello usato meno di recente, e ogni voce scade dopo ttl_seconds.
+# Ogni voce ricorda la versione della configurazione da cui è nata (calendari + updated_at del
+# business): se il business cambia, alla richiesta successiva il servizio viene ricostruito.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import booking_logic
+
+CALENDAR_REGISTRY_MAX_SIZE = int(os.getenv("CALENDAR_REGISTRY_MAX_SIZE", "1000"))
+CALENDAR_REGISTRY_TTL_SECONDS = int(os.getenv("CALENDAR_REGISTRY_TTL_SECONDS", "3600"))
+
+
+def calendar_config_version(business):
+    """Parte della configurazione del business da cui dipende il CalendarService."""
+    return tuple(booking_logic.get_calendar_ids(business)), business.get("updated_at")
+
+
+class CalendarServiceRegistry:
+    """
+    business_id -> CalendarService, creato da factory(business) alla prima richiesta
+    (factory può restituire None, es. calendario non configurato: in quel caso nulla viene salvato).
+    """
+
+    def __init__(self, factory, max_size=CALENDAR_REGISTRY_MAX_SIZE, ttl_seconds=CALENDAR_REGISTRY_TTL_SECONDS):
+        self.factory = factory
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # business_id -> voce, dalla meno alla più recente
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "rebuilds": 0, "invalidations": 0}
+
+    def _lookup(self, business_id, version):
+        with self._lock:
+            entry = self._entries.get(business_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                self.stats["expirations"] += 1
+            elif entry["version"] != version:
+                self.stats["rebuilds"] += 1
+            else:
+                self._entries.move_to_end(business_id)
+                self.stats["hits"] += 1
+                return entry["service"]
+            self.stats["misses"] += 1
+            del self._entries[business_id]
+            return None
+
+    def put(self, business_id, business, service):
+        """Salva il servizio per il business, scartando i meno usati oltre max_size."""
+        entry = {
+            "service": service,
+            "version": calendar_config_version(business),
+            "expires_at": time.monotonic() + self.ttl_seconds,
+        }
+        with self._lock:
+            self._entries[business_id] = entry
+            self._entries.move_to_end(business_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return service
+
+    def get(self, business_id, business):
+        """CalendarService del business (documento già letto dalla cache dei business), o None."""
+        if not business:
+            return None
+        service = self._lookup(business_id, calendar_config_version(business))
+        if service is not None:
+            return service
+        # Costruzione fuori dal lock: con il client condiviso costa poco, e due thread che la fanno insieme sono innocui
+        service = self.factory(business)
+        return self.put(business_id, business, service) if service is not None else None
+
+    def get_cached(self, business_id):
+        """Servizio già in memoria, senza crearlo né aggiornare l'ordine LRU."""
+        with self._lock:
+            entry = self._entries.get(business_id)
+        return entry["service"] if entry else None
+
+    def values(self):
+        with self._lock:
+            return [entry["service"] for entry in self._entries.values()]
+
+    def invalidate(self, business_id=None):
+        """Rimuove un business; senza argomenti svuota il registro."""
+        with self._lock:
+            self.stats["invalidations"] += 1
+            if business_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(business_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
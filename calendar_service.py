@@ -1,218 +1,536 @@
 # calendar_service.py - Versione con controllo dinamico reale
 
 import json
+import threading
 from datetime import datetime, timedelta, time as dtime
 from google.oauth2.service_account import Credentials as ServiceCredentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+import os
 import pytz
+import metrics
+import resilience
+import slot_engine
+
+# Parole chiave degli eventi "di sistema" che modificano gli orari del giorno
+CLOSED_KEYWORDS = ['CHIUSO', 'CLOSED', 'FERIE', 'VACATION']
+HOURS_KEYWORDS = ['ORARI', 'WORKING_HOURS', 'APERTO', 'OPEN']
+
+# Timeout di ogni richiesta a Google: httplib2 lo fissa sulla connessione, quindi non segue il tempo rimasto al messaggio
+CALENDAR_TIMEOUT_SECONDS = float(os.getenv("CALENDAR_TIMEOUT_SECONDS", "5"))
+# Una risposta persa non dice se l'evento è stato creato: queste richieste non vengono ritentate
+NON_IDEMPOTENT_METHODS = {'calendar.events.insert'}
+TRANSIENT_HTTP_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_transient_google_error(error):
+    """Errori per cui ha senso ritentare: rete, timeout, 429/5xx e limiti di frequenza (403 rateLimitExceeded)."""
+    if isinstance(error, HttpError):
+        status = int(getattr(error.resp, 'status', 0) or 0)
+        return status in TRANSIENT_HTTP_STATUSES or (status == 403 and b'ateLimitExceeded' in (error.content or b''))
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+class CalendarClient:
+    """
+    Credenziali e risorsa Calendar v3 condivise da tutti i CalendarService del processo.
+    Ogni thread ha il suo AuthorizedHttp (httplib2 non è thread-safe), che tiene aperte le
+    connessioni verso Google tra una richiesta e l'altra, qualunque sia il business.
+    """
+
+    def __init__(self, service_account_key):
+        creds_info = json.loads(service_account_key) if isinstance(service_account_key, str) and service_account_key.startswith('{') else service_account_key
+        self.credentials = ServiceCredentials.from_service_account_info(
+            creds_info, scopes=['https://www.googleapis.com/auth/calendar']
+        )
+        # Documento discovery incluso nella libreria: costruito una volta, senza richieste HTTP
+        self.service = build('calendar', 'v3', credentials=self.credentials, static_discovery=True, cache_discovery=False)
+        self._thread_local = threading.local()
+
+    def _http(self):
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=CALENDAR_TIMEOUT_SECONDS))
+            self._thread_local.http = http
+        return http
+
+    def execute(self, request):
+        return request.execute(http=self._http())
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def shared_calendar_client(service_account_key):
+    """CalendarClient unico per chiave di service account (di solito una sola per processo)."""
+    cache_key = service_account_key if isinstance(service_account_key, str) else json.dumps(service_account_key, sort_keys=True)
+    with _shared_clients_lock:
+        client = _shared_clients.get(cache_key)
+        if client is None:
+            client = CalendarClient(service_account_key)
+            _shared_clients[cache_key] = client
+            print("✅ Google Calendar connesso")
+        return client
+
 
 class CalendarService:
-    def __init__(self, calendar_id=None, service_account_key=None):
+    """
+    Vista su uno o più calendari di un business. Credenziali, risorsa discovery e connessioni
+    vengono dal CalendarClient condiviso, quindi crearne una per business costa poco.
+    """
+
+    def __init__(self, calendar_id=None, service_account_key=None, client=None):
         if isinstance(calendar_id, list):
             self.calendar_ids = calendar_id
         elif calendar_id:
             self.calendar_ids = [calendar_id]
         else:
             self.calendar_ids = []
+        self.client = client
         self.service = None
         self.timezone = pytz.timezone('Europe/Rome')
         
-        if service_account_key:
-            self._init_service_account(service_account_key)
+        if service_account_key and client is None:
+            try:
+                self.client = shared_calendar_client(service_account_key)
+            except Exception as e:
+                print(f"❌ Errore connessione Google Calendar: {e}")
+        if self.client is not None:
+            self.service = self.client.service
 
-    def _init_service_account(self, service_account_key):
-        try:
-            creds_info = json.loads(service_account_key) if isinstance(service_account_key, str) and service_account_key.startswith('{') else service_account_key
-            credentials = ServiceCredentials.from_service_account_info(
-                creds_info, scopes=['https://www.googleapis.com/auth/calendar']
+    def _execute(self, request):
+        """
+        Esegue una richiesta (o un batch) con il client HTTP del thread corrente:
+        httplib2 non è thread-safe e i tool di un turno girano in parallelo.
+        Errori transitori ritentati entro il tempo del messaggio, poi DependencyUnavailable.
+        """
+        # methodId es. 'calendar.events.list'; i batch non ce l'hanno
+        method = getattr(request, 'methodId', None)
+        execute = request.execute if self.client is None else (lambda: self.client.execute(request))
+        with metrics.span("calendar", method or 'batch'):
+            return resilience.call(
+                "calendar", lambda timeout: execute(), is_transient_google_error, CALENDAR_TIMEOUT_SECONDS,
+                attempts=1 if method in NON_IDEMPOTENT_METHODS else resilience.RETRY_MAX_ATTEMPTS
             )
-            self.service = build('calendar', 'v3', credentials=credentials)
-            print("✅ Google Calendar connesso")
-        except Exception as e:
-            print(f"❌ Errore connessione Google Calendar: {e}")
-            self.service = None
 
-    def get_working_hours_for_date(self, date_str):
+    def scan_day(self, date_str):
         """
-        Determina gli orari di lavoro effettivi per una data specifica
-        controllando se ci sono eventi 'ORARI' o 'CHIUSO' nel calendario.
+        Legge una sola volta gli eventi del giorno e li smista in chiusura,
+        override 'ORARI' e intervalli occupati. Restituisce None se il calendario non è disponibile.
         """
         if not self.service or not self.calendar_ids:
-            return None, None
-            
+            return None
+
         try:
             target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-            start_of_day = self.timezone.localize(datetime.combine(target_date, dtime(0, 0)))
-            end_of_day = self.timezone.localize(datetime.combine(target_date, dtime(23, 59, 59)))
-
-            events_result = self.service.events().list(
-                calendarId=self.calendar_ids[0],
-                timeMin=start_of_day.isoformat(),
-                timeMax=end_of_day.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
-            working_start = None
-            working_end = None
-            is_closed = False
-            
-            for event in events:
-                if event.get('status') == 'cancelled': continue
-                summary = event.get('summary', '').upper()
-                
-                if any(keyword in summary for keyword in ['CHIUSO', 'CLOSED', 'FERIE', 'VACATION']):
-                    print(f"🚫 Business chiuso il {date_str}: {event.get('summary')}")
-                    is_closed = True
-                    break
-                
-                if any(keyword in summary for keyword in ['ORARI', 'WORKING_HOURS', 'APERTO', 'OPEN']):
-                    start_dt_str = event['start'].get('dateTime', event['start'].get('date'))
-                    end_dt_str = event['end'].get('dateTime', event['end'].get('date'))
-                    
-                    if 'T' in start_dt_str and 'T' in end_dt_str:
-                        start_time = datetime.fromisoformat(start_dt_str.replace('Z', '+00:00')).astimezone(self.timezone)
-                        end_time = datetime.fromisoformat(end_dt_str.replace('Z', '+00:00')).astimezone(self.timezone)
-                        working_start, working_end = start_time.time(), end_time.time()
-                        print(f"📅 Orari personalizzati per {date_str}: {working_start} - {working_end}")
-                        break
-            
-            if is_closed:
-                return None, None
-            
-            return working_start, working_end
-            
+            return self._scan_dates([target_date])[target_date]
         except Exception as e:
-            print(f"❌ Errore controllo orari di lavoro: {e}")
+            print(f"❌ Errore lettura calendario per il {date_str}: {e}")
+            return None
+
+    def _scan_dates(self, dates):
+        """
+        Una sola lettura (batch se ci sono più calendari) per l'intero intervallo di date,
+        classificata giorno per giorno. Chiusure e orari speciali arrivano dal primo
+        calendario (quello del business); per ogni calendario dello staff si tengono gli
+        intervalli occupati, e una sua chiusura (es. "FERIE") lo esclude solo per quel giorno.
+        """
+        range_start, range_end = self._range_bounds(dates)
+        events_by_calendar = self._list_events_multi(self.calendar_ids, range_start, range_end)
+        return self._build_days(dates, events_by_calendar)
+
+    def _range_bounds(self, dates):
+        range_start = self.timezone.localize(datetime.combine(dates[0], dtime(0, 0)))
+        range_end = self.timezone.localize(datetime.combine(dates[-1], dtime(23, 59, 59)))
+        return range_start, range_end
+
+    def _build_days(self, dates, events_by_calendar):
+        """Combina gli eventi già letti di tutti i calendari nella vista per giorno."""
+        main_calendar = self.calendar_ids[0]
+        classified = self._classify_events(events_by_calendar[main_calendar], dates)
+        days = {}
+        for d in dates:
+            day = classified[d]
+            if day['closed']:
+                print(f"🚫 Business chiuso il {d}")
+            elif day['hours']:
+                print(f"📅 Orari personalizzati per {d}: {day['hours'][0]} - {day['hours'][1]}")
+            days[d] = {'closed': day['closed'], 'hours': day['hours'], 'busy': {main_calendar: day['busy']}}
+
+        for calendar_id in self.calendar_ids[1:]:
+            staff_days = self._classify_events(events_by_calendar[calendar_id], dates)
+            for d in dates:
+                if not staff_days[d]['closed']:
+                    days[d]['busy'][calendar_id] = staff_days[d]['busy']
+        return days
+
+    def get_working_hours_for_date(self, date_str):
+        """
+        Determina gli orari di lavoro effettivi per una data specifica
+        controllando se ci sono eventi 'ORARI' o 'CHIUSO' nel calendario.
+        """
+        day_info = self.scan_day(date_str)
+        if not day_info or day_info['closed'] or not day_info['hours']:
             return None, None
+        return day_info['hours']
 
     def get_available_slots(self, date: str, duration_minutes: int, start_hour: int, end_hour: int, slot_interval: int = 30):
         """
         Trova slot disponibili controllando Google Calendar.
         Gli orari start_hour e end_hour sono obbligatori e derivano dal DB.
         """
+        return self.get_day_overview(date, duration_minutes, start_hour, end_hour, slot_interval)[1]
+
+    def get_day_overview(self, date: str, duration_minutes: int, start_hour: int, end_hour: int, slot_interval: int = 30):
+        """
+        Override orari e slot liberi di un giorno con una sola chiamata al calendario.
+        Restituisce ((is_open, start_hour, end_hour), slot) con la stessa semantica
+        di check_business_hours_override.
+        """
         if not self.service or not self.calendar_ids:
             print("❌ Servizio calendar non disponibile")
-            return []
-            
+            return (None, None, None), []
+
         try:
             target_date = datetime.strptime(date, '%Y-%m-%d').date()
-            
-            # 1. Controlla se il calendario impone orari diversi o chiusura
-            dynamic_start, dynamic_end = self.get_working_hours_for_date(date)
-            
-            if dynamic_start is None and dynamic_end is None:
-                # Controlla se è una chiusura esplicita (entrambi None) o solo nessun override
-                # Questa logica viene gestita nel chiamante (bot_tools), qui procediamo con gli orari dati.
-                is_explicitly_closed = self.is_day_closed(date)
-                if is_explicitly_closed:
-                    print(f"🚫 Business esplicitamente chiuso il {date}")
-                    return []
-
-            # Usa orari dinamici se disponibili, altrimenti quelli passati come argomento (da DB)
-            actual_start_hour = dynamic_start.hour if dynamic_start else start_hour
-            actual_end_hour = dynamic_end.hour if dynamic_end else end_hour
-            
-            print(f"📅 Orari di lavoro per {date}: {actual_start_hour}:00 - {actual_end_hour}:00")
-            
-            # 2. Definisci finestra temporale e recupera eventi
-            work_start = self.timezone.localize(datetime.combine(target_date, dtime(hour=actual_start_hour)))
-            work_end = self.timezone.localize(datetime.combine(target_date, dtime(hour=actual_end_hour)))
-            
-            events_result = self.service.events().list(
-                calendarId=self.calendar_ids[0],
-                timeMin=work_start.isoformat(),
-                timeMax=work_end.isoformat(),
+            day_info = self._scan_dates([target_date])[target_date]
+            return self._day_overview(target_date, day_info, duration_minutes, start_hour, end_hour, slot_interval)
+
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore ricerca slot: {e}")
+            return (None, None, None), []
+
+    def _day_overview(self, target_date, day_info, duration_minutes, start_hour, end_hour, slot_interval):
+        if day_info['closed']:
+            print(f"🚫 Business esplicitamente chiuso il {target_date}")
+            return (False, None, None), []
+
+        override = (None, None, None)
+        if day_info['hours']:
+            override = (True, day_info['hours'][0].hour, day_info['hours'][1].hour)
+            print(f"📅 Orari di lavoro per {target_date}: {override[1]}:00 - {override[2]}:00")
+
+        available_slots = self._slots_for_day(
+            target_date, day_info, duration_minutes, start_hour, end_hour, slot_interval
+        )
+        print(f"📊 Slot disponibili per {target_date}: {len(available_slots)}")
+        return override, available_slots
+
+    def _parse_event_datetime(self, value):
+        """Converte un dateTime di Google Calendar in datetime nel fuso del business."""
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(self.timezone)
+
+    def _list_events(self, calendar_id, time_min, time_max):
+        """Scarica tutti gli eventi (espansi) di un calendario nell'intervallo, gestendo la paginazione."""
+        events = []
+        page_token = None
+        while True:
+            events_result = self._execute(self.service.events().list(
+                calendarId=calendar_id,
+                timeMin=time_min.isoformat(),
+                timeMax=time_max.isoformat(),
                 singleEvents=True,
                 orderBy='startTime',
-            ).execute()
-            
-            busy_events = events_result.get('items', [])
-            
-            # 3. Processa eventi e crea intervalli occupati
-            busy_intervals = []
-            for event in busy_events:
-                if event.get('status') == 'cancelled': continue
-                summary = event.get('summary', '').upper()
-                if any(keyword in summary for keyword in ['ORARI', 'CHIUSO', 'APERTO']): continue
-
-                start_dt_str = event['start'].get('dateTime')
-                end_dt_str = event['end'].get('dateTime')
-                
-                if not start_dt_str or not end_dt_str: continue # Salta eventi all-day
-                
-                event_start = datetime.fromisoformat(start_dt_str.replace('Z', '+00:00')).astimezone(self.timezone)
-                event_end = datetime.fromisoformat(end_dt_str.replace('Z', '+00:00')).astimezone(self.timezone)
-                busy_intervals.append({'start': event_start, 'end': event_end})
-            
-            # 4. Genera slot candidati e verifica disponibilità
-            available_slots = []
-            current_time = work_start
-            slot_duration = timedelta(minutes=duration_minutes)
-            slot_step = timedelta(minutes=slot_interval)
-            
-            while current_time + slot_duration <= work_end:
-                slot_end = current_time + slot_duration
-                is_free = all(current_time >= busy['end'] or slot_end <= busy['start'] for busy in busy_intervals)
-                
-                if is_free:
-                    available_slots.append({'start': current_time.strftime('%H:%M'), 'end': slot_end.strftime('%H:%M')})
-                
-                current_time += slot_step
-            
-            print(f"📊 Slot disponibili per {date}: {len(available_slots)}")
-            return available_slots
-            
+                pageToken=page_token
+            ))
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                return events
+
+    def _list_events_multi(self, calendar_ids, time_min, time_max):
+        """
+        Legge gli eventi di più calendari con un'unica richiesta HTTP batch.
+        Le poche risposte paginate vengono completate con _list_events.
+        """
+        if len(calendar_ids) == 1:
+            return {calendar_ids[0]: self._list_events(calendar_ids[0], time_min, time_max)}
+
+        responses = {}
+        errors = {}
+
+        def _collect(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        batch = self.service.new_batch_http_request(callback=_collect)
+        for index, calendar_id in enumerate(calendar_ids):
+            batch.add(self.service.events().list(
+                calendarId=calendar_id,
+                timeMin=time_min.isoformat(),
+                timeMax=time_max.isoformat(),
+                singleEvents=True,
+                orderBy='startTime'
+            ), request_id=str(index))
+        self._execute(batch)
+
+        events_by_calendar = {}
+        for index, calendar_id in enumerate(calendar_ids):
+            key = str(index)
+            if key in errors:
+                if index == 0:
+                    raise errors[key]
+                # Un calendario staff illeggibile non deve bloccare gli altri: lo consideriamo non disponibile
+                print(f"⚠️ Calendario {calendar_id} non leggibile: {errors[key]}")
+                events_by_calendar[calendar_id] = [self._unavailable_marker(time_min, time_max)]
+                continue
+            response = responses.get(key, {})
+            if response.get('nextPageToken'):
+                events_by_calendar[calendar_id] = self._list_events(calendar_id, time_min, time_max)
+            else:
+                events_by_calendar[calendar_id] = response.get('items', [])
+        return events_by_calendar
+
+    def _unavailable_marker(self, time_min, time_max):
+        """Evento fittizio che rende occupato un calendario per tutto l'intervallo."""
+        return {
+            'summary': 'NON DISPONIBILE',
+            'start': {'dateTime': time_min.isoformat()},
+            'end': {'dateTime': time_max.isoformat()},
+        }
+
+    def _classify_events(self, events, dates):
+        """
+        Smista in un solo passaggio gli eventi dell'intervallo sui singoli giorni:
+        per ogni data restituisce chiusura, eventuale override 'ORARI' e intervalli occupati.
+        """
+        days = {d: {'closed': False, 'hours': None, 'busy': []} for d in dates}
+        for event in events:
+            if event.get('status') == 'cancelled': continue
+            summary = event.get('summary', '').upper()
+            event_start, event_end, first_day, last_day = self._event_span(event)
+
+            is_closure = any(keyword in summary for keyword in CLOSED_KEYWORDS)
+            is_hours = not is_closure and any(keyword in summary for keyword in HOURS_KEYWORDS)
+
+            current = max(first_day, dates[0])
+            while current <= min(last_day, dates[-1]):
+                day = days[current]
+                if is_closure:
+                    day['closed'] = True
+                elif is_hours:
+                    # Vale il primo override della giornata, come nel controllo giornaliero
+                    if event_start and day['hours'] is None:
+                        day['hours'] = (event_start.time(), event_end.time())
+                elif event_start:
+                    day['busy'].append({'start': event_start, 'end': event_end})
+                current += timedelta(days=1)
+        return days
+
+    def _event_span(self, event):
+        """
+        Inizio, fine (None per gli eventi "tutto il giorno") e primo/ultimo giorno occupato
+        di un evento di Google Calendar.
+        """
+        start_str = event['start'].get('dateTime')
+        end_str = event['end'].get('dateTime')
+
+        if start_str and end_str:
+            event_start = self._parse_event_datetime(start_str)
+            event_end = self._parse_event_datetime(end_str)
+            first_day = event_start.date()
+            # Un evento che finisce a mezzanotte non occupa il giorno successivo
+            last_day = (event_end - timedelta(microseconds=1)).date() if event_end > event_start else first_day
+            return event_start, event_end, first_day, last_day
+
+        # Evento "tutto il giorno": la data di fine è esclusiva
+        first_day = datetime.strptime(event['start'].get('date'), '%Y-%m-%d').date()
+        last_day = datetime.strptime(event['end'].get('date'), '%Y-%m-%d').date() - timedelta(days=1)
+        return None, None, first_day, last_day
+
+    def _minutes_in_day(self, dt, target_date, round_up=False):
+        """
+        Minuti dalla mezzanotte di target_date (orario locale), tagliati a [0, 1440].
+        Con round_up i secondi contano come un minuto intero: per la fine di un intervallo occupato
+        (un evento che finisce alle 10:00:30 occupa anche il minuto delle 10:00).
+        """
+        local = dt.astimezone(self.timezone)
+        if local.date() < target_date: return 0
+        if local.date() > target_date: return 24 * 60
+        minutes = local.hour * 60 + local.minute
+        if round_up and (local.second or local.microsecond):
+            minutes += 1
+        return minutes
+
+    def _slots_for_day(self, target_date, day_info, duration_minutes, start_hour, end_hour, slot_interval, not_before=None):
+        """
+        Genera gli slot liberi di un giorno già classificato. Uno slot è libero se almeno
+        un calendario è libero; 'calendar_ids' elenca i calendari prenotabili per quello slot.
+        """
+        return self._slots_for_day_multi(
+            target_date, day_info, [duration_minutes], start_hour, end_hour, slot_interval, not_before
+        )[duration_minutes]
+
+    def _slots_for_day_multi(self, target_date, day_info, durations, start_hour, end_hour, slot_interval, not_before=None):
+        """Come _slots_for_day, ma per più durate con un solo passaggio sugli intervalli occupati."""
+        if day_info['closed']:
+            return {duration: [] for duration in durations}
+
+        dynamic_hours = day_info['hours']
+        actual_start_hour = dynamic_hours[0].hour if dynamic_hours else start_hour
+        actual_end_hour = dynamic_hours[1].hour if dynamic_hours else end_hour
+
+        busy_by_calendar = {
+            calendar_id: [(self._minutes_in_day(b['start'], target_date), self._minutes_in_day(b['end'], target_date, round_up=True)) for b in busy]
+            for calendar_id, busy in day_info['busy'].items()
+        }
+        not_before_minutes = None
+        if not_before is not None:
+            local_not_before = not_before.astimezone(self.timezone)
+            if local_not_before.date() > target_date:
+                return {duration: [] for duration in durations}
+            if local_not_before.date() == target_date:
+                # Secondi e microsecondi contano: uno slot alle 10:00 non è "dopo" le 10:00:30
+                not_before_minutes = local_not_before.hour * 60 + local_not_before.minute
+
+        free = slot_engine.find_free_slots(
+            actual_start_hour * 60, actual_end_hour * 60, busy_by_calendar,
+            durations, slot_interval, not_before_minutes
+        )
+        return {
+            duration: [
+                {
+                    'start': slot_engine.format_minutes(start),
+                    'end': slot_engine.format_minutes(start + duration),
+                    'calendar_ids': calendar_ids
+                }
+                for start, calendar_ids in free[duration]
+            ]
+            for duration in durations
+        }
+
+    def get_available_slots_for_durations(self, date: str, durations, start_hour: int, end_hour: int, slot_interval: int = 30):
+        """
+        Slot liberi di un giorno per più durate (es. tutti i servizi del business)
+        con una sola lettura del calendario. Restituisce {durata: slot}.
+        """
+        durations = sorted(set(durations))
+        if not self.service or not self.calendar_ids:
+            print("❌ Servizio calendar non disponibile")
+            return {duration: [] for duration in durations}
+
+        try:
+            target_date = datetime.strptime(date, '%Y-%m-%d').date()
+            day_info = self._scan_dates([target_date])[target_date]
+            return self._slots_for_day_multi(target_date, day_info, durations, start_hour, end_hour, slot_interval)
+        except resilience.DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"❌ Errore ricerca slot: {e}")
+            return {duration: [] for duration in durations}
+
+    def get_available_slots_range(self, start_date: str, days: int, duration_minutes: int, start_hour: int, end_hour: int,
+                                  slot_interval: int = 30, first_only: bool = False, not_before=None):
+        """
+        Calcola la disponibilità su più giorni con un'unica lettura del calendario.
+        Restituisce una lista di (data 'AAAA-MM-GG', slot) in ordine cronologico; con
+        first_only=True si ferma al primo giorno che ha almeno uno slot libero.
+        not_before (datetime con fuso) scarta gli slot che iniziano prima di quell'istante.
+        """
+        if not self.service or not self.calendar_ids:
+            print("❌ Servizio calendar non disponibile")
+            return []
+
+        try:
+            dates = self._horizon_dates(start_date, days)
+            classified = self._scan_dates(dates)
+            return self._range_results(dates, classified, duration_minutes, start_hour, end_hour, slot_interval, first_only, not_before)
+
+        except resilience.DependencyUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Errore ricerca slot su intervallo: {e}")
             return []
 
+    def _horizon_dates(self, start_date, days):
+        first_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+        return [first_date + timedelta(days=i) for i in range(days)]
+
+    def _range_results(self, dates, classified, duration_minutes, start_hour, end_hour, slot_interval, first_only, not_before):
+        results = []
+        for target_date in dates:
+            slots = self._slots_for_day(
+                target_date, classified[target_date], duration_minutes,
+                start_hour, end_hour, slot_interval, not_before
+            )
+            if first_only:
+                if slots:
+                    return [(target_date.strftime('%Y-%m-%d'), slots)]
+                continue
+            results.append((target_date.strftime('%Y-%m-%d'), slots))
+
+        print(f"📊 Disponibilità calcolata su {len(dates)} giorni dal {dates[0]}")
+        return results
+
     def is_day_closed(self, date_str):
         """ Funzione helper per verificare solo la chiusura esplicita """
-        # ... implementazione simile a get_working_hours_for_date ma controlla solo 'CHIUSO'
-        return False # Semplificato per brevità, la logica principale è già in get_working_hours
+        day_info = self.scan_day(date_str)
+        return bool(day_info and day_info['closed'])
 
-    def create_appointment(self, date, start_time, duration_minutes, customer_name, customer_phone, service_type="Appuntamento", notes=""):
+    def create_appointment(self, date, start_time, duration_minutes, customer_name, customer_phone, service_type="Appuntamento", notes="", calendar_id=None):
+        """
+        Crea l'evento sul calendario indicato: quello scelto dalla prenotazione tra i 'calendar_ids'
+        dello slot (vedi slot_reservations), che tiene conto di chiusure e orari speciali; senza
+        calendar_id usa il calendario principale.
+        """
         if not self.service or not self.calendar_ids: return None
         try:
-            start_dt = self.timezone.localize(datetime.strptime(f"{date} {start_time}", '%Y-%m-%d %H:%M'))
-            end_dt = start_dt + timedelta(minutes=duration_minutes)
-
-            event = {
-                'summary': f"{service_type} - {customer_name}",
-                'description': f"Cliente: {customer_name}\nTelefono: {customer_phone}\nServizio: {service_type}\nNote: {notes}",
-                'start': {'dateTime': start_dt.isoformat(), 'timeZone': 'Europe/Rome'},
-                'end': {'dateTime': end_dt.isoformat(), 'timeZone': 'Europe/Rome'},
-            }
-            
-            created_event = self.service.events().insert(calendarId=self.calendar_ids[0], body=event).execute()
-            print(f"✅ Appuntamento creato con ID: {created_event.get('id')}")
+            _, _, event = self._appointment_event(date, start_time, duration_minutes, customer_name, customer_phone, service_type, notes)
+            calendar_id = calendar_id or self.calendar_ids[0]
+
+            created_event = self._execute(self.service.events().insert(calendarId=calendar_id, body=event))
+            print(f"✅ Appuntamento creato con ID: {created_event.get('id')} su {calendar_id}")
             return created_event.get('id')
             
+        except resilience.DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"❌ Errore creazione appuntamento: {e}")
             return None
 
-    def cancel_appointment(self, event_id):
+    def _appointment_event(self, date, start_time, duration_minutes, customer_name, customer_phone, service_type, notes):
+        """Intervallo e corpo dell'evento Google Calendar per un appuntamento."""
+        start_dt = self.timezone.localize(datetime.strptime(f"{date} {start_time}", '%Y-%m-%d %H:%M'))
+        end_dt = start_dt + timedelta(minutes=duration_minutes)
+        event = {
+            'summary': f"{service_type} - {customer_name}",
+            'description': f"Cliente: {customer_name}\nTelefono: {customer_phone}\nServizio: {service_type}\nNote: {notes}",
+            'start': {'dateTime': start_dt.isoformat(), 'timeZone': 'Europe/Rome'},
+            'end': {'dateTime': end_dt.isoformat(), 'timeZone': 'Europe/Rome'},
+        }
+        return start_dt, end_dt, event
+
+    def cancel_appointment(self, event_id, calendar_id=None):
         if not self.service or not self.calendar_ids: return False
         try:
-            self.service.events().delete(calendarId=self.calendar_ids[0], eventId=event_id).execute()
+            self._execute(self.service.events().delete(calendarId=calendar_id or self.calendar_ids[0], eventId=event_id))
             print(f"✅ Appuntamento {event_id} cancellato")
             return True
+        except resilience.DependencyUnavailable:
+            raise
         except Exception as e:
             print(f"❌ Errore cancellazione: {e}")
             return False
             
     def check_business_hours_override(self, date_str):
         try:
-            working_start, working_end = self.get_working_hours_for_date(date_str)
-            if working_start is None and working_end is None and self.is_day_closed(date_str):
+            day_info = self.scan_day(date_str)
+            if not day_info:
+                return None, None, None # Calendario non disponibile, usa default
+            if day_info['closed']:
                 return False, None, None # Chiuso
-            elif working_start and working_end:
+            elif day_info['hours']:
+                working_start, working_end = day_info['hours']
                 return True, working_start.hour, working_end.hour # Orari speciali
             else:
                 return None, None, None # Nessun override, usa default
         except Exception as e:
             print(f"⚠️ Errore controllo override orari: {e}")
-            return None, None, None
\ No newline at end of file
+            return None, None, None
@@ -0,0 +1,269 @@
+# calendar_watch.py - Notifiche push di Google Calendar (events.watch) per invalidare le disponibilità
+#
+# Per ogni calendario di un business apriamo un canale di notifica verso /calendar/notifications
+# (i canali si aprono quando il business riceve un calendario, vedi manage_business).
+# Quando il titolare aggiunge a mano un evento (es. "CHIUSO" o "ORARI") Google ci avvisa e
+# invalidiamo subito solo le disponibilità di quel business, in tutti i worker: la modifica viene
+# registrata nella collection calendar_changes, il cui change stream avvisa gli altri processi. La
+# configurazione del business (e la sua cache) resta intatta. I canali scadono, quindi un job
+# APScheduler li rinnova prima della scadenza.
+
+import os
+import secrets
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+# URL pubblico HTTPS dell'endpoint /calendar/notifications (senza, le notifiche restano disattivate)
+CALENDAR_WEBHOOK_URL = os.getenv("CALENDAR_WEBHOOK_URL")
+CALENDAR_CHANNEL_TTL_SECONDS = int(os.getenv("CALENDAR_CHANNEL_TTL_SECONDS", str(7 * 24 * 3600)))
+CALENDAR_CHANNEL_RENEW_BEFORE_SECONDS = int(os.getenv("CALENDAR_CHANNEL_RENEW_BEFORE_SECONDS", str(24 * 3600)))
+CALENDAR_CHANNEL_RENEW_INTERVAL_MINUTES = int(os.getenv("CALENDAR_CHANNEL_RENEW_INTERVAL_MINUTES", "60"))
+
+# Tempo concesso a un worker per rinnovare un canale prima che un altro possa riprovarci
+RENEW_CLAIM_SECONDS = 300
+
+
+class CalendarWatchManager:
+    """
+    Gestisce i canali events.watch salvati nella collection calendar_channels
+    (channel_id, resource_id, token, business_id, calendar_id, expiration) e registra le modifiche
+    segnalate in calendar_changes (_id = business_id, changed_at). Con collection motor si usano
+    le varianti a* (async_app).
+    """
+
+    def __init__(self, channels_collection, changes_collection, address=CALENDAR_WEBHOOK_URL):
+        self.channels = channels_collection
+        self.changes = changes_collection
+        self.address = address
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._scheduler = None
+        self._scheduler_pid = None
+        self._watcher_pid = None
+        self.stats = {"notifications": 0, "invalidations": 0, "renewals": 0, "rejected": 0}
+
+    def is_enabled(self):
+        return bool(self.address)
+
+    def watch_calendar(self, calendar_service, business_id, calendar_id):
+        """Apre un canale di notifica per un calendario e lo registra. Restituisce il documento salvato."""
+        channel_id = str(uuid.uuid4())
+        token = secrets.token_urlsafe(24)
+        response = calendar_service._execute(calendar_service.service.events().watch(
+            calendarId=calendar_id,
+            body={
+                'id': channel_id,
+                'type': 'web_hook',
+                'address': self.address,
+                'token': token,
+                'params': {'ttl': str(CALENDAR_CHANNEL_TTL_SECONDS)},
+            }
+        ))
+        channel = {
+            "channel_id": channel_id,
+            "resource_id": response.get('resourceId'),
+            "token": token,
+            "business_id": business_id,
+            "calendar_id": calendar_id,
+            "expiration": datetime.utcfromtimestamp(int(response['expiration']) / 1000) if response.get('expiration')
+                          else datetime.utcnow() + timedelta(seconds=CALENDAR_CHANNEL_TTL_SECONDS),
+            "created_at": datetime.utcnow(),
+        }
+        self.channels.insert_one(channel)
+        print(f"📡 Notifiche attive per {calendar_id} fino al {channel['expiration']:%Y-%m-%d %H:%M} UTC")
+        return channel
+
+    def watch_business(self, business_id, calendar_service):
+        """Apre i canali mancanti per tutti i calendari del business. Restituisce quanti ne ha aperti."""
+        if not self.is_enabled():
+            print("⚠️ CALENDAR_WEBHOOK_URL non impostato: notifiche calendario disattivate")
+            return 0
+        opened = 0
+        for calendar_id in calendar_service.calendar_ids:
+            active = self.channels.find_one(
+                {"business_id": business_id, "calendar_id": calendar_id, "expiration": {"$gt": datetime.utcnow()}},
+                {"_id": 1}
+            )
+            if active:
+                continue
+            try:
+                self.watch_calendar(calendar_service, business_id, calendar_id)
+                opened += 1
+            except Exception as e:
+                print(f"❌ Impossibile attivare le notifiche per {calendar_id}: {e}")
+        return opened
+
+    def stop_channel(self, calendar_service, channel):
+        """Chiude il canale su Google (se ancora aperto) e lo rimuove dalla collection."""
+        try:
+            calendar_service._execute(calendar_service.service.channels().stop(
+                body={'id': channel['channel_id'], 'resourceId': channel['resource_id']}
+            ))
+        except Exception as e:
+            print(f"⚠️ Stop canale {channel['channel_id']} non riuscito (probabilmente già scaduto): {e}")
+        self.channels.delete_one({"channel_id": channel['channel_id']})
+
+    def add_change_listener(self, callback):
+        """Registra callback(business_id), chiamata quando cambia un calendario del business, anche se la notifica arriva a un altro worker."""
+        self._listeners.append(callback)
+
+    def _notify_listeners(self, business_id):
+        for callback in self._listeners:
+            try:
+                callback(business_id)
+            except Exception as e:
+                print(f"⚠️ Errore listener modifica calendario: {e}")
+
+    def _channel_lookup(self, headers):
+        channel_id = headers.get('X-Goog-Channel-ID')
+        return channel_id, ({"channel_id": channel_id}, {"token": 1, "business_id": 1, "calendar_id": 1})
+
+    def _accept(self, channel_id, channel, headers):
+        """Verifica canale e token: restituisce il canale se la notifica segnala una modifica, altrimenti None."""
+        if not channel or not secrets.compare_digest(channel.get('token') or '', headers.get('X-Goog-Channel-Token') or ''):
+            with self._lock:
+                self.stats["rejected"] += 1
+            print(f"⚠️ Notifica calendario ignorata: canale sconosciuto o token errato ({channel_id})")
+            return None
+
+        with self._lock:
+            self.stats["notifications"] += 1
+        if headers.get('X-Goog-Resource-State') == 'sync':
+            # Primo messaggio dopo events.watch: conferma che il canale funziona, nessuna modifica
+            return None
+        return channel
+
+    def _change_update(self, business_id):
+        return {"_id": business_id}, {"$set": {"changed_at": datetime.utcnow()}}
+
+    def _changed(self, channel):
+        business_id = channel['business_id']
+        # In questo worker subito; gli altri lo sanno dal change stream di calendar_changes
+        self._notify_listeners(business_id)
+        with self._lock:
+            self.stats["invalidations"] += 1
+        print(f"🔔 Calendario {channel['calendar_id']} modificato: disponibilità del business {business_id} invalidate")
+        return business_id
+
+    def handle_notification(self, headers):
+        """
+        Elabora una notifica di Google (solo header X-Goog-*). Restituisce il business_id
+        invalidato, oppure None per handshake iniziale, canali sconosciuti o token errati.
+        """
+        channel_id, lookup = self._channel_lookup(headers)
+        channel = self._accept(channel_id, self.channels.find_one(*lookup) if channel_id else None, headers)
+        if not channel:
+            return None
+        try:
+            self.changes.update_one(*self._change_update(channel['business_id']), upsert=True)
+        except Exception as e:
+            print(f"⚠️ Errore propagazione modifica calendario: {e}")
+        return self._changed(channel)
+
+    async def ahandle_notification(self, headers):
+        channel_id, lookup = self._channel_lookup(headers)
+        channel = self._accept(channel_id, await self.channels.find_one(*lookup) if channel_id else None, headers)
+        if not channel:
+            return None
+        try:
+            await self.changes.update_one(*self._change_update(channel['business_id']), upsert=True)
+        except Exception as e:
+            print(f"⚠️ Errore propagazione modifica calendario: {e}")
+        return self._changed(channel)
+
+    def _ensure_change_watcher(self):
+        """Ascolta calendar_changes una volta per processo, se qualcuno è interessato alle modifiche."""
+        if not self._listeners or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch_changes, name="calendar-changes-watcher", daemon=True).start()
+
+    def _watch_changes(self):
+        """Avvisa i listener delle modifiche registrate da altri worker. Richiede un replica set (es. Atlas)."""
+        while True:
+            started = False
+            try:
+                with self.changes.watch() as stream:
+                    started = True
+                    print("👀 Change stream calendar_changes attivo")
+                    for change in stream:
+                        if change.get("documentKey"):
+                            self._notify_listeners(change["documentKey"]["_id"])
+            except Exception as e:
+                if not started:
+                    # Es. MongoDB standalone: il mirror si riallinea comunque alla scadenza del suo intervallo
+                    print(f"⚠️ Change stream calendar_changes non disponibile: {e}")
+                    return
+                print(f"⚠️ Change stream calendar_changes interrotto, riconnessione: {e}")
+            # Durante la disconnessione potremmo aver perso modifiche
+            self._notify_listeners(None)
+            time.sleep(5)
+
+    def _claim_expiring(self):
+        """Prende in carico un canale in scadenza, così un solo worker lo rinnova."""
+        now = datetime.utcnow()
+        return self.channels.find_one_and_update(
+            {
+                "expiration": {"$lt": now + timedelta(seconds=CALENDAR_CHANNEL_RENEW_BEFORE_SECONDS)},
+                "$or": [{"renewing_until": {"$exists": False}}, {"renewing_until": {"$lt": now}}],
+            },
+            {"$set": {"renewing_until": now + timedelta(seconds=RENEW_CLAIM_SECONDS)}},
+            sort=[("expiration", 1)]
+        )
+
+    def renew_expiring(self, get_calendar_service):
+        """Sostituisce i canali vicini alla scadenza: prima apre il nuovo, poi chiude il vecchio."""
+        renewed = 0
+        while True:
+            channel = self._claim_expiring()
+            if not channel:
+                return renewed
+            calendar_service = get_calendar_service(channel['business_id'])
+            if not calendar_service or channel['calendar_id'] not in calendar_service.calendar_ids:
+                # Business rimosso o calendario non più associato: il canale non serve più
+                print(f"🗑️ Canale {channel['channel_id']} non più necessario")
+                if calendar_service:
+                    self.stop_channel(calendar_service, channel)
+                else:
+                    self.channels.delete_one({"_id": channel['_id']})
+                continue
+            try:
+                self.watch_calendar(calendar_service, channel['business_id'], channel['calendar_id'])
+            except Exception as e:
+                # Il claim scade da solo: il prossimo giro riproverà
+                print(f"❌ Rinnovo canale per {channel['calendar_id']} fallito: {e}")
+                continue
+            self.stop_channel(calendar_service, channel)
+            renewed += 1
+            with self._lock:
+                self.stats["renewals"] += 1
+
+    def ensure_renewer(self, get_calendar_service):
+        """
+        Avvia il job di rinnovo e l'ascolto di calendar_changes una volta per processo (scheduler
+        e thread non sopravvivono al fork di gunicorn).
+        """
+        if not self.is_enabled():
+            return
+        self._ensure_change_watcher()
+        if self._scheduler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._scheduler_pid == os.getpid():
+                return
+            self._scheduler_pid = os.getpid()
+            self._scheduler = BackgroundScheduler(daemon=True)
+            self._scheduler.add_job(
+                self.renew_expiring, 'interval', args=[get_calendar_service],
+                minutes=CALENDAR_CHANNEL_RENEW_INTERVAL_MINUTES, next_run_time=datetime.now(),
+                id='calendar-channel-renewer', max_instances=1, coalesce=True
+            )
+            self._scheduler.start()
+        print(f"⏰ Rinnovo canali calendario ogni {CALENDAR_CHANNEL_RENEW_INTERVAL_MINUTES} minuti")
@@ -0,0 +1,81 @@
+# conversation_state.py - Stato strutturato della trattativa di prenotazione
+#
+# I messaggi più vecchi escono dalla cronologia passata al modello, ma quello che serve davvero
+# per concludere la prenotazione (servizio scelto, data considerata, orari proposti, ultimo
+# appuntamento) viene ricavato dai tool eseguiti e salvato sul documento della conversazione.
+
+import json
+from datetime import datetime, timedelta
+
+import booking_logic
+
+# Oltre questo tempo servizio, data e orari proposti non valgono più: è una nuova richiesta
+STATE_TTL = timedelta(hours=12)
+MAX_PROPOSED_SLOTS = 6
+
+
+def empty_state():
+    return {"service": None, "date": None, "proposed_slots": [], "last_booking": None, "updated_at": None}
+
+
+def _parse_json(result):
+    try:
+        return json.loads(result)
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_tool_event(state, tool_name, args, result):
+    """Aggiorna lo stato con l'esito di un tool; i tool falliti non cambiano nulla."""
+    state = dict(empty_state(), **(state or {}))
+    parsed = _parse_json(result)
+
+    if tool_name == "get_available_slots" and isinstance(parsed, list):
+        state.update(service=args.get("service_name"), date=args.get("date"), proposed_slots=parsed[:MAX_PROPOSED_SLOTS])
+    elif tool_name == "get_next_available_slot" and isinstance(parsed, dict) and parsed.get("date"):
+        state.update(service=args.get("service_name"), date=parsed["date"], proposed_slots=[parsed["time"]])
+    elif tool_name == "create_or_update_booking" and str(result).startswith(booking_logic.BOOKING_CONFIRMED_PREFIX):
+        # Trattativa conclusa: resta solo il riferimento all'appuntamento
+        state.update(service=None, date=None, proposed_slots=[], last_booking={
+            "service": args.get("service_name"), "date": args.get("date"), "time": args.get("time"),
+        })
+    elif tool_name == "cancel_booking" and str(result).startswith(booking_logic.BOOKING_CANCELLED_PREFIX):
+        state.update(last_booking=None)
+    else:
+        return state
+
+    state["updated_at"] = datetime.now().isoformat()
+    return state
+
+
+def apply_tool_events(state, tool_events):
+    for tool_name, args, result in tool_events:
+        state = apply_tool_event(state, tool_name, args, result)
+    return state
+
+
+def is_negotiation_fresh(state, now=None):
+    updated_at = (state or {}).get("updated_at")
+    if not updated_at:
+        return False
+    return (now or datetime.now()) - datetime.fromisoformat(updated_at) <= STATE_TTL
+
+
+def format_state_block(state, now=None):
+    """Riassunto compatto dello stato per il prompt, o None se non c'è nulla di utile."""
+    if not state:
+        return None
+    parts = []
+    if is_negotiation_fresh(state, now):
+        if state.get("service"):
+            parts.append(f"servizio scelto: {state['service']}")
+        if state.get("date"):
+            parts.append(f"data considerata: {state['date']}")
+        if state.get("proposed_slots"):
+            parts.append(f"orari proposti: {', '.join(state['proposed_slots'])}")
+    last_booking = state.get("last_booking")
+    if last_booking:
+        parts.append(f"ultimo appuntamento confermato: '{last_booking['service']}' il {last_booking['date']} alle {last_booking['time']}")
+    if not parts:
+        return None
+    return "Stato della conversazione (dai turni precedenti): " + "; ".join(parts) + "."
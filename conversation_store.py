@@ -0,0 +1,67 @@
+# conversation_store.py - Cronologia delle conversazioni con limite applicato dal server
+#
+# Una lettura proiettata sugli ultimi messaggi e una scrittura atomica ($push con $each/$slice):
+# due messaggi concorrenti dello stesso utente si accodano invece di sovrascriversi.
+# Accanto ai messaggi c'è lo stato strutturato della trattativa (vedi conversation_state).
+
+from datetime import datetime
+
+HISTORY_READ_LIMIT = 12   # Messaggi letti; quanti arrivano al modello lo decide il budget di token in prompts
+HISTORY_STORE_LIMIT = 12  # Messaggi conservati nel documento
+
+
+def _conversation_filter(user_id, business_id):
+    return {"user_id": user_id, "business_id": business_id}
+
+
+def _history_projection(limit):
+    return {"_id": 0, "messages": {"$slice": -limit}, "state": 1}
+
+
+def _append_update(new_messages, limit, state):
+    update = {
+        "$push": {"messages": {"$each": new_messages, "$slice": -limit}},
+        "$set": {"last_interaction": datetime.now().isoformat()},
+    }
+    if state is not None:
+        update["$set"]["state"] = state
+    return update
+
+
+def _split_conversation(conversation):
+    if not conversation:
+        return [], None
+    return conversation.get("messages", []), conversation.get("state")
+
+
+def exchange_messages(incoming_msg, response_text):
+    return [
+        {"role": "user", "content": incoming_msg},
+        {"role": "assistant", "content": response_text},
+    ]
+
+
+def load_conversation(collection, user_id, business_id, limit=HISTORY_READ_LIMIT):
+    """Ultimi `limit` messaggi e stato della conversazione: ([], None) se non esiste."""
+    return _split_conversation(
+        collection.find_one(_conversation_filter(user_id, business_id), _history_projection(limit))
+    )
+
+
+def append_messages(collection, user_id, business_id, new_messages, state=None, limit=HISTORY_STORE_LIMIT):
+    """Accoda i messaggi (e salva lo stato) in un'unica operazione atomica, creando la conversazione se serve."""
+    collection.update_one(
+        _conversation_filter(user_id, business_id), _append_update(new_messages, limit, state), upsert=True
+    )
+
+
+async def aload_conversation(collection, user_id, business_id, limit=HISTORY_READ_LIMIT):
+    return _split_conversation(
+        await collection.find_one(_conversation_filter(user_id, business_id), _history_projection(limit))
+    )
+
+
+async def aappend_messages(collection, user_id, business_id, new_messages, state=None, limit=HISTORY_STORE_LIMIT):
+    await collection.update_one(
+        _conversation_filter(user_id, business_id), _append_update(new_messages, limit, state), upsert=True
+    )
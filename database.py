@@ -1,6 +1,8 @@
 import os
 from pymongo import MongoClient
 from pymongo.server_api import ServerApi
+from db_indexes import INDEX_SPECS, missing_indexes
+from metrics import mongo_listener
 
 class MongoClientWrapper:
     _instance = None
@@ -20,7 +22,7 @@ class MongoClientWrapper:
 
         try:
             server_api = ServerApi('1')
-            self.client = MongoClient(uri, server_api=server_api)
+            self.client = MongoClient(uri, server_api=server_api, event_listeners=[mongo_listener])
             self.client.admin.command('ping')
             print("--- CONNESSIONE A MONGODB STABILITA CON SUCCESSO! ---")
             
@@ -30,10 +32,36 @@ class MongoClientWrapper:
             self.customers = db.customers
             self.bookings = db.bookings
             self.pending_bookings = db.pending_bookings
+            self.inbound_jobs = db.inbound_jobs
+            self.inbound_messages = db.inbound_messages
+            self.calendar_channels = db.calendar_channels
+            self.calendar_changes = db.calendar_changes
 
         except Exception as e:
             print(f"--- ERRORE FATALE DI CONNESSIONE A MONGODB ---")
             raise Exception(f"Impossibile connettersi a MongoDB: {e}")
 
+    def ensure_indexes(self):
+        """
+        Crea (se mancano) e verifica gli indici usati dalle query calde.
+        create_indexes è idempotente, quindi è sicuro chiamarlo a ogni avvio.
+        Restituisce True se alla fine tutti gli indici attesi sono presenti.
+        """
+        all_present = True
+        for collection_name, models in INDEX_SPECS.items():
+            collection = getattr(self, collection_name)
+            try:
+                collection.create_indexes(models)
+            except Exception as e:
+                # Es. numeri Twilio duplicati che impediscono l'indice univoco
+                print(f"⚠️ Impossibile creare gli indici di {collection_name}: {e}")
+            missing = missing_indexes(collection_name, collection.index_information())
+            if missing:
+                all_present = False
+                print(f"❌ Indici mancanti su {collection_name}: {', '.join(missing)}")
+        if all_present:
+            print("✅ Indici MongoDB verificati")
+        return all_present
+
 # Nome corretto e coerente
 db_connection = MongoClientWrapper()
\ No newline at end of file
@@ -0,0 +1,49 @@
+# db_indexes.py - Indici richiesti dalle query calde, condivisi da database e async_database
+
+from pymongo import ASCENDING, IndexModel
+
+# collection -> indici. I nomi sono espliciti così la verifica non dipende dai default di MongoDB.
+INDEX_SPECS = {
+    "businesses": [
+        IndexModel([("twilio_phone_number", ASCENDING)], name="twilio_phone_number_unique", unique=True,
+                   partialFilterExpression={"twilio_phone_number": {"$type": "string"}}),
+    ],
+    "conversations": [
+        IndexModel([("user_id", ASCENDING), ("business_id", ASCENDING)], name="user_business_unique", unique=True),
+    ],
+    "bookings": [
+        IndexModel([("business_id", ASCENDING), ("start", ASCENDING)], name="business_start"),
+        IndexModel([("user_id", ASCENDING), ("business_id", ASCENDING), ("start", ASCENDING)], name="user_business_start"),
+        # Scansione dei promemoria (reminders): prenotazioni con promemoria da inviare, in ordine di inizio
+        IndexModel([("reminder_status", ASCENDING), ("start", ASCENDING)], name="reminder_status_start"),
+        # Status callback di Twilio: promemoria non recapitato, cercato per SID del messaggio
+        IndexModel([("reminder_sid", ASCENDING)], name="reminder_sid", sparse=True),
+    ],
+    "pending_bookings": [
+        IndexModel([("user_id", ASCENDING), ("business_id", ASCENDING)], name="user_business"),
+        # Un solo cliente alla volta può tenere uno slot (vedi slot_reservations)
+        IndexModel([("business_id", ASCENDING), ("calendar_id", ASCENDING), ("start", ASCENDING)],
+                   name="business_calendar_start_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "inbound_jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+    # Deduplica dei messaggi Twilio per MessageSid (_id): i documenti scadono da soli
+    "inbound_messages": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "calendar_channels": [
+        IndexModel([("channel_id", ASCENDING)], name="channel_id_unique", unique=True),
+        IndexModel([("business_id", ASCENDING), ("calendar_id", ASCENDING)], name="business_calendar"),
+        IndexModel([("expiration", ASCENDING)], name="expiration"),
+    ],
+}
+
+
+def missing_indexes(collection_name, index_information):
+    """Nomi degli indici attesi che non risultano in index_information() della collection."""
+    return [
+        model.document["name"] for model in INDEX_SPECS.get(collection_name, [])
+        if model.document["name"] not in index_information
+    ]
@@ -0,0 +1,218 @@
+# fake_calendar.py - Finta API Google Calendar v3 in memoria, per prove locali e benchmark
+#
+# Implementa il sottoinsieme usato da CalendarService e CalendarMirror: events().list
+# (intervallo, paginazione, syncToken), insert, delete, watch, channels().stop e le richieste batch.
+# Uso: service = FakeCalendarAPI(); calendar_service.service = service
+
+import itertools
+import threading
+import time
+from datetime import datetime
+
+import httplib2
+import pytz
+from googleapiclient.errors import HttpError
+
+
+class _FakeRequest:
+    def __init__(self, api, func):
+        self.api = api
+        self.func = func
+
+    def execute(self, http=None, num_retries=0):
+        self.api._round_trip()
+        return self.func()
+
+
+class _FakeBatch:
+    def __init__(self, api, callback):
+        self.api = api
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request))
+
+    def execute(self, http=None):
+        # Una sola richiesta HTTP per tutto il batch, come nella libreria reale
+        self.api._round_trip()
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.func(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class _FakeEvents:
+    def __init__(self, api):
+        self.api = api
+
+    def list(self, calendarId, timeMin=None, timeMax=None, singleEvents=False, orderBy=None,
+             pageToken=None, syncToken=None, showDeleted=False, maxResults=None, **kwargs):
+        self.api.calls.append(('list', calendarId, 'sync' if syncToken else 'full'))
+        return _FakeRequest(self.api, lambda: self.api._list(
+            calendarId, timeMin, timeMax, pageToken, syncToken, showDeleted, maxResults or self.api.page_size
+        ))
+
+    def insert(self, calendarId, body, **kwargs):
+        self.api.calls.append(('insert', calendarId))
+        return _FakeRequest(self.api, lambda: self.api.add_event(calendarId, body))
+
+    def delete(self, calendarId, eventId, **kwargs):
+        self.api.calls.append(('delete', calendarId))
+        return _FakeRequest(self.api, lambda: self.api.delete_event(calendarId, eventId))
+
+    def watch(self, calendarId, body, **kwargs):
+        self.api.calls.append(('watch', calendarId))
+        return _FakeRequest(self.api, lambda: self.api._watch(calendarId, body))
+
+
+class _FakeChannels:
+    def __init__(self, api):
+        self.api = api
+
+    def stop(self, body):
+        self.api.calls.append(('stop', body.get('id')))
+        return _FakeRequest(self.api, lambda: self.api._stop_channel(body))
+
+
+class FakeCalendarAPI:
+    """
+    Sostituto di googleapiclient.discovery.build('calendar', 'v3') che tiene gli eventi in memoria.
+    Ogni modifica avanza un contatore; i syncToken lo registrano, così le letture incrementali
+    restituiscono solo le modifiche successive (cancellazioni comprese, con status 'cancelled').
+    invalidate_sync_tokens() simula il 410 Gone di Google; latency_seconds la latenza di rete.
+    """
+
+    def __init__(self, events_by_calendar=None, timezone='Europe/Rome', page_size=250, latency_seconds=0.0):
+        self.timezone = pytz.timezone(timezone)
+        self.page_size = page_size
+        self.latency_seconds = latency_seconds
+        self.calls = []
+        self.round_trips = 0
+        self._lock = threading.RLock()
+        self._events = {}
+        self._sequence = 0
+        self._token_epoch = 0
+        self._ids = itertools.count(1)
+        self.channels_by_id = {}
+        for calendar_id, events in (events_by_calendar or {}).items():
+            self._events.setdefault(calendar_id, {})
+            for event in events:
+                self.add_event(calendar_id, event)
+
+    # --- Interfaccia del client Google ---
+
+    def events(self):
+        return _FakeEvents(self)
+
+    def channels(self):
+        return _FakeChannels(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+    # --- Modifiche dirette (simulano chi lavora sul calendario da Google) ---
+
+    def add_event(self, calendar_id, body):
+        with self._lock:
+            event = dict(body)
+            event.setdefault('id', f"fake{next(self._ids)}")
+            event.setdefault('status', 'confirmed')
+            self._sequence += 1
+            self._events.setdefault(calendar_id, {})[event['id']] = (self._sequence, event)
+            return dict(event)
+
+    def delete_event(self, calendar_id, event_id):
+        with self._lock:
+            events = self._events.get(calendar_id, {})
+            if event_id not in events or events[event_id][1].get('status') == 'cancelled':
+                raise self._http_error(404, "Not Found")
+            self._sequence += 1
+            events[event_id] = (self._sequence, {'id': event_id, 'status': 'cancelled'})
+            return {}
+
+    def invalidate_sync_tokens(self):
+        with self._lock:
+            self._token_epoch += 1
+
+    # --- Implementazione ---
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _http_error(self, status, reason):
+        return HttpError(httplib2.Response({'status': status, 'reason': reason}), reason.encode())
+
+    def _bounds(self, event):
+        """Inizio e fine dell'evento come datetime consapevoli del fuso."""
+        bounds = []
+        for key in ('start', 'end'):
+            value = event[key]
+            if value.get('dateTime'):
+                bounds.append(datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')))
+            else:
+                bounds.append(self.timezone.localize(datetime.strptime(value['date'], '%Y-%m-%d')))
+        return bounds
+
+    def _parse_bound(self, value):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+    def _list(self, calendar_id, time_min, time_max, page_token, sync_token, show_deleted, page_size):
+        with self._lock:
+            if calendar_id not in self._events:
+                raise self._http_error(404, "Not Found")
+
+            if sync_token:
+                epoch, _, since = sync_token.partition(':')
+                if int(epoch) != self._token_epoch:
+                    raise self._http_error(410, "Gone")
+                entries = [(seq, event) for seq, event in self._events[calendar_id].values() if seq > int(since)]
+                entries.sort(key=lambda entry: entry[0])
+            else:
+                time_min, time_max = self._parse_bound(time_min), self._parse_bound(time_max)
+                entries, deleted = [], []
+                for seq, event in self._events[calendar_id].values():
+                    if event.get('status') == 'cancelled':
+                        if show_deleted:
+                            deleted.append((seq, event))
+                        continue
+                    start, end = self._bounds(event)
+                    if (time_max is None or start < time_max) and (time_min is None or end > time_min):
+                        entries.append((seq, event))
+                entries.sort(key=lambda entry: self._bounds(entry[1])[0])
+                entries += deleted
+
+            offset = int(page_token or 0)
+            page = [dict(event) for _, event in entries[offset:offset + page_size]]
+            result = {'items': page}
+            if offset + page_size < len(entries):
+                result['nextPageToken'] = str(offset + page_size)
+            else:
+                result['nextSyncToken'] = f"{self._token_epoch}:{self._sequence}"
+            return result
+
+    def _watch(self, calendar_id, body):
+        with self._lock:
+            if calendar_id not in self._events:
+                raise self._http_error(404, "Not Found")
+            ttl = int(body.get('params', {}).get('ttl', 604800))
+            channel = {
+                'kind': 'api#channel',
+                'id': body['id'],
+                'resourceId': f"resource-{calendar_id}",
+                'resourceUri': f"https://www.googleapis.com/calendar/v3/calendars/{calendar_id}/events",
+                'token': body.get('token'),
+                'expiration': str(int((time.time() + ttl) * 1000)),
+            }
+            self.channels_by_id[body['id']] = dict(channel, calendar_id=calendar_id, address=body['address'])
+            return channel
+
+    def _stop_channel(self, body):
+        with self._lock:
+            if self.channels_by_id.pop(body['id'], None) is None:
+                raise self._http_error(404, "Not Found")
+            return {}
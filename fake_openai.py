@@ -0,0 +1,106 @@
+# fake_openai.py - Finto endpoint OpenAI (chat.completions) su HTTP locale, per prove e load test
+#
+# Il client OpenAI dell'app non va modificato: basta puntare OPENAI_BASE_URL all'indirizzo del
+# server. Le risposte le decide un "responder" scritto dal chiamante, che riceve i messaggi della
+# richiesta e restituisce (tool_calls, testo); latency_seconds simula i tempi del modello.
+# Uso: server = FakeOpenAIServer(responder, latency_seconds=0.4); os.environ["OPENAI_BASE_URL"] = server.start()
+
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def tool_call(name, arguments):
+    """Tool call da restituire dal responder."""
+    return {"name": name, "arguments": arguments}
+
+
+class FakeOpenAIServer:
+    """
+    Server HTTP con thread per richiesta che risponde a POST /v1/chat/completions.
+    responder(messages, tools) -> (lista di tool_call(...) o None, testo o None).
+    """
+
+    def __init__(self, responder, latency_seconds=0.0, host="127.0.0.1", port=0):
+        self.responder = responder
+        self.latency_seconds = latency_seconds
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _completion(self, body):
+        with self._lock:
+            self.requests += 1
+            request_id = next(self._ids)
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        tool_calls, content = self.responder(body.get("messages", []), body.get("tools"))
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["content"] = None
+            message["tool_calls"] = [
+                {"id": f"call_{request_id}_{i}", "type": "function",
+                 "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])}}
+                for i, call in enumerate(tool_calls)
+            ]
+        # Stima grossolana dei token, sufficiente per i log di format_usage
+        prompt_tokens = len(json.dumps(body.get("messages", []), default=str)) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        return {
+            "id": f"chatcmpl-fake{request_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    return self._reply(404, {"error": {"message": "Not Found"}})
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                    return self._reply(200, server._completion(body))
+                except Exception as e:
+                    return self._reply(500, {"error": {"message": str(e), "type": "server_error"}})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,45 @@
+# fake_twilio.py - Finto invio di messaggi Twilio, per prove locali e benchmark dei promemoria
+#
+# Stessa interfaccia di reminders.TwilioReminderSender: send(from_number, to_number, content_sid, content_variables) -> SID.
+# Uso: ReminderScheduler(bookings, businesses, FakeTwilioSender(latency_seconds=0.1))
+
+import itertools
+import threading
+import time
+
+
+class FakeTwilioSender:
+    """
+    Registra i messaggi invece di inviarli. latency_seconds simula la durata della chiamata REST;
+    con fail_every=N fallisce una chiamata ogni N (errore temporaneo di Twilio).
+    """
+
+    def __init__(self, latency_seconds=0.0, fail_every=0):
+        self.latency_seconds = latency_seconds
+        self.fail_every = fail_every
+        self.sent = []
+        self._calls = itertools.count(1)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.max_in_flight = 0
+
+    def send(self, from_number, to_number, content_sid, content_variables):
+        with self._lock:
+            call = next(self._calls)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            if self.latency_seconds:
+                time.sleep(self.latency_seconds)
+            if self.fail_every and call % self.fail_every == 0:
+                raise RuntimeError("HTTP 429: Too Many Requests")
+            sid = f"SMfake{call:08d}"
+            with self._lock:
+                self.sent.append({
+                    "sid": sid, "from": from_number, "to": to_number, "content_sid": content_sid,
+                    "content_variables": content_variables, "at": time.monotonic(),
+                })
+            return sid
+        finally:
+            with self._lock:
+                self._in_flight -= 1
@@ -0,0 +1,116 @@
+# inbound_dedupe.py - Elaborazione idempotente dei messaggi in arrivo, per MessageSid di Twilio
+#
+# Se il webhook risponde lentamente Twilio può ripetere la consegna dello stesso messaggio: senza
+# questo controllo ripartirebbero modello e Calendar (e magari una seconda prenotazione) proprio
+# nei momenti di carico. Il primo worker che inserisce il documento con _id = MessageSid lo prende
+# in carico; le consegne ripetute ricevono la risposta già calcolata oppure, se l'elaborazione è
+# ancora in corso, un ack vuoto. I documenti scadono da soli (indice TTL su expires_at).
+
+import os
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+INBOUND_DEDUPE_TTL_SECONDS = int(os.getenv("INBOUND_DEDUPE_TTL_SECONDS", str(24 * 3600)))
+# Una presa in carico più vecchia di così appartiene a un worker morto: la consegna successiva la riprende
+INBOUND_PROCESSING_TIMEOUT_SECONDS = int(os.getenv("INBOUND_PROCESSING_TIMEOUT_SECONDS", "120"))
+
+stats = {"claimed": 0, "reclaimed": 0, "duplicates_done": 0, "duplicates_processing": 0}
+_stats_lock = threading.Lock()
+
+
+def _record(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+def _claim_document(message_sid, from_number, to_number, now):
+    return {
+        "_id": message_sid,
+        "from_number": from_number,
+        "to_number": to_number,
+        "status": "processing",
+        "claimed_at": now,
+        "expires_at": now + timedelta(seconds=INBOUND_DEDUPE_TTL_SECONDS),
+    }
+
+
+def _stale_claim(message_sid, now):
+    """Filtro e update per riprendere un messaggio rimasto 'processing' oltre il timeout."""
+    stale_filter = {
+        "_id": message_sid, "status": "processing",
+        "claimed_at": {"$lt": now - timedelta(seconds=INBOUND_PROCESSING_TIMEOUT_SECONDS)},
+    }
+    return stale_filter, {"$set": {"claimed_at": now}}
+
+
+def _duplicate(existing):
+    """Registra la consegna ripetuta e restituisce il documento esistente."""
+    if existing and existing.get("status") == "done":
+        _record("duplicates_done")
+        print(f"♻️ Messaggio {existing['_id']} già elaborato: risposta dalla cache")
+    else:
+        _record("duplicates_processing")
+        print("♻️ Messaggio già in elaborazione: ack vuoto alla consegna ripetuta")
+    return existing or {"status": "processing"}
+
+
+def _complete_update(reply, now):
+    return {"$set": {"status": "done", "reply": reply, "completed_at": now}}
+
+
+def claim(collection, message_sid, from_number, to_number):
+    """
+    Prende in carico il messaggio. Restituisce None se tocca a questo worker elaborarlo,
+    altrimenti il documento già presente: status 'done' (con 'reply') o 'processing'.
+    """
+    now = datetime.utcnow()
+    try:
+        collection.insert_one(_claim_document(message_sid, from_number, to_number, now))
+        _record("claimed")
+        return None
+    except DuplicateKeyError:
+        stale_filter, update = _stale_claim(message_sid, now)
+        if collection.find_one_and_update(stale_filter, update, return_document=ReturnDocument.AFTER):
+            _record("reclaimed")
+            return None
+    return _duplicate(collection.find_one({"_id": message_sid}))
+
+
+def complete(collection, message_sid, reply):
+    """Salva la risposta: le consegne ripetute del messaggio riceveranno questa."""
+    collection.update_one({"_id": message_sid}, _complete_update(reply, datetime.utcnow()))
+
+
+def is_done(collection, message_sid):
+    """True se il messaggio è già stato elaborato e la risposta salvata (es. prima di rieseguire un job ripreso)."""
+    return collection.find_one({"_id": message_sid, "status": "done"}, {"_id": 1}) is not None
+
+
+def release(collection, message_sid):
+    """Rinuncia alla presa in carico (elaborazione non avviata): la prossima consegna lo rielabora."""
+    collection.delete_one({"_id": message_sid, "status": "processing"})
+
+
+async def aclaim(collection, message_sid, from_number, to_number):
+    now = datetime.utcnow()
+    try:
+        await collection.insert_one(_claim_document(message_sid, from_number, to_number, now))
+        _record("claimed")
+        return None
+    except DuplicateKeyError:
+        stale_filter, update = _stale_claim(message_sid, now)
+        if await collection.find_one_and_update(stale_filter, update, return_document=ReturnDocument.AFTER):
+            _record("reclaimed")
+            return None
+    return _duplicate(await collection.find_one({"_id": message_sid}))
+
+
+async def acomplete(collection, message_sid, reply):
+    await collection.update_one({"_id": message_sid}, _complete_update(reply, datetime.utcnow()))
+
+
+async def arelease(collection, message_sid):
+    await collection.delete_one({"_id": message_sid, "status": "processing"})
@@ -0,0 +1,306 @@
+# intent_router.py - Percorso veloce deterministico per gli intenti più frequenti
+#
+# Prima di chiamare il modello proviamo a riconoscere con regole semplici i messaggi più comuni:
+# informazioni sul business, disdetta (cancellata solo dopo conferma), saluti/ringraziamenti, conferma
+# di un orario o di una disdetta proposti da noi e richieste esplicite "servizio + data + ora". Se la regola scatta chiamiamo direttamente i tool
+# e rispondiamo con un template; in tutti gli altri casi il messaggio passa al modello come prima.
+
+import json
+import re
+import threading
+import unicodedata
+from datetime import date as date_cls, datetime, timedelta
+
+import metrics
+
+MONTHS = {
+    'gennaio': 1, 'febbraio': 2, 'marzo': 3, 'aprile': 4, 'maggio': 5, 'giugno': 6,
+    'luglio': 7, 'agosto': 8, 'settembre': 9, 'ottobre': 10, 'novembre': 11, 'dicembre': 12,
+}
+WEEKDAYS = {'lunedi': 0, 'martedi': 1, 'mercoledi': 2, 'giovedi': 3, 'venerdi': 4, 'sabato': 5, 'domenica': 6}
+
+DATE_PATTERNS = [
+    ('iso', re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')),
+    ('numeric', re.compile(r'\b(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?\b')),
+    ('month_name', re.compile(r'\b(\d{1,2})\s+(' + '|'.join(MONTHS) + r')(?:\s+(\d{4}))?\b')),
+    ('relative', re.compile(r'\b(oggi|domani|dopodomani)\b')),
+    ('weekday', re.compile(r'\b(' + '|'.join(WEEKDAYS) + r')\b')),
+]
+TIME_PATTERNS = [
+    re.compile(r'\b(?:alle|ore|h|per le)\s*(\d{1,2})(?:[:.](\d{2}))?\b'),
+    re.compile(r'\b(\d{1,2})[:.](\d{2})\b'),
+]
+INFO_PATTERN = re.compile(
+    r'\b(orari|orario|apertura|aperti|aprite|chiudete|chiusura|indirizzo|dove siete|dove vi trovate|'
+    r'dove si trova|servizi|trattamenti|listino|info|informazioni)\b'
+)
+CANCEL_PATTERN = re.compile(
+    r'^(?:(?:ciao|scusa|scusate|salve)\s+)?(?:(?:vorrei|voglio|devo|puoi|potete|posso)\s+)?'
+    r'(annulla|annullare|disdici|disdire|cancella|cancellare|disdetta)'
+    r'(?:\s+(?:il|l|la|lo|mio|mia)){0,2}(?:\s+(appuntamento|prenotazione))?'
+    r'(?:\s+per\s+favore)?(?:\s+grazie)?$'
+)
+# Template della nostra proposta: la conferma successiva dell'utente viene riconosciuta da qui
+PROPOSAL_TEMPLATE = "Ho trovato posto per '{service}' il {date} alle {time}. Confermi la prenotazione?"
+PROPOSAL_PATTERN = re.compile(r"^Ho trovato posto per '(.+)' il (\d{4}-\d{2}-\d{2}) alle (\d{2}:\d{2})\. Confermi la prenotazione\?$")
+# Anche la disdetta passa da una proposta: cancelliamo solo dopo il sì dell'utente
+CANCEL_PROPOSAL_TEMPLATE = "Ho trovato il tuo appuntamento per '{service}' il {date} alle {time}. Confermi la cancellazione?"
+CANCEL_PROPOSAL_PATTERN = re.compile(r"^Ho trovato il tuo appuntamento per '(.+)' il (\d{4}-\d{2}-\d{2}) alle (\d{2}:\d{2})\. Confermi la cancellazione\?$")
+CLOSING_REPLY = "Grazie a te! Se ti serve altro, scrivimi pure. 😊"
+
+# Parole che rendono il messaggio troppo ambiguo per il percorso veloce
+AMBIGUOUS_WORDS = {
+    'spostare', 'sposta', 'spostami', 'cambiare', 'cambia', 'modificare', 'modifica', 'annulla', 'annullare',
+    'cancella', 'cancellare', 'disdici', 'disdire', 'non', 'invece', 'anticipare', 'posticipare', 'rimandare',
+    'oppure', 'o', 'altro', 'altra',
+}
+BOOKING_VERBS = {
+    'prenota', 'prenotami', 'prenotate', 'prenotatemi', 'fissa', 'fissami', 'fissate', 'segnami', 'mettimi', 'confermo',
+}
+AFFIRMATIVE_WORDS = {'si', 'sisi', 'ok', 'okay', 'confermo', 'certo', 'esatto', 'procedi', 'perfetto', 'bene', 'accordo', 'vai'}
+AFFIRMATIVE_FILLER = {'va', 'd', 'grazie', 'benissimo', 'ottimo', 'pure', 'dai', 'allora', 'mille', 'assolutamente'}
+CLOSING_WORDS = {'grazie', 'arrivederci', 'presto'}
+# 'ciao' apre e chiude le conversazioni: vale come congedo solo dopo una nostra risposta
+GREETING_OR_CLOSING_WORDS = {'ciao'}
+CLOSING_FILLER = {
+    'ok', 'okay', 'mille', 'tante', 'perfetto', 'ottimo', 'benissimo', 'bene', 'va', 'a', 'buona', 'giornata',
+    'serata', 'allora', 'gentilissimo', 'gentilissima', 'gentile', 'molto', 'super', 'top', 'di', 'tutto',
+}
+
+_stats_lock = threading.Lock()
+stats = {"messages": 0, "fallthrough": 0, "hits": {}}
+
+
+def _plain(text):
+    """Minuscolo, senza accenti e punteggiatura: 'Lunedì alle 15:30?' -> 'lunedi alle 15:30'."""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.findall(r"[a-z0-9]+(?:[:./-][0-9]+)*", text))
+
+
+def _build_date(year, month, day, today, explicit_year):
+    try:
+        result = date_cls(year, month, day)
+    except ValueError:
+        return None
+    # Senza anno si intende la prossima occorrenza di quella data
+    if not explicit_year and result < today:
+        try:
+            result = date_cls(year + 1, month, day)
+        except ValueError:
+            return None
+    return result
+
+
+def parse_italian_date(text, today):
+    """
+    Cerca una data nel testo già normalizzato con _plain ('domani', 'venerdì', '20/10', '3 novembre',
+    '2026-10-20'). Restituisce (date, (inizio, fine) della corrispondenza), None se non c'è o è ambigua.
+    """
+    found = []
+    for kind, pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            # '10-20' dentro '2026-10-20' è già coperto dalla data ISO
+            if any(start <= match.start() < end for _, (start, end) in found):
+                continue
+            if kind == 'iso':
+                value = _build_date(int(match.group(1)), int(match.group(2)), int(match.group(3)), today, True)
+            elif kind == 'numeric':
+                year = match.group(3)
+                if year and len(year) == 2:
+                    year = '20' + year
+                value = _build_date(int(year) if year else today.year, int(match.group(2)), int(match.group(1)), today, bool(year))
+            elif kind == 'month_name':
+                year = match.group(3)
+                value = _build_date(int(year) if year else today.year, MONTHS[match.group(2)], int(match.group(1)), today, bool(year))
+            elif kind == 'relative':
+                value = today + timedelta(days={'oggi': 0, 'domani': 1, 'dopodomani': 2}[match.group(1)])
+            else:
+                # "lunedì" detto di lunedì indica quello della settimana prossima
+                value = today + timedelta(days=(WEEKDAYS[match.group(1)] - today.weekday()) % 7 or 7)
+            if value is None:
+                return None
+            found.append((value, match.span()))
+    if len(found) != 1:
+        return None
+    return found[0]
+
+
+def parse_time(text):
+    """
+    Cerca un orario ('alle 15', 'ore 10:30', '15.30'). Le ore da 1 a 7 si intendono del pomeriggio.
+    Restituisce ('HH:MM', (inizio, fine)), None se non c'è o ce n'è più di uno.
+    """
+    found = []
+    for pattern in TIME_PATTERNS:
+        for match in pattern.finditer(text):
+            if any(start <= match.start() < end or match.start() <= start < match.end() for _, (start, end) in found):
+                continue
+            hour, minute = int(match.group(1)), int(match.group(2) or 0)
+            if 1 <= hour <= 7:
+                hour += 12
+            if hour > 23 or minute > 59:
+                return None
+            found.append((f"{hour:02d}:{minute:02d}", match.span()))
+    if len(found) != 1:
+        return None
+    return found[0]
+
+
+def _last_assistant_message(history):
+    for message in reversed(history or []):
+        if message.get('role') == 'assistant':
+            return message.get('content') or ''
+    return ''
+
+
+def classify(incoming_msg, config, history, today=None):
+    """
+    Riconosce l'intento del messaggio. Restituisce un dict con 'name', 'tool' (o None) e 'args',
+    oppure None se il messaggio va lasciato al modello.
+    """
+    today = today or datetime.now().date()
+    text = _plain(incoming_msg)
+    tokens = set(text.split())
+    if not tokens:
+        return None
+    last_reply = _last_assistant_message(history)
+    awaiting_answer = last_reply.rstrip().endswith('?')
+
+    # Conferma di una nostra proposta: prenotiamo esattamente quello che abbiamo proposto
+    affirmative = bool(tokens & AFFIRMATIVE_WORDS) and tokens <= AFFIRMATIVE_WORDS | AFFIRMATIVE_FILLER
+    proposal = PROPOSAL_PATTERN.match(last_reply.strip())
+    if proposal and affirmative:
+        service, date, time = proposal.groups()
+        return {"name": "confirm_booking", "tool": "create_or_update_booking",
+                "args": {"service_name": service, "date": date, "time": time}}
+
+    # Conferma della disdetta proposta: solo l'appuntamento indicato, se è ancora il prossimo
+    cancel_proposal = CANCEL_PROPOSAL_PATTERN.match(last_reply.strip())
+    if cancel_proposal and affirmative:
+        _, date, time = cancel_proposal.groups()
+        return {"name": "confirm_cancel", "tool": "cancel_booking", "args": {"date": date, "time": time}}
+
+    closing_triggers = CLOSING_WORDS | GREETING_OR_CLOSING_WORDS if last_reply else CLOSING_WORDS
+    closing_vocabulary = CLOSING_WORDS | GREETING_OR_CLOSING_WORDS | CLOSING_FILLER
+    if tokens & closing_triggers and tokens <= closing_vocabulary and not awaiting_answer:
+        return {"name": "closing", "tool": None, "args": {}}
+
+    cancel = CANCEL_PATTERN.match(text)
+    if cancel and (cancel.group(2) or not awaiting_answer):
+        # Nessuna cancellazione diretta: cerchiamo l'appuntamento e chiediamo conferma
+        return {"name": "cancel_check", "tool": "get_next_booking", "args": {}}
+
+    if tokens & AMBIGUOUS_WORDS:
+        return None
+
+    parsed_date = parse_italian_date(text, today)
+    parsed_time = parse_time(text)
+
+    if parsed_date is None and parsed_time is None and not tokens & BOOKING_VERBS:
+        if len(tokens) <= 8 and INFO_PATTERN.search(text):
+            return {"name": "business_info", "tool": "get_business_info", "args": {}}
+        return None
+
+    if not (parsed_date and parsed_time and config):
+        return None
+
+    # Il servizio si cerca nel testo senza data e ora, e senza ricerca fuzzy
+    (request_date, date_span), (request_time, time_span) = parsed_date, parsed_time
+    remaining = text
+    for start, end in sorted([date_span, time_span], reverse=True):
+        remaining = remaining[:start] + ' ' + remaining[end:]
+    service = config["matcher"].match_strict(remaining)
+    if not service:
+        return None
+
+    args = {"service_name": service['name'], "date": request_date.isoformat(), "time": request_time}
+    # Con un verbo esplicito prenotiamo subito; una domanda ("avete posto...?") riceve solo la proposta
+    if tokens & BOOKING_VERBS and '?' not in incoming_msg:
+        return {"name": "direct_booking", "tool": "create_or_update_booking", "args": args}
+    # hold_time: se l'orario è libero lo teniamo per l'utente finché non risponde alla proposta
+    return {"name": "slot_check", "tool": "get_available_slots",
+            "args": {"service_name": service['name'], "date": args["date"], "hold_time": request_time}, "time": request_time}
+
+
+def render(intent, tool_result):
+    """Risposta finale per l'utente a partire dall'intento e dal risultato del tool."""
+    if intent["name"] == "closing":
+        return CLOSING_REPLY
+    if intent["name"] == "cancel_check":
+        try:
+            booking = json.loads(tool_result)
+        except (TypeError, ValueError):
+            # Nessuna prenotazione futura, o errore del tool
+            return tool_result
+        return CANCEL_PROPOSAL_TEMPLATE.format(**booking)
+    if intent["name"] != "slot_check":
+        return tool_result
+
+    try:
+        starts = json.loads(tool_result)
+    except (TypeError, ValueError):
+        # Messaggio d'errore del tool (data passata, giorno pieno, servizio non configurato...)
+        return tool_result
+    args, time = intent["args"], intent["time"]
+    if time in starts:
+        return PROPOSAL_TEMPLATE.format(service=args["service_name"], date=args["date"], time=time)
+    alternatives = f"Orari liberi: {', '.join(starts[:4])}..." if starts else "Prova un altro giorno."
+    return f"L'orario delle {time} del {args['date']} non è disponibile per '{args['service_name']}'. {alternatives}"
+
+
+def _record(intent_name):
+    with _stats_lock:
+        stats["messages"] += 1
+        if intent_name is None:
+            stats["fallthrough"] += 1
+        else:
+            stats["hits"][intent_name] = stats["hits"].get(intent_name, 0) + 1
+
+
+def hit_rate():
+    """Quota dei messaggi gestiti senza modello (0.0 - 1.0)."""
+    with _stats_lock:
+        return (stats["messages"] - stats["fallthrough"]) / stats["messages"] if stats["messages"] else 0.0
+
+
+def _log_hit(intent):
+    print(f"⚡ Percorso veloce '{intent['name']}' senza modello (hit rate {hit_rate():.0%})")
+
+
+def route(incoming_msg, business_id, user_id, user_name, config, history, tools_module, today=None, tool_events=None):
+    """
+    Risposta pronta se il messaggio è riconosciuto, altrimenti None (il messaggio va al modello).
+    Il tool eseguito viene aggiunto a tool_events come (nome, argomenti, esito).
+    """
+    intent = classify(incoming_msg, config, history, today)
+    if not intent:
+        _record(None)
+        return None
+    result = None
+    if intent["tool"]:
+        context = {"business_id": business_id, "user_id": user_id, "user_name": user_name}
+        with metrics.span("tool", intent["tool"]):
+            result = getattr(tools_module, intent["tool"])(**intent["args"], **context)
+        if tool_events is not None:
+            tool_events.append((intent["tool"], intent["args"], result))
+    _record(intent["name"])
+    _log_hit(intent)
+    return render(intent, result)
+
+
+async def aroute(incoming_msg, business_id, user_id, user_name, config, history, tools_module, today=None, tool_events=None):
+    """Come route, per i tool asyncio di async_bot_tools."""
+    intent = classify(incoming_msg, config, history, today)
+    if not intent:
+        _record(None)
+        return None
+    result = None
+    if intent["tool"]:
+        context = {"business_id": business_id, "user_id": user_id, "user_name": user_name}
+        with metrics.span("tool", intent["tool"]):
+            result = await getattr(tools_module, intent["tool"])(**intent["args"], **context)
+        if tool_events is not None:
+            tool_events.append((intent["tool"], intent["args"], result))
+    _record(intent["name"])
+    _log_hit(intent)
+    return render(intent, result)
@@ -0,0 +1,280 @@
+# loadtest.py - Load test offline di /webhook con servizi esterni simulati
+#
+# Tutto gira in locale: finto OpenAI su HTTP (fake_openai.py, raggiunto tramite OPENAI_BASE_URL),
+# finta API Google Calendar con densità di eventi configurabile (fake_calendar.py) e MongoDB con
+# mongomock oppure un mongod locale (--mongo-uri). Gli utenti virtuali ripetono dei copioni di
+# conversazione contro /webhook con la concorrenza richiesta; alla fine vengono riportati
+# throughput, latenze p50/p95/p99 e chiamate esterne per messaggio (dalle tracce di metrics).
+# Con --max-p95-ms / --max-llm-calls / --max-calendar-calls il processo esce con 1 se i limiti
+# vengono superati, così una regressione nei round trip fa fallire la run.
+# Uso: python loadtest.py [--users 40] [--concurrency 8] [--llm-latency-ms 400] [--calendar-latency-ms 80]
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fake_openai import FakeOpenAIServer, tool_call
+
+BUSINESS_ID = "loadtest-business"
+BUSINESS_NUMBER = "whatsapp:+390000000000"
+SERVICES = [{"name": "Taglio uomo", "duration": 30}, {"name": "Piega", "duration": 45}, {"name": "Colore", "duration": 90}]
+
+BOOKING_REQUEST = re.compile(r"prenotare (?:un |una )?(.+?) per il (\d{4}-\d{2}-\d{2})")
+BOOKING_CHOICE = re.compile(r"(.+?) il (\d{4}-\d{2}-\d{2}) alle (\d{2}:\d{2})")
+
+
+def scripts_for_user(index, first_day):
+    """Copioni di conversazione: metà passano dal modello, metà dal percorso veloce."""
+    day = (first_day + timedelta(days=index % 5)).isoformat()
+    time_slot = f"{9 + (index // 5) % 8:02d}:{'30' if index % 2 else '00'}"
+    service = SERVICES[index % len(SERVICES)]["name"].lower()
+    if index % 2 == 0:
+        return [
+            f"Ciao, vorrei prenotare un {service} per il {day}",
+            f"{service} il {day} alle {time_slot}",
+            "grazie mille",
+        ]
+    return [
+        "dove siete e che orari fate?",
+        f"avete posto per {service} il {day} alle {time_slot}?",
+        "sì",
+        "vorrei annullare la prenotazione",
+    ]
+
+
+def responder(messages, tools):
+    """Risposte del finto modello: tool coerenti con il copione, poi un testo basato sui risultati."""
+    last = messages[-1] if messages else {}
+    if last.get("role") == "tool":
+        results = [m["content"] for m in messages if m.get("role") == "tool"]
+        return None, f"Ecco cosa ho trovato: {results[-1][:200]}"
+
+    text = (last.get("content") or "").lower()
+    choice = BOOKING_CHOICE.search(text)
+    if choice:
+        service, date, time_slot = choice.groups()
+        return [tool_call("create_or_update_booking", {"service_name": service, "date": date, "time": time_slot})], None
+    request = BOOKING_REQUEST.search(text)
+    if request:
+        service, date = request.groups()
+        return [tool_call("get_available_slots", {"service_name": service, "date": date}),
+                tool_call("get_next_available_slot", {"service_name": service})], None
+    return None, "Certo! Dimmi per quale servizio e in che giorno vuoi prenotare."
+
+
+def random_events(api, calendar_ids, events_per_day, days, seed):
+    rng = random.Random(seed)
+    today = datetime.now(api.timezone).date()
+    for calendar_id in calendar_ids:
+        for day_offset in range(days):
+            day = today + timedelta(days=day_offset)
+            for _ in range(events_per_day):
+                start = api.timezone.localize(datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(9 * 60, 18 * 60, 15)))
+                end = start + timedelta(minutes=rng.choice([15, 30, 45, 60]))
+                api.add_event(calendar_id, {'summary': 'Occupato', 'start': {'dateTime': start.isoformat()}, 'end': {'dateTime': end.isoformat()}})
+
+
+def use_mongomock():
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("mongomock non installato (pip install mongomock), oppure usa --mongo-uri con un mongod locale")
+    import pymongo
+
+    class LocalMongoClient(mongomock.MongoClient):
+        """mongomock non accetta server_api ed event_listeners."""
+
+        def __init__(self, host=None, server_api=None, event_listeners=None, **kwargs):
+            super().__init__(host, **kwargs)
+
+    # mongomock non è thread-safe: le operazioni delle richieste concorrenti passano una alla volta
+    lock = threading.RLock()
+    for name in ("find_one", "insert_one", "insert_many", "update_one", "update_many", "delete_one",
+                 "delete_many", "find_one_and_update", "count_documents", "create_indexes", "index_information"):
+        original = getattr(mongomock.collection.Collection, name)
+
+        def locked(self, *args, _original=original, **kwargs):
+            with lock:
+                return _original(self, *args, **kwargs)
+        setattr(mongomock.collection.Collection, name, locked)
+    pymongo.MongoClient = LocalMongoClient
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=40, help="utenti virtuali (ognuno esegue un copione)")
+    parser.add_argument('--concurrency', type=int, default=8, help="utenti attivi contemporaneamente")
+    parser.add_argument('--llm-latency-ms', type=float, default=400)
+    parser.add_argument('--calendar-latency-ms', type=float, default=80)
+    parser.add_argument('--calendars', type=int, default=2, help="calendari del business (staff)")
+    parser.add_argument('--events-per-day', type=int, default=6, help="densità di eventi per calendario")
+    parser.add_argument('--mirror', action='store_true', help="disponibilità dal mirror locale (CALENDAR_MIRROR)")
+    parser.add_argument('--no-router', action='store_true', help="disattiva il percorso veloce (INTENT_ROUTER=0)")
+    parser.add_argument('--coalesce-seconds', type=float,
+                        help="MESSAGE_COALESCE_SECONDS (senza, si misura la configurazione dell'ambiente o il default)")
+    parser.add_argument('--mongo-uri', help="mongod locale; senza, si usa mongomock")
+    parser.add_argument('--json', action='store_true', help="stampa il report come JSON")
+    parser.add_argument('--verbose', action='store_true', help="mostra i log dell'app")
+    parser.add_argument('--max-p95-ms', type=float)
+    parser.add_argument('--max-llm-calls', type=float, help="chiamate medie al modello per messaggio")
+    parser.add_argument('--max-calendar-calls', type=float, help="chiamate medie a Google Calendar per messaggio")
+    args = parser.parse_args()
+
+    fake_openai = FakeOpenAIServer(responder, latency_seconds=args.llm_latency_ms / 1000)
+    os.environ["OPENAI_BASE_URL"] = fake_openai.start()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ["BUSINESS_CACHE_CHANGE_STREAM"] = "0"
+    os.environ["CALENDAR_MIRROR"] = "1" if args.mirror else "0"
+    os.environ["INTENT_ROUTER"] = "0" if args.no_router else "1"
+    if args.coalesce_seconds is not None:
+        os.environ["MESSAGE_COALESCE_SECONDS"] = str(args.coalesce_seconds)
+    os.environ.pop("CALENDAR_WEBHOOK_URL", None)
+    os.environ.pop("GOOGLE_SERVICE_ACCOUNT_KEY", None)
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        os.environ["MONGO_URI"] = "mongodb://localhost:27017"
+        os.environ["ENSURE_INDEXES"] = "0"
+        use_mongomock()
+
+    app_output = sys.stdout if args.verbose else open(os.devnull, 'w')
+    with contextlib.redirect_stdout(app_output):
+        import app as webhook_app
+        import bot_tools
+        import metrics
+        from calendar_mirror import MirroredCalendarService
+        from calendar_service import CalendarService
+        from fake_calendar import FakeCalendarAPI
+
+        db = webhook_app.db
+        for name in ("businesses", "conversations", "bookings", "pending_bookings"):
+            getattr(db, name).delete_many({"business_id": BUSINESS_ID} if name != "businesses" else {"_id": BUSINESS_ID})
+        calendar_ids = [f"loadtest-staff{c}" for c in range(args.calendars)]
+        db.businesses.insert_one({
+            "_id": BUSINESS_ID, "business_name": "Salone Load Test", "twilio_phone_number": BUSINESS_NUMBER,
+            "services": json.dumps(SERVICES), "booking_hours": "9-18", "address": "Via delle Prove 1",
+            "google_calendar_id": calendar_ids[0], "staff_calendar_ids": calendar_ids[1:],
+        })
+        api = FakeCalendarAPI({calendar_id: [] for calendar_id in calendar_ids})
+        random_events(api, calendar_ids, args.events_per_day, days=14, seed=7)
+        api.latency_seconds = args.calendar_latency_ms / 1000
+        calendar_service = (MirroredCalendarService if args.mirror else CalendarService)(calendar_id=calendar_ids)
+        calendar_service.service = api
+        bot_tools.calendar_services.put(BUSINESS_ID, db.businesses.find_one({"_id": BUSINESS_ID}), calendar_service)
+
+    entries = []
+    entries_lock = threading.Lock()
+
+    def _collect(entry):
+        with entries_lock:
+            entries.append(entry)
+    metrics.add_request_listener(_collect)
+
+    first_day = datetime.now().date() + timedelta(days=1)
+    user_queue = list(range(args.users))
+    queue_lock = threading.Lock()
+    latencies, failures = [], []
+
+    def _virtual_user():
+        client = webhook_app.app.test_client()
+        while True:
+            with queue_lock:
+                if not user_queue:
+                    return
+                index = user_queue.pop(0)
+            for text in scripts_for_user(index, first_day):
+                started = time.perf_counter()
+                response = client.post('/webhook', data={
+                    'Body': text, 'From': f"whatsapp:+39333{index:07d}", 'To': BUSINESS_NUMBER, 'ProfileName': f"Utente {index}",
+                    'MessageSid': f"SM{uuid.uuid4().hex}",
+                })
+                elapsed = time.perf_counter() - started
+                with entries_lock:
+                    latencies.append(elapsed)
+                    if response.status_code != 200 or b"errore generale" in response.data:
+                        failures.append((text, response.status_code))
+
+    calendar_trips_before, llm_before = api.round_trips, fake_openai.requests
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(app_output):
+        threads = [threading.Thread(target=_virtual_user, name=f"user-{i}") for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - started
+    fake_openai.stop()
+
+    messages = len(latencies) or 1
+    per_message = {}
+    for entry in entries:
+        for kind, span_stats in entry["spans"].items():
+            per_message[kind] = per_message.get(kind, 0) + span_stats["calls"]
+    paths = {}
+    for entry in entries:
+        paths[entry["path"]] = paths.get(entry["path"], 0) + 1
+
+    report = {
+        "messages": len(latencies),
+        "failures": len(failures),
+        "throughput_msg_s": round(len(latencies) / wall, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "max": round(max(latencies, default=0) * 1000, 1),
+        },
+        "calls_per_message": {kind: round(count / messages, 2) for kind, count in sorted(per_message.items())},
+        "llm_requests_per_message": round((fake_openai.requests - llm_before) / messages, 2),
+        "calendar_round_trips_per_message": round((api.round_trips - calendar_trips_before) / messages, 2),
+        "paths": paths,
+        "settings": {key: value for key, value in vars(args).items() if not key.startswith('max_') and key not in ('json', 'verbose')},
+    }
+    # Finestra effettiva, anche quando viene dall'ambiente o dal default
+    coalescer = webhook_app.message_coalescer
+    report["settings"]["coalesce_seconds"] = coalescer.window_seconds if coalescer else 0.0
+    if "mongo" not in per_message:
+        report["calls_per_message"]["mongo"] = None  # mongomock non emette eventi di monitoring
+
+    limits = [
+        ("p95 ms", args.max_p95_ms, report["latency_ms"]["p95"]),
+        ("chiamate al modello", args.max_llm_calls, report["llm_requests_per_message"]),
+        ("chiamate a Calendar", args.max_calendar_calls, report["calendar_round_trips_per_message"]),
+    ]
+    exceeded = [f"{name} {value} > {limit}" for name, limit, value in limits if limit is not None and value > limit]
+    report["exceeded"] = exceeded
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(f"{'✅' if not exceeded and not failures else '❌'} {report['messages']} messaggi in {wall:.1f}s "
+              f"({report['throughput_msg_s']} msg/s, concorrenza {args.concurrency}), errori {len(failures)}")
+        latency = report["latency_ms"]
+        print(f"   latenza p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, max {latency['max']} ms")
+        print(f"   per messaggio: modello {report['llm_requests_per_message']}, round trip Calendar "
+              f"{report['calendar_round_trips_per_message']}, span {report['calls_per_message']}")
+        print(f"   percorsi: {paths}")
+        for text, status in failures[:5]:
+            print(f"   ⚠️ '{text}' -> {status}")
+        for line in exceeded:
+            print(f"   ❌ limite superato: {line}")
+    raise SystemExit(1 if exceeded or failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 load_dotenv()
 from database import db_connection
+from business_cache import notify_business_changed
+import booking_logic
 
 class BusinessManager:
     def __init__(self):
@@ -24,11 +26,39 @@ class BusinessManager:
                 business_data["services"] = json.dumps(business_data["services"])
                 
             result = self.businesses.insert_one(business_data)
+            notify_business_changed(business_id=result.inserted_id, phone_number=business_data.get("twilio_phone_number"))
             print(f"✅ Business aggiunto con ID: {result.inserted_id}")
+            if business_data.get("google_calendar_id"):
+                self.watch_new_calendars(result.inserted_id)
             return result.inserted_id
         except Exception as e:
             print(f"❌ Errore nell'aggiungere business: {e}")
             return None
+
+    def update_business(self, business_id, updates):
+        """
+        Aggiorna i campi di un business e invalida le cache di configurazione.
+        I worker web in altri processi se ne accorgono tramite change stream o alla scadenza del TTL.
+        """
+        try:
+            updates = dict(updates, updated_at=datetime.now().isoformat())
+            if isinstance(updates.get("services"), list):
+                updates["services"] = json.dumps(updates["services"])
+
+            previous = self.businesses.find_one_and_update(
+                {"_id": business_id}, {"$set": updates}, projection={"twilio_phone_number": 1}
+            )
+            if not previous:
+                print(f"❌ Business {business_id} non trovato")
+                return False
+            notify_business_changed(business_id=business_id, phone_number=previous.get("twilio_phone_number"))
+            print(f"✅ Business {business_id} aggiornato")
+            if "google_calendar_id" in updates or "staff_calendar_ids" in updates:
+                self.watch_new_calendars(business_id)
+            return True
+        except Exception as e:
+            print(f"❌ Errore nell'aggiornare business: {e}")
+            return False
     
     def setup_dynamic_calendar_events(self, business_id):
         """
@@ -101,14 +131,21 @@ Per configurare orari dinamici, crea questi eventi nel tuo Google Calendar:
             return False
             
         business_id = business['_id']
-        calendar_id = business.get('google_calendar_id')
+        # Stessi calendari che usa il bot (bot_tools costruisce il CalendarService con get_calendar_ids)
+        calendar_ids = booking_logic.get_calendar_ids(business)
         
-        if not calendar_id:
+        if not calendar_ids:
             print("❌ Google Calendar ID non configurato")
             return False
             
         print(f"🔍 Testing calendario per: {business.get('business_name')}")
-        print(f"📅 Calendar ID: {calendar_id[:20]}...")
+        print(f"📅 Calendar ID: {calendar_ids[0][:20]}... ({len(calendar_ids)} calendari)")
+        
+        from calendar_service import CalendarService
+        calendar_service = CalendarService(
+            calendar_id=calendar_ids,
+            service_account_key=os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY")
+        )
         
         # Test prossimi 3 giorni
         today = datetime.now()
@@ -119,15 +156,14 @@ Per configurare orari dinamici, crea questi eventi nel tuo Google Calendar:
             print(f"\n📅 {day_name} ({test_date}):")
             
             try:
-                from calendar_service import CalendarService
-                calendar_service = CalendarService(
-                    calendar_id=calendar_id,
-                    service_account_key=os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY")
+                # Override orari e slot con una sola lettura del calendario per giorno
+                (is_open, start_time, end_time), slots = calendar_service.get_day_overview(
+                    date=test_date,
+                    duration_minutes=60,
+                    start_hour=9,
+                    end_hour=18
                 )
                 
-                # Test controllo orari
-                is_open, start_time, end_time = calendar_service.check_business_hours_override(test_date)
-                
                 if is_open is False:
                     print("   🚫 Business CHIUSO (evento nel calendario)")
                 elif start_time and end_time:
@@ -136,14 +172,6 @@ Per configurare orari dinamici, crea questi eventi nel tuo Google Calendar:
                     default_hours = business.get("booking_hours", "9-18")
                     print(f"   📝 Orari DEFAULT: {default_hours}")
                 
-                # Test slot disponibili
-                slots = calendar_service.get_available_slots(
-                    date=test_date,
-                    duration_minutes=60,
-                    start_hour=9,
-                    end_hour=18
-                )
-                
                 print(f"   ✅ Slot disponibili: {len(slots)}")
                 if slots:
                     first_few = [s['start'] for s in slots[:3]]
@@ -154,6 +182,40 @@ Per configurare orari dinamici, crea questi eventi nel tuo Google Calendar:
         
         return True
 
+    def _open_calendar_channels(self, business):
+        """Apre i canali di notifica push mancanti per i calendari del business. Restituisce quanti ne ha aperti."""
+        from calendar_service import CalendarService
+        from calendar_watch import CalendarWatchManager
+        calendar_service = CalendarService(
+            calendar_id=booking_logic.get_calendar_ids(business),
+            service_account_key=os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY")
+        )
+        return CalendarWatchManager(self.db.calendar_channels, self.db.calendar_changes).watch_business(business['_id'], calendar_service)
+
+    def watch_new_calendars(self, business_id):
+        """Con le notifiche push attive (CALENDAR_WEBHOOK_URL) apre subito i canali per i calendari appena associati al business."""
+        if not os.getenv("CALENDAR_WEBHOOK_URL"):
+            return
+        business = self.businesses.find_one({"_id": business_id})
+        if not business or not booking_logic.get_calendar_ids(business):
+            return
+        try:
+            opened = self._open_calendar_channels(business)
+            print(f"📡 Notifiche calendario attivate: {opened} canali aperti")
+        except Exception as e:
+            print(f"⚠️ Notifiche calendario non attivate (riprova con l'opzione 6): {e}")
+
+    def watch_calendars(self, twilio_number):
+        """Apre i canali di notifica push per i calendari del business (richiede CALENDAR_WEBHOOK_URL)."""
+        business = self.get_business(twilio_number)
+        if not business or not booking_logic.get_calendar_ids(business):
+            print("❌ Business non trovato o Google Calendar ID non configurato")
+            return False
+
+        opened = self._open_calendar_channels(business)
+        print(f"✅ Canali aperti: {opened} (i canali già attivi restano invariati, il rinnovo è automatico)")
+        return True
+
 def main():
     manager = BusinessManager()
     
@@ -165,6 +227,8 @@ def main():
         print("2. Visualizza business")
         print("3. Setup calendario dinamico")
         print("4. Test integrazione calendario")
+        print("5. Crea/verifica indici MongoDB")
+        print("6. Riattiva notifiche calendario (push)")
         print("0. Esci")
         
         choice = input("\nScegli un'opzione: ").strip()
@@ -181,6 +245,8 @@ def main():
             business_data["business_type"] = input("Tipo business (es: parrucchiere): ")
             business_data["address"] = input("Indirizzo: ")
             business_data["google_calendar_id"] = input("ID Google Calendar: ")
+            staff_calendars = input("ID calendari staff aggiuntivi, separati da virgola (lascia vuoto se nessuno): ")
+            business_data["staff_calendar_ids"] = [c.strip() for c in staff_calendars.split(",") if c.strip()]
             
             print("\n🕒 ORARI BASE (usati quando non ci sono eventi speciali nel calendario)")
             print("Il sistema dinamico può sovrascrivere questi orari con eventi nel calendario")
@@ -196,7 +262,11 @@ def main():
                     break
                 duration = input(f"Durata di '{service_name}' in minuti: ").strip()
                 if service_name and duration.isdigit():
-                    services.append({"name": service_name, "duration": int(duration)})
+                    service = {"name": service_name, "duration": int(duration)}
+                    aliases = input(f"Sinonimi di '{service_name}' separati da virgola (es: taglio capelli, sforbiciata): ").strip()
+                    if aliases:
+                        service["aliases"] = [a.strip() for a in aliases.split(",") if a.strip()]
+                    services.append(service)
                 else:
                     print("Nome o durata non validi.")
             business_data["services"] = services
@@ -231,6 +301,13 @@ def main():
             twilio_number = input("Numero Twilio del business da testare: ")
             manager.test_calendar_integration(twilio_number)
 
+        elif choice == "5":
+            manager.db.ensure_indexes()
+
+        elif choice == "6":
+            twilio_number = input("Numero Twilio del business: ")
+            manager.watch_calendars(twilio_number)
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,173 @@
+# message_coalescer.py - Unisce i messaggi ravvicinati dello stesso utente in un unico turno del modello
+#
+# Su WhatsApp capita spesso "ciao" / "vorrei un taglio" / "domani" in tre messaggi a pochi secondi
+# di distanza. Il primo messaggio di una raffica la "guida": aspetta che l'utente smetta di scrivere
+# per MESSAGE_COALESCE_SECONDS (al massimo MESSAGE_COALESCE_MAX_SECONDS dal primo), raccoglie i
+# messaggi arrivati nel frattempo e li elabora come uno solo; gli altri ricevono solo un ack.
+# I turni dello stesso utente sono anche serializzati: una raffica nuova attende che la precedente
+# abbia finito (e continua a raccogliere messaggi mentre aspetta), così le risposte non si
+# contraddicono e le scritture sulla conversazione non si sovrappongono.
+# Il coordinamento è in memoria: vale per i messaggi che arrivano allo stesso processo.
+# Disattivato di default (MESSAGE_COALESCE_SECONDS=0): ogni raffica aspetta la finestra di quiete,
+# un costo che ripaga solo dove i messaggi dello stesso utente possono arrivare in parallelo
+# (coda a thread con ASYNC_WEBHOOK=1, oppure async_app). Con un solo worker gunicorn sincrono
+# il secondo messaggio non arriva mai durante la finestra: sarebbe solo latenza in più.
+
+import asyncio
+import os
+import threading
+import time
+
+MESSAGE_COALESCE_SECONDS = float(os.getenv("MESSAGE_COALESCE_SECONDS", "0"))
+MESSAGE_COALESCE_MAX_SECONDS = float(os.getenv("MESSAGE_COALESCE_MAX_SECONDS", "4"))
+
+
+class Burst:
+    """Messaggi di una raffica: restituita a chi la guida, che la elabora dentro `with`."""
+
+    def __init__(self, coalescer, key, now):
+        self._coalescer = coalescer
+        self.key = key
+        self.texts = []
+        self.started_at = now  # time.monotonic() del primo messaggio
+        self.last_at = now
+        # time.monotonic() dell'avvio: fine della finestra di quiete o del turno precedente, la più tarda
+        self.processing_at = None
+
+    @property
+    def text(self):
+        return "\n".join(self.texts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._coalescer._finish(self.key)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._coalescer._afinish(self.key)
+
+
+class _KeyState:
+    __slots__ = ("burst", "busy")
+
+    def __init__(self):
+        self.burst = None  # raffica aperta, che accetta ancora messaggi
+        self.busy = False  # un turno dell'utente è in elaborazione
+
+
+class _CoalescerBase:
+    def __init__(self, window_seconds, max_seconds):
+        self.window_seconds = window_seconds
+        self.max_seconds = max_seconds
+        self._states = {}
+        self.stats = {"messages": 0, "bursts": 0, "merged": 0}
+
+    def _add(self, key, text, now):
+        """Aggiunge il messaggio alla raffica aperta; restituisce la raffica se il chiamante la guida, altrimenti None."""
+        self.stats["messages"] += 1
+        state = self._states.setdefault(key, _KeyState())
+        if state.burst is not None:
+            state.burst.texts.append(text)
+            state.burst.last_at = now
+            self.stats["merged"] += 1
+            return None
+        state.burst = Burst(self, key, now)
+        state.burst.texts.append(text)
+        self.stats["bursts"] += 1
+        return state.burst
+
+    def pending_stats(self):
+        """stats più il numero di utenti con una raffica aperta o un turno in corso (gauge 'users')."""
+        return dict(self.stats, users=len(self._states))
+
+    def _quiet_until(self, burst):
+        """Istante in cui la raffica si chiude se non arrivano altri messaggi."""
+        return min(burst.last_at + self.window_seconds, burst.started_at + self.max_seconds)
+
+    def _try_start(self, burst):
+        """Se la finestra è passata e nessun turno dell'utente è in corso, chiude la raffica e la avvia."""
+        state = self._states[burst.key]
+        if time.monotonic() < self._quiet_until(burst) or state.busy:
+            return False
+        state.burst = None
+        state.busy = True
+        burst.processing_at = time.monotonic()
+        if len(burst.texts) > 1:
+            print(f"🧩 {len(burst.texts)} messaggi ravvicinati uniti in un solo turno")
+        return True
+
+    def _release(self, key):
+        state = self._states.get(key)
+        if state is None:
+            return
+        state.busy = False
+        if state.burst is None:
+            del self._states[key]
+
+
+class MessageCoalescer(_CoalescerBase):
+    """Versione a thread (Flask e worker della coda)."""
+
+    def __init__(self, window_seconds=MESSAGE_COALESCE_SECONDS, max_seconds=MESSAGE_COALESCE_MAX_SECONDS):
+        super().__init__(window_seconds, max_seconds)
+        self._condition = threading.Condition()
+
+    def join(self, key, text):
+        """
+        Restituisce la Burst da elaborare (con `with`) se questo messaggio apre la raffica,
+        None se è stato unito a una raffica guidata da un'altra richiesta.
+        """
+        with self._condition:
+            burst = self._add(key, text, time.monotonic())
+            if burst is None:
+                self._condition.notify_all()
+                return None
+            while not self._try_start(burst):
+                wait = self._quiet_until(burst) - time.monotonic()
+                # Finestra passata ma turno precedente ancora in corso: si attende la sua fine
+                self._condition.wait(timeout=wait if wait > 0 else None)
+            return burst
+
+    def _finish(self, key):
+        with self._condition:
+            self._release(key)
+            self._condition.notify_all()
+
+
+class AsyncMessageCoalescer(_CoalescerBase):
+    """Versione asyncio (async_app): stesse regole, un solo event loop."""
+
+    def __init__(self, window_seconds=MESSAGE_COALESCE_SECONDS, max_seconds=MESSAGE_COALESCE_MAX_SECONDS):
+        super().__init__(window_seconds, max_seconds)
+        self._condition = None
+
+    def _get_condition(self):
+        # Creata nel loop in esecuzione, non all'import del modulo
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def join(self, key, text):
+        condition = self._get_condition()
+        async with condition:
+            burst = self._add(key, text, time.monotonic())
+            if burst is None:
+                condition.notify_all()
+                return None
+            while not self._try_start(burst):
+                wait = self._quiet_until(burst) - time.monotonic()
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout=wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            return burst
+
+    async def _afinish(self, key):
+        condition = self._get_condition()
+        async with condition:
+            self._release(key)
+            condition.notify_all()
@@ -0,0 +1,174 @@
+# message_pipeline.py - Passi della pipeline /webhook, senza I/O
+#
+# Condivisi tra app.py (Flask) e async_app.py (ASGI), come booking_logic per i tool: qui stanno
+# lettura del webhook, risposta alle consegne ripetute, prompt e richieste al modello, risposte
+# degradate e aggiornamento della conversazione. MongoDB, OpenAI, tool e Twilio restano nei due
+# moduli chiamanti, che si limitano a eseguire le chiamate tra un passo e l'altro.
+
+import time
+import traceback
+from contextlib import contextmanager
+
+import booking_logic
+import metrics
+import resilience
+from conversation_state import apply_tool_events, format_state_block
+from conversation_store import exchange_messages
+from prompts import TOOLS, build_prompt_messages, format_token_report, format_usage
+from tool_dispatcher import tool_events as collect_tool_events
+
+MODEL = "gpt-4o-mini"
+# Turni del modello che possono chiamare tool; poi una chiamata finale solo testuale
+MAX_TOOL_ITERATIONS = 3
+
+INVALID_MESSAGE_REPLY = "Errore nel messaggio ricevuto."
+UNKNOWN_BUSINESS_REPLY = "Questo numero non è configurato per le prenotazioni."
+FALLBACK_REPLY = "Mi dispiace, non sono riuscito a elaborare la tua richiesta. Potresti riprovare a scriverla in modo diverso?"
+GENERAL_ERROR_REPLY = "Si è verificato un errore generale. Il nostro team è stato notificato. Riprova tra qualche istante."
+
+
+def parse_webhook(values):
+    """
+    Campi del webhook Twilio (form): dict con body, from_number, to_number, user_name e message_sid
+    (lo stesso formato dei job della coda), oppure None se mancano testo o numeri.
+    """
+    inbound = {
+        "body": values.get('Body', '').strip(),
+        "from_number": values.get('From', ''),
+        "to_number": values.get('To', ''),
+        "user_name": values.get('ProfileName', 'Cliente'),
+        "message_sid": values.get('MessageSid', ''),
+    }
+    return inbound if all([inbound["body"], inbound["from_number"], inbound["to_number"]]) else None
+
+
+def dedupe_enabled(enabled, message_sid):
+    """La deduplica (vedi inbound_dedupe) vale solo se attiva e se Twilio ha inviato il MessageSid."""
+    return enabled and bool(message_sid)
+
+
+def duplicate_reply(previous, reply_sent_separately=False):
+    """
+    Testo da ripetere a una consegna ripetuta, oppure None per un ack vuoto: elaborazione ancora
+    in corso, o risposta già recapitata via REST (ripeterla nel TwiML la duplicherebbe).
+    """
+    if previous.get("status") == "done" and previous.get("reply") and not reply_sent_separately:
+        return previous["reply"]
+    return None
+
+
+@contextmanager
+def message_scope(incoming_msg, received_at=None):
+    """
+    Traccia (durate di modello, tool, Calendar e MongoDB in un'unica riga di log) e tempo massimo
+    del messaggio, contato da received_at (time.monotonic()) se indicato, altrimenti da adesso.
+    """
+    trace_token = metrics.start_request(message_chars=len(incoming_msg))
+    deadline_token = resilience.start_deadline(started_at=received_at)
+    try:
+        yield
+    finally:
+        resilience.end_deadline(deadline_token)
+        metrics.finish_request(trace_token)
+
+
+def model_request(api_messages, iteration):
+    """Argomenti di chat.completions per il turno iteration (da 1): con i tool, o l'ultima solo testuale."""
+    if iteration > MAX_TOOL_ITERATIONS:
+        return {"model": MODEL, "messages": api_messages, "temperature": 0.1}
+    return {"model": MODEL, "messages": api_messages, "tools": TOOLS, "tool_choice": "auto", "temperature": 0.0}
+
+
+def read_model_response(response, api_messages, iteration):
+    """
+    Registra l'uso di token e restituisce i tool_calls da eseguire, già aggiunti alla conversazione
+    del modello; None se la risposta è il testo finale (vedi reply_text).
+    """
+    print(format_usage(getattr(response, "usage", None), iteration if iteration <= MAX_TOOL_ITERATIONS else "finale"))
+    response_message = response.choices[0].message
+    if not response_message.tool_calls:
+        return None
+    api_messages.append(response_message)
+    return response_message.tool_calls
+
+
+def reply_text(response):
+    return response.choices[0].message.content
+
+
+class MessageTurn:
+    """Stato di un messaggio mentre attraversa la pipeline: business, conversazione, tool eseguiti e risposta."""
+
+    def __init__(self, incoming_msg, from_number, user_name):
+        self.incoming_msg = incoming_msg
+        self.from_number = from_number
+        self.user_name = user_name
+        self.started = time.time()
+        self.business_id = None
+        self.history = []
+        self.conversation_state = None
+        self.tool_events = []  # (nome, argomenti, esito) dei tool eseguiti, dal percorso veloce o dal modello
+        self.reply = FALLBACK_REPLY
+
+    def unknown_business(self):
+        metrics.annotate(path="unknown_business")
+        return UNKNOWN_BUSINESS_REPLY
+
+    def start(self, business):
+        self.business_id = business['_id']
+        metrics.annotate(business_id=str(self.business_id))
+        print(f"✅ Richiesta per: {business.get('business_name')}")
+
+    def set_conversation(self, conversation):
+        """Risultato di load_conversation: ultimi messaggi e stato strutturato."""
+        self.history, self.conversation_state = conversation
+
+    def tool_context(self):
+        """Argomenti di contesto dei tool, che sovrascrivono quelli del modello."""
+        return {'business_id': self.business_id, 'user_id': self.from_number, 'user_name': self.user_name}
+
+    def fast_reply(self, reply):
+        metrics.annotate(path="fast")
+        self.reply = reply
+
+    def model_prompt(self, business, config):
+        """Messaggi per il modello: prefisso stabile (tool, istruzioni, business) per la cache dei prompt di OpenAI."""
+        metrics.annotate(path="model")
+        api_messages, token_report = build_prompt_messages(
+            business, config, self.history, self.incoming_msg, state_block=format_state_block(self.conversation_state)
+        )
+        print(format_token_report(token_report))
+        return api_messages
+
+    def add_tool_results(self, api_messages, tool_calls, tool_messages):
+        """Esiti dei tool: nella conversazione del modello e in tool_events per lo stato della conversazione."""
+        api_messages.extend(tool_messages)
+        self.tool_events.extend(collect_tool_events(tool_calls, tool_messages))
+
+    def model_reply(self, reply):
+        self.reply = reply or self.reply
+
+    def fail(self, error):
+        """Risposta quando la pipeline si interrompe: degradata se una dipendenza non ha risposto in tempo."""
+        if isinstance(error, resilience.DependencyUnavailable):
+            print(f"⏱️ Risposta degradata: {error}")
+            metrics.annotate(path="degraded")
+            self.reply = booking_logic.degraded_reply(self.tool_events)
+        else:
+            print(f"💥 ERRORE GLOBALE nel webhook: {error}\n{traceback.format_exc()}")
+            metrics.annotate(path="error")
+            self.reply = GENERAL_ERROR_REPLY
+
+    def conversation_update(self):
+        """
+        Messaggi da aggiungere alla conversazione e nuovo stato (None se nessun tool è stato eseguito,
+        lo stato resta com'è). Solleva ValueError se il business non è stato determinato.
+        """
+        if self.business_id is None:
+            raise ValueError("business non determinato")
+        new_state = apply_tool_events(self.conversation_state, self.tool_events) if self.tool_events else None
+        return exchange_messages(self.incoming_msg, self.reply), new_state
+
+    def finish(self):
+        print(f"📤 Risposta finale in {time.time() - self.started:.2f}s: '{self.reply[:80]}...'")
+        return self.reply
@@ -0,0 +1,195 @@
+# message_queue.py - Code per l'elaborazione asincrona dei messaggi in arrivo
+
+import importlib
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+
+class InlineQueue:
+    """Esegue subito il job nel thread chiamante. Utile nei test e in locale."""
+
+    def __init__(self, handler, **kwargs):
+        self.handler = handler
+
+    def enqueue(self, job):
+        _run_job(self.handler, job)
+        return True
+
+
+class ThreadQueue:
+    """
+    Coda in memoria servita da un pool di thread del worker.
+    Veloce ma non persistente: i messaggi in coda si perdono se il processo muore.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, **kwargs):
+        self.handler = handler
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def _ensure_workers(self):
+        # I thread vanno creati nel processo worker, non nel master di gunicorn (--preload)
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"message-worker-{i}", daemon=True).start()
+
+    def enqueue(self, job):
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            return False
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                _run_job(self.handler, job)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Attende che tutti i job in coda siano stati elaborati."""
+        self._queue.join()
+
+
+class MongoQueue:
+    """
+    Coda persistente su MongoDB (collection inbound_jobs), condivisa tra i worker.
+    Finché un job è in elaborazione il worker rinnova claimed_at; se il worker muore il job torna
+    disponibile dopo visibility_timeout. Ogni presa in carico ha il suo claim: rinnovo e completamento
+    valgono solo per il claim (e il claimed_at) di chi lo sta elaborando. Il handler riceve il job con
+    'deliveries', il numero di prese in carico (più di 1 se è stato ripreso).
+    """
+
+    def __init__(self, handler, collection, workers=4, poll_interval=0.5, visibility_timeout=120, **kwargs):
+        self.handler = handler
+        self.collection = collection
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def _ensure_workers(self):
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"mongo-message-worker-{i}", daemon=True).start()
+
+    def enqueue(self, job):
+        self._ensure_workers()
+        try:
+            self.collection.insert_one({"job": job, "status": "queued", "created_at": datetime.utcnow()})
+            return True
+        except Exception as e:
+            print(f"❌ Errore inserimento job in coda: {e}")
+            return False
+
+    def _claim(self):
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {"status": "processing", "claimed_at": {"$lt": now - timedelta(seconds=self.visibility_timeout)}}
+            ]},
+            {"$set": {"status": "processing", "claimed_at": now, "claim": uuid.uuid4().hex}, "$inc": {"deliveries": 1}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _owned(self, document):
+        """Filtro che trova il job solo se è ancora preso in carico da questo worker."""
+        return {"_id": document["_id"], "claim": document["claim"], "claimed_at": document["claimed_at"]}
+
+    def _keep_claimed(self, document, done):
+        """Rinnova claimed_at mentre il job è in elaborazione, così non viene riconsegnato a un altro worker."""
+        while not done.wait(self.visibility_timeout / 3):
+            now = datetime.utcnow()
+            try:
+                if not self.collection.update_one(self._owned(document), {"$set": {"claimed_at": now}}).matched_count:
+                    print(f"⚠️ Job {document['_id']} ripreso da un altro worker")
+                    return
+                document["claimed_at"] = now
+            except Exception as e:
+                print(f"⚠️ Errore rinnovo job in elaborazione: {e}")
+
+    def _complete(self, document):
+        try:
+            if not self.collection.delete_one(self._owned(document)).deleted_count:
+                print(f"⚠️ Job {document['_id']} ripreso da un altro worker: non lo rimuovo")
+        except Exception as e:
+            print(f"⚠️ Errore rimozione job completato: {e}")
+
+    def _process(self, document):
+        done = threading.Event()
+        keeper = threading.Thread(target=self._keep_claimed, args=(document, done), name="mongo-message-claim", daemon=True)
+        keeper.start()
+        try:
+            _run_job(self.handler, dict(document["job"], deliveries=document["deliveries"]))
+        finally:
+            done.set()
+            # Il rinnovo in corso aggiorna claimed_at: il completamento usa quello definitivo
+            keeper.join()
+        self._complete(document)
+
+    def _work(self):
+        while True:
+            try:
+                document = self._claim()
+            except Exception as e:
+                print(f"⚠️ Errore lettura coda messaggi: {e}")
+                document = None
+            if not document:
+                time.sleep(self.poll_interval)
+                continue
+            self._process(document)
+
+
+def _run_job(handler, job):
+    try:
+        handler(job)
+    except Exception as e:
+        print(f"💥 Errore elaborazione job in coda: {e}\n{traceback.format_exc()}")
+
+
+QUEUE_BACKENDS = {
+    "inline": InlineQueue,
+    "thread": ThreadQueue,
+    "mongo": MongoQueue,
+}
+
+
+def create_queue(backend, handler, **kwargs):
+    """
+    Crea la coda indicata: 'inline', 'thread', 'mongo' oppure un percorso
+    'modulo:Classe' per un backend esterno con la stessa interfaccia enqueue(job) -> bool.
+    """
+    if backend in QUEUE_BACKENDS:
+        queue_class = QUEUE_BACKENDS[backend]
+    elif ":" in backend:
+        module_name, class_name = backend.split(":", 1)
+        queue_class = getattr(importlib.import_module(module_name), class_name)
+    else:
+        raise ValueError(f"Backend coda sconosciuto: {backend}")
+    print(f"📬 Webhook asincrono attivo con coda '{backend}'")
+    return queue_class(handler, **kwargs)
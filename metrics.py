@@ -0,0 +1,254 @@
+# metrics.py - Tempi per richiesta e metriche in formato Prometheus (route /metrics)
+#
+# Ogni messaggio apre una traccia (contextvars) in cui finiscono le durate delle chiamate a
+# OpenAI, dei tool, di Google Calendar e di MongoDB: a fine messaggio la scomposizione viene
+# stampata come riga JSON e le durate alimentano gli istogrammi esposti su /metrics.
+# Nessuna dipendenza esterna: il formato di testo di Prometheus è scritto qui.
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(zip(self.label_names, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._series.items())
+        for key, series in items:
+            labels = list(zip(self.label_names, key))
+            for bound, count in zip(self.buckets, series["counts"]):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+SPAN_SECONDS = Histogram(
+    "remindly_span_seconds", "Durata delle chiamate a OpenAI, tool, Google Calendar e MongoDB", ("kind", "name")
+)
+SPAN_ERRORS = Counter("remindly_span_errors_total", "Chiamate terminate con un errore", ("kind", "name"))
+MESSAGE_SECONDS = Histogram("remindly_message_seconds", "Tempo totale di elaborazione di un messaggio", ("path",))
+LLM_ITERATIONS = Histogram("remindly_llm_iterations", "Chiamate al modello per messaggio", buckets=COUNT_BUCKETS)
+TOOL_CALLS = Histogram("remindly_tool_calls_per_message", "Tool eseguiti per messaggio", buckets=COUNT_BUCKETS)
+
+_metrics = [SPAN_SECONDS, SPAN_ERRORS, MESSAGE_SECONDS, LLM_ITERATIONS, TOOL_CALLS]
+_collectors = []
+_request_listeners = []
+
+_current_trace = contextvars.ContextVar("remindly_trace", default=None)
+
+
+class RequestTrace:
+    """Durate accumulate per tipo di chiamata durante un messaggio (anche dai thread dei tool)."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            count, total = self.spans.get(kind, (0, 0.0))
+            self.spans[kind] = (count + 1, total + seconds)
+
+    def count(self, kind):
+        with self._lock:
+            return self.spans.get(kind, (0, 0.0))[0]
+
+    def breakdown(self):
+        with self._lock:
+            return {kind: {"calls": count, "ms": round(total * 1000, 1)} for kind, (count, total) in sorted(self.spans.items())}
+
+
+def record(kind, name, seconds, error=False):
+    """Registra una chiamata già misurata (es. dagli eventi di pymongo)."""
+    SPAN_SECONDS.observe(seconds, kind=kind, name=name)
+    if error:
+        SPAN_ERRORS.inc(kind=kind, name=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(kind, seconds)
+
+
+@contextmanager
+def span(kind, name):
+    """Misura il blocco come chiamata di tipo kind ('llm', 'tool', 'calendar', 'mongo')."""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(kind, name, time.perf_counter() - started, error)
+
+
+def start_request(**fields):
+    """Apre la traccia del messaggio corrente. Restituisce il token da passare a finish_request."""
+    return _current_trace.set(RequestTrace(**fields))
+
+
+def annotate(**fields):
+    """Aggiunge campi (es. business_id, path) alla riga di log del messaggio corrente."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def finish_request(token):
+    """Chiude la traccia, aggiorna gli istogrammi per messaggio e stampa la scomposizione come JSON."""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return None
+    elapsed = time.perf_counter() - trace.started
+    path = trace.fields.setdefault("path", "unknown")
+    MESSAGE_SECONDS.observe(elapsed, path=path)
+    LLM_ITERATIONS.observe(trace.count("llm"))
+    TOOL_CALLS.observe(trace.count("tool"))
+    entry = dict(trace.fields, event="message_processed", total_ms=round(elapsed * 1000, 1), spans=trace.breakdown())
+    print(json.dumps(entry, ensure_ascii=False, default=str))
+    for listener in list(_request_listeners):
+        listener(entry)
+    return entry
+
+
+def add_request_listener(callback):
+    """callback(entry) riceve la scomposizione di ogni messaggio concluso (es. dal load test)."""
+    _request_listeners.append(callback)
+
+
+def in_current_context(function):
+    """
+    Lega function al contesto di chi la chiama, da passare ai pool di thread: il tool eseguito
+    nel pool vede la traccia del messaggio che l'ha lanciato.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Durata di ogni comando MongoDB. Con pymongo l'evento arriva nel thread che ha eseguito il comando,
+    quindi finisce anche nella traccia del messaggio; con motor alimenta solo gli istogrammi.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record("mongo", event.command_name, event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        record("mongo", event.command_name, event.duration_micros / 1_000_000, error=True)
+
+
+mongo_listener = MongoCommandMetrics()
+
+
+def register_stats(prefix, help_text, get_stats, label_name=None, gauges=()):
+    """
+    Espone come contatori i valori numerici di un dict di statistiche già esistente
+    (es. cache dei business): prefix_chiave_total. I dict annidati diventano un'etichetta label_name.
+    Le chiavi in gauges sono valori istantanei (es. dimensione di una cache): prefix_chiave, di tipo gauge.
+    """
+    _collectors.append((prefix, help_text, get_stats, label_name, frozenset(gauges)))
+
+
+def _render_stats(prefix, help_text, get_stats, label_name, gauges):
+    try:
+        stats = get_stats() or {}
+    except Exception as e:
+        print(f"⚠️ Statistiche {prefix} non disponibili: {e}")
+        return []
+    lines = []
+    for key, value in sorted(stats.items()):
+        metric_type = "gauge" if key in gauges else "counter"
+        name = f"{prefix}_{key}" if metric_type == "gauge" else f"{prefix}_{key}_total"
+        if isinstance(value, dict) and label_name:
+            samples = [(f"{name}{_format_labels([(label_name, sub_key)])}", sub_value) for sub_key, sub_value in sorted(value.items())]
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            samples = [(name, value)]
+        else:
+            continue
+        lines += [f"# HELP {name} {help_text}: {key}", f"# TYPE {name} {metric_type}"]
+        lines += [f"{sample} {_format_value(sample_value)}" for sample, sample_value in samples]
+    return lines
+
+
+def render():
+    """Tutte le metriche nel formato di testo di Prometheus."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for collector in list(_collectors):
+        lines += _render_stats(*collector)
+    return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,165 @@
+# prompts.py - Prompt di sistema e definizione dei tool per il modello
+
+import json
+import os
+from datetime import datetime
+
+TOOLS = [
+    {
+        "type": "function", "function": {
+            "name": "get_available_slots", "description": "Trova gli orari disponibili per un servizio in una data specifica.",
+            "parameters": { "type": "object", "properties": { "service_name": {"type": "string"}, "date": {"type": "string"} }, "required": ["service_name", "date"] },
+        },
+    },
+    {
+        "type": "function", "function": {
+            "name": "get_next_available_slot", "description": "Trova il primo orario disponibile per un servizio, partendo da oggi. Da usare quando l'utente chiede 'il prima possibile', 'quando puoi', o non specifica una data.",
+            "parameters": { "type": "object", "properties": { "service_name": {"type": "string"} }, "required": ["service_name"] },
+        },
+    },
+    {
+        "type": "function", "function": {
+            "name": "create_or_update_booking", "description": "Crea o aggiorna un appuntamento. Usala SOLO quando hai la conferma esplicita del servizio, della data e dell'ora.",
+            "parameters": { "type": "object", "properties": { "service_name": {"type": "string"}, "date": {"type": "string"}, "time": {"type": "string"} }, "required": ["service_name", "date", "time"] },
+        },
+    },
+    {
+        "type": "function", "function": {
+            "name": "cancel_booking", "description": "Cancella l'ultimo appuntamento confermato di un utente.",
+            "parameters": {"type": "object", "properties": {}},
+        },
+    },
+    {
+        "type": "function", "function": {
+            "name": "get_business_info", "description": "Recupera informazioni generali sul business (orari, indirizzo, lista servizi).",
+            "parameters": {"type": "object", "properties": {}},
+        }
+    }
+]
+
+
+# Istruzioni identiche per tutti i business e tutti i messaggi: insieme ai tool formano il prefisso
+# che OpenAI può riusare dalla cache. Tutto ciò che cambia (business, cronologia, ora) va dopo.
+STATIC_INSTRUCTIONS = """
+Sei un assistente AI per l'attività descritta nel messaggio successivo, la tua specialità è prenotare appuntamenti in modo efficiente e naturale.
+
+**MEMORIA E CONTESTO (REGOLA FONDAMENTALE):**
+- **Ricorda sempre i messaggi precedenti!** Se l'utente ha già specificato un servizio (es. "taglio capelli") e poi dice "il prima possibile", devi capire che sta chiedendo il primo orario per il servizio di taglio. NON chiedere di nuovo il servizio.
+- **Deduci il servizio:** Se l'utente chiede "per tagliare i capelli", devi associarlo al servizio più pertinente (es. "Taglio" o "Taglio uomo") e usarlo per la funzione `get_next_available_slot`.
+- **Riempi le informazioni mancanti:** Il tuo obiettivo è raccogliere `service_name`, `date` e `time`. Usa la conversazione per ottenere le informazioni una per una. Se hai già il servizio, chiedi la data. Se hai entrambi, propon gli orari.
+
+**FLUSSO DI LAVORO:**
+1.  L'utente esprime un'intenzione (es. "vorrei un appuntamento").
+2.  Identifica il `service_name` dalla sua richiesta. Se non è chiaro, chiediglielo.
+3.  Una volta ottenuto il servizio, cerca la disponibilità usando `get_next_available_slot` (se non dà una data) o `get_available_slots` (se la dà).
+4.  Proponi gli orari all'utente.
+5.  Quando l'utente conferma un orario, e SOLO ALLORA, usa `create_or_update_booking`.
+
+Usa la data e l'ora attuali indicate subito prima dell'ultimo messaggio dell'utente.
+Sii sempre conciso e vai dritto al punto.
+"""
+
+# Token massimi di cronologia inviati al modello: si tengono i messaggi più recenti che ci stanno
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", "800"))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # tiktoken è in requirements.txt; se manca o non riesce a scaricare la codifica
+    # (es. worker senza rete), stimiamo circa 4 caratteri per token
+    print("⚠️ tiktoken non disponibile: conteggio dei token stimato dai caratteri")
+    _encoding = None
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    """Token di un messaggio chat, con il piccolo costo fisso per ruolo e separatori."""
+    return count_tokens(message.get("content")) + 4
+
+
+TOOLS_TOKENS = count_tokens(json.dumps(TOOLS, ensure_ascii=False))
+STATIC_TOKENS = count_tokens(STATIC_INSTRUCTIONS)
+
+
+def build_business_block(business, config):
+    """Parte specifica del business; config è la configurazione parsata (può essere None)."""
+    services_list = config["services"] if config else []
+    service_names = [s.get('name') for s in services_list if s.get('name')]
+    services_prompt_part = f"I servizi disponibili sono: {', '.join(service_names)}." if service_names else ""
+    return f"Attività: '{business.get('business_name')}'.\n{services_prompt_part}".strip()
+
+
+def build_time_block(now=None):
+    return f"Data e ora attuali: {(now or datetime.now()).strftime('%Y-%m-%d %H:%M')}."
+
+
+def trim_history(history, budget=PROMPT_HISTORY_TOKEN_BUDGET):
+    """Ultimi messaggi della cronologia che stanno nel budget di token (dal più recente al più vecchio)."""
+    kept = []
+    used = 0
+    for message in reversed(history or []):
+        tokens = message_tokens(message)
+        if used + tokens > budget:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    # Non iniziare con una risposta dell'assistente rimasta senza la sua domanda
+    while kept and kept[0].get("role") == "assistant":
+        used -= message_tokens(kept.pop(0))
+    return kept, used
+
+
+def build_prompt_messages(business, config, history, incoming_msg, now=None, history_budget=PROMPT_HISTORY_TOKEN_BUDGET, state_block=None):
+    """
+    Messaggi per il modello in ordine di stabilità: istruzioni statiche (dopo i tool), blocco del
+    business, stato della conversazione, cronologia, ora attuale e messaggio dell'utente.
+    Restituisce (messaggi, conteggio token).
+    """
+    business_block = build_business_block(business, config)
+    time_block = build_time_block(now)
+    trimmed_history, history_tokens = trim_history(history, history_budget)
+
+    messages = (
+        [{"role": "system", "content": STATIC_INSTRUCTIONS},
+         {"role": "system", "content": business_block}]
+        + ([{"role": "system", "content": state_block}] if state_block else [])
+        + trimmed_history
+        + [{"role": "system", "content": time_block},
+           {"role": "user", "content": incoming_msg}]
+    )
+    report = {
+        "tools": TOOLS_TOKENS,
+        "static": STATIC_TOKENS,
+        "business": count_tokens(business_block),
+        "state": count_tokens(state_block),
+        "history": history_tokens,
+        "history_messages": len(trimmed_history),
+        "volatile": count_tokens(time_block) + count_tokens(incoming_msg),
+    }
+    report["total"] = sum(report[k] for k in ("tools", "static", "business", "state", "history", "volatile")) + 4 * len(messages)
+    return messages, report
+
+
+def format_token_report(report):
+    return (f"🧮 Prompt ~{report['total']} token (tool {report['tools']}, statico {report['static']}, "
+            f"business {report['business']}, stato {report['state']}, cronologia {report['history']} su {report['history_messages']} msg, "
+            f"variabile {report['volatile']})")
+
+
+def format_usage(usage, iteration):
+    """Token effettivi riportati da OpenAI per una chiamata, con la parte servita dalla cache se disponibile."""
+    if not usage:
+        return f"🧾 Iter. {iteration}: utilizzo token non disponibile"
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details else None
+    cached_text = f", {cached} in cache" if cached is not None else ""
+    return f"🧾 Iter. {iteration}: input {usage.prompt_tokens} token{cached_text}, output {usage.completion_tokens}"
@@ -0,0 +1,263 @@
+# reminders.py - Promemoria WhatsApp degli appuntamenti, inviati a lotti con APScheduler
+#
+# Nessun timer in memoria per singola prenotazione: un job periodico scorre le prenotazioni che
+# iniziano entro REMINDER_LEAD_MINUTES (indice reminder_status + start), le prende in carico a lotti
+# con un update_many e le invia con un pool di thread limitato da un rate limiter. Lo stato
+# reminder_status (pending -> sending -> sent) rende l'invio idempotente tra più processi: una
+# prenotazione "sending" torna disponibile solo se chi l'aveva presa non risponde entro
+# REMINDER_VISIBILITY_SECONDS.
+# I promemoria partono fuori dalla finestra di 24 ore di WhatsApp, quindi come template approvato
+# (REMINDER_CONTENT_SID): un testo libero verrebbe accettato da Twilio e poi scartato. I messaggi che
+# Twilio segnala come non recapitati (subito o con la status callback su /reminders/status) restano
+# registrati come falliti, non come inviati.
+# Avvio come processo dedicato: python reminders.py (vedi Procfile)
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from pymongo import UpdateOne
+
+import booking_logic
+
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", str(24 * 60)))
+# Per appuntamenti più vicini di così il promemoria non ha senso (prenotati all'ultimo momento)
+REMINDER_MIN_LEAD_MINUTES = int(os.getenv("REMINDER_MIN_LEAD_MINUTES", "60"))
+REMINDER_SCAN_SECONDS = int(os.getenv("REMINDER_SCAN_SECONDS", "60"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", "8"))
+REMINDER_RATE_PER_SECOND = float(os.getenv("REMINDER_RATE_PER_SECOND", "20"))
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "3"))
+REMINDER_VISIBILITY_SECONDS = int(os.getenv("REMINDER_VISIBILITY_SECONDS", "600"))
+# Content SID ("HX...") del template approvato; un business può averne uno suo (campo reminder_content_sid)
+REMINDER_CONTENT_SID = os.getenv("REMINDER_CONTENT_SID")
+# URL pubblico di /reminders/status, dove Twilio segnala i promemoria non recapitati (facoltativo)
+REMINDER_STATUS_CALLBACK_URL = os.getenv("REMINDER_STATUS_CALLBACK_URL")
+
+# Stati Twilio di un messaggio che non arriverà al cliente
+FAILED_MESSAGE_STATUSES = {"failed", "undelivered"}
+
+
+def initial_reminder_status(start, now):
+    """Stato iniziale del promemoria per una prenotazione che inizia a `start` (UTC)."""
+    return "pending" if start - now > timedelta(minutes=REMINDER_MIN_LEAD_MINUTES) else "skipped"
+
+
+class RateLimiter:
+    """Token bucket condiviso dai thread di invio: al massimo rate_per_second messaggi al secondo."""
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TwilioReminderSender:
+    """Invio reale tramite l'API REST di Twilio (stesse credenziali del webhook)."""
+
+    def __init__(self, account_sid=None, auth_token=None):
+        from twilio.rest import Client as TwilioClient
+        self.client = TwilioClient(account_sid or os.getenv("TWILIO_ACCOUNT_SID"), auth_token or os.getenv("TWILIO_AUTH_TOKEN"))
+
+    def send(self, from_number, to_number, content_sid, content_variables):
+        """
+        Invia il template content_sid con le sue variabili e restituisce il SID del messaggio; solleva
+        un'eccezione se Twilio lo rifiuta o lo segna già come non recapitabile.
+        """
+        options = {"status_callback": REMINDER_STATUS_CALLBACK_URL} if REMINDER_STATUS_CALLBACK_URL else {}
+        message = self.client.messages.create(
+            from_=from_number, to=to_number, content_sid=content_sid, content_variables=json.dumps(content_variables), **options
+        )
+        if message.status in FAILED_MESSAGE_STATUSES or message.error_code:
+            raise RuntimeError(f"Twilio {message.status} (codice {message.error_code}): {message.error_message}")
+        return message.sid
+
+
+def delivery_failure_update(values, now=None):
+    """
+    Filtro e modifica per una status callback di Twilio (campi del form) che segnala un promemoria
+    non recapitato; None se lo stato non è un fallimento.
+    """
+    status = values.get("MessageStatus")
+    if status not in FAILED_MESSAGE_STATUSES or not values.get("MessageSid"):
+        return None
+    error = f"Twilio {status} (codice {values.get('ErrorCode') or '-'})"
+    return (
+        {"reminder_sid": values["MessageSid"], "reminder_status": "sent"},
+        {"$set": {"reminder_status": "failed", "reminder_error": error, "reminder_failed_at": now or datetime.utcnow()}},
+    )
+
+
+def record_delivery_status(bookings_collection, values):
+    """Registra come fallito il promemoria segnalato dalla status callback. True se era un promemoria inviato."""
+    update = delivery_failure_update(values)
+    return bool(update) and bookings_collection.update_one(*update).modified_count == 1
+
+
+async def arecord_delivery_status(bookings_collection, values):
+    update = delivery_failure_update(values)
+    return bool(update) and (await bookings_collection.update_one(*update)).modified_count == 1
+
+
+class ReminderScheduler:
+    """Scansione periodica delle prenotazioni in arrivo e invio dei promemoria."""
+
+    def __init__(self, bookings_collection, businesses_collection, sender,
+                 lead_minutes=REMINDER_LEAD_MINUTES, min_lead_minutes=REMINDER_MIN_LEAD_MINUTES,
+                 batch_size=REMINDER_BATCH_SIZE, concurrency=REMINDER_CONCURRENCY,
+                 rate_per_second=REMINDER_RATE_PER_SECOND):
+        self.bookings = bookings_collection
+        self.businesses = businesses_collection
+        self.sender = sender
+        self.lead = timedelta(minutes=lead_minutes)
+        self.min_lead = timedelta(minutes=min_lead_minutes)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self._lock = threading.Lock()
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "expired": 0, "batches": 0}
+
+    def _claimable_filter(self, now):
+        return {
+            "status": "confirmed",
+            "start": {"$gt": now + self.min_lead, "$lte": now + self.lead},
+            "$or": [
+                # reminder_retry_at: dopo un errore si riprova alla scansione successiva, non nello stesso giro
+                {"reminder_status": "pending", "reminder_retry_at": {"$not": {"$gt": now}}},
+                {"reminder_status": "sending", "reminder_claimed_at": {"$lt": now - timedelta(seconds=REMINDER_VISIBILITY_SECONDS)}},
+            ],
+        }
+
+    def _expire_missed(self, now):
+        """I promemoria rimasti indietro (scheduler fermo) non partono più a ridosso dell'appuntamento."""
+        result = self.bookings.update_many(
+            {"reminder_status": "pending", "start": {"$lte": now + self.min_lead}},
+            {"$set": {"reminder_status": "expired"}}
+        )
+        with self._lock:
+            self.stats["expired"] += result.modified_count
+
+    def _claim_batch(self, now):
+        """Prende in carico fino a batch_size prenotazioni con tre operazioni, qualunque sia la dimensione del lotto."""
+        claimable = self._claimable_filter(now)
+        ids = [doc["_id"] for doc in self.bookings.find(claimable, {"_id": 1}).sort("start", 1).limit(self.batch_size)]
+        if not ids:
+            return []
+        claim = uuid.uuid4().hex
+        # Il filtro viene ripetuto: se un altro processo le ha prese nel frattempo, qui non passano
+        self.bookings.update_many(
+            dict(claimable, _id={"$in": ids}),
+            {"$set": {"reminder_status": "sending", "reminder_claim": claim, "reminder_claimed_at": now}}
+        )
+        return list(self.bookings.find({"reminder_claim": claim, "reminder_status": "sending"}))
+
+    def _business_numbers(self, bookings):
+        business_ids = list({booking["business_id"] for booking in bookings})
+        return {
+            business["_id"]: business
+            for business in self.businesses.find(
+                {"_id": {"$in": business_ids}}, {"business_name": 1, "twilio_phone_number": 1, "reminder_content_sid": 1}
+            )
+        }
+
+    def _send_one(self, booking, business):
+        if not business or not business.get("twilio_phone_number"):
+            return booking, None, "business senza numero Twilio"
+        content_sid = business.get("reminder_content_sid") or REMINDER_CONTENT_SID
+        if not content_sid:
+            return booking, None, "template del promemoria non configurato (REMINDER_CONTENT_SID)"
+        self.rate_limiter.acquire()
+        try:
+            sid = self.sender.send(
+                business["twilio_phone_number"], booking["user_id"], content_sid,
+                booking_logic.reminder_variables(booking, business.get("business_name", "noi"))
+            )
+            return booking, sid, None
+        except Exception as e:
+            return booking, None, str(e)
+
+    def _outcome_update(self, booking, sid, error, now):
+        """Esito dell'invio, applicato solo se la prenotazione è ancora presa in carico da questo lotto."""
+        owned = {"_id": booking["_id"], "reminder_claim": booking["reminder_claim"], "reminder_status": "sending"}
+        if not error:
+            return UpdateOne(owned, {"$set": {"reminder_status": "sent", "reminder_sent_at": now, "reminder_sid": sid}}), "sent"
+        attempts = booking.get("reminder_attempts", 0) + 1
+        status = "failed" if attempts >= REMINDER_MAX_ATTEMPTS else "pending"
+        update = {"$set": {
+            "reminder_status": status, "reminder_attempts": attempts, "reminder_error": error,
+            "reminder_retry_at": now + timedelta(seconds=REMINDER_SCAN_SECONDS),
+        }}
+        if status == "failed":
+            update["$set"]["reminder_failed_at"] = now
+        return UpdateOne(owned, update), "failed" if status == "failed" else "retried"
+
+    def run_once(self, now=None):
+        """Invia tutti i promemoria dovuti. Restituisce quanti ne ha inviati."""
+        now = now or datetime.utcnow()
+        self._expire_missed(now)
+        sent_total = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="reminder-sender") as pool:
+            while True:
+                bookings = self._claim_batch(now)
+                if not bookings:
+                    break
+                businesses = self._business_numbers(bookings)
+                results = list(pool.map(lambda booking: self._send_one(booking, businesses.get(booking["business_id"])), bookings))
+
+                updates, counts = [], {"sent": 0, "failed": 0, "retried": 0}
+                for booking, sid, error in results:
+                    update, outcome = self._outcome_update(booking, sid, error, datetime.utcnow())
+                    updates.append(update)
+                    counts[outcome] += 1
+                    if error:
+                        print(f"⚠️ Promemoria per {booking['user_id']} non inviato: {error}")
+                self.bookings.bulk_write(updates, ordered=False)
+
+                with self._lock:
+                    self.stats["batches"] += 1
+                    for key, value in counts.items():
+                        self.stats[key] += value
+                sent_total += counts["sent"]
+        if sent_total:
+            print(f"🔔 Promemoria inviati: {sent_total}")
+        return sent_total
+
+    def _safe_run(self):
+        try:
+            self.run_once()
+        except Exception as e:
+            print(f"❌ Errore scansione promemoria: {e}")
+
+    def start(self):
+        """Avvia la scansione periodica e blocca il processo (processo dedicato)."""
+        scheduler = BlockingScheduler()
+        scheduler.add_job(
+            self._safe_run, 'interval', seconds=REMINDER_SCAN_SECONDS, next_run_time=datetime.now(),
+            id='appointment-reminders', max_instances=1, coalesce=True
+        )
+        print(f"⏰ Promemoria ogni {REMINDER_SCAN_SECONDS}s, {REMINDER_LEAD_MINUTES} minuti prima dell'appuntamento")
+        scheduler.start()
+
+
+if __name__ == '__main__':
+    from database import db_connection
+    ReminderScheduler(db_connection.bookings, db_connection.businesses, TwilioReminderSender()).start()
@@ -0,0 +1,238 @@
+# resilience.py - Tempo massimo per messaggio, retry con backoff e circuit breaker verso OpenAI e Google Calendar
+#
+# Ogni messaggio riceve un budget (MESSAGE_DEADLINE_SECONDS, sotto i 15 secondi dopo cui Twilio
+# rinuncia) salvato in un contextvar: lo vedono il ciclo del modello, i tool (anche nei thread del
+# pool, grazie a metrics.in_current_context) e le chiamate a Calendar. Ogni tentativo riceve come
+# timeout il minimo tra il limite della dipendenza e il tempo rimasto; gli errori transitori vengono
+# ritentati con backoff casuale solo se resta tempo. Se una dipendenza continua a fallire il suo
+# breaker si apre e per qualche secondo le chiamate falliscono subito, invece di consumare il budget.
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+
+import openai
+
+MESSAGE_DEADLINE_SECONDS = float(os.getenv("MESSAGE_DEADLINE_SECONDS", "12"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "8"))
+# Con meno tempo di così una nuova chiamata al modello non arriverebbe in tempo: meglio la risposta degradata
+LLM_MIN_SECONDS = float(os.getenv("LLM_MIN_SECONDS", "1.5"))
+
+
+class DependencyUnavailable(Exception):
+    """Una dipendenza esterna non può rispondere in tempo: il chiamante deve degradare la risposta."""
+
+
+class DeadlineExceeded(DependencyUnavailable):
+    pass
+
+
+class CircuitOpenError(DependencyUnavailable):
+    pass
+
+
+_deadline = contextvars.ContextVar("remindly_deadline", default=None)
+
+
+def start_deadline(seconds=MESSAGE_DEADLINE_SECONDS, started_at=None):
+    """
+    Fissa il tempo massimo del messaggio corrente, contato da started_at (time.monotonic() della
+    ricezione, se il messaggio ha già atteso) o da adesso. Restituisce il token da passare a end_deadline.
+    """
+    return _deadline.set((time.monotonic() if started_at is None else started_at) + seconds)
+
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """Secondi rimasti al messaggio corrente, o None fuori da un messaggio (es. job in background)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def budget(limit):
+    """Il minimo tra limit e il tempo rimasto (mai negativo)."""
+    left = remaining()
+    return limit if left is None else max(0.0, min(limit, left))
+
+
+def check_deadline(dependency, min_seconds=0.0):
+    """Solleva DeadlineExceeded se al messaggio restano min_seconds o meno."""
+    left = remaining()
+    if left is not None and left <= min_seconds:
+        raise DeadlineExceeded(f"tempo del messaggio esaurito prima di chiamare {dependency}")
+
+
+def is_transient_openai_error(error):
+    """Timeout, errori di rete, 429 e 5xx di OpenAI (il client ha max_retries=0: i retry li facciamo qui)."""
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+class CircuitBreaker:
+    """
+    Chiuso: le chiamate passano. Dopo failure_threshold errori transitori consecutivi si apre e
+    rifiuta tutto per reset_seconds; poi lascia passare una chiamata di prova (semiaperto),
+    che lo richiude se va a buon fine o lo riapre se fallisce.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        # Inizio della chiamata di prova: se non si conclude (es. task cancellato) se ne concede un'altra dopo reset_seconds
+        self._probe_started = None
+        self.stats = {"calls": 0, "failures": 0, "retries": 0, "rejected": 0, "opened": 0, "deadline_exceeded": 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def before_call(self):
+        """Solleva CircuitOpenError se il breaker è aperto (o se la chiamata di prova è già in corso)."""
+        with self._lock:
+            self.stats["calls"] += 1
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            probe_free = self._probe_started is None or now - self._probe_started >= self.reset_seconds
+            if now - self._opened_at >= self.reset_seconds and probe_free:
+                self._probe_started = now
+                return
+            self.stats["rejected"] += 1
+        raise CircuitOpenError(f"{self.name} non disponibile (circuit breaker aperto)")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"✅ {self.name} di nuovo raggiungibile, circuit breaker chiuso")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.stats["failures"] += 1
+            self._failures += 1
+            probe_failed = self._probe_started is not None
+            if probe_failed or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+                self.stats["opened"] += 1
+                print(f"🔌 Circuit breaker aperto per {self.name} ({self._failures} errori consecutivi)")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(dependency):
+    with _breakers_lock:
+        breaker = _breakers.get(dependency)
+        if breaker is None:
+            breaker = _breakers[dependency] = CircuitBreaker(dependency)
+        return breaker
+
+
+def stats():
+    """Statistiche per dipendenza nel formato di metrics.register_stats (label 'dependency', gauge 'open')."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    totals = {}
+    for breaker in breakers:
+        for key, value in breaker.stats.items():
+            totals.setdefault(key, {})[breaker.name] = value
+        # Valore istantaneo (gauge): 1 se il breaker rifiuta le chiamate
+        totals.setdefault("open", {})[breaker.name] = int(breaker.state != "closed")
+    return totals
+
+
+def _backoff(attempt):
+    """Full jitter: attesa casuale tra 0 e il backoff esponenziale del tentativo."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+def _retry_delay(breaker, dependency, error, is_transient, attempt, attempts):
+    """
+    Registra l'errore e restituisce l'attesa prima del prossimo tentativo. Se non si ritenta solleva
+    l'errore originale (errore della richiesta) o DependencyUnavailable (errori transitori esauriti).
+    """
+    if not is_transient(error):
+        # Errore della richiesta (es. 404): la dipendenza risponde, il breaker non c'entra
+        breaker.record_success()
+        raise error
+    breaker.record_failure()
+    delay = _backoff(attempt)
+    left = remaining()
+    # Niente retry se il tentativo ha appena aperto il breaker o non resta tempo per l'attesa
+    if attempt + 1 >= attempts or breaker.state != "closed" or (left is not None and left <= delay):
+        raise DependencyUnavailable(f"{dependency} non raggiungibile: {type(error).__name__}: {error}") from error
+    breaker.count("retries")
+    return delay
+
+
+def _attempt_timeout(breaker, dependency, timeout, min_seconds):
+    try:
+        check_deadline(dependency, min_seconds)
+    except DeadlineExceeded:
+        breaker.count("deadline_exceeded")
+        raise
+    breaker.before_call()
+    return budget(timeout)
+
+
+def call(dependency, function, is_transient, timeout, attempts=RETRY_MAX_ATTEMPTS, min_seconds=0.0):
+    """
+    Esegue function(timeout_del_tentativo) con deadline, retry e circuit breaker della dipendenza.
+    is_transient(errore) dice se l'errore merita un nuovo tentativo (timeout, 429, 5xx...); esauriti
+    i tentativi, o il tempo del messaggio, viene sollevato DependencyUnavailable.
+    Passare attempts=1 per le operazioni non idempotenti (es. creazione di un evento); min_seconds
+    è il tempo minimo che deve restare al messaggio per iniziare un tentativo.
+    """
+    breaker = get_breaker(dependency)
+    for attempt in range(attempts):
+        attempt_timeout = _attempt_timeout(breaker, dependency, timeout, min_seconds)
+        try:
+            result = function(attempt_timeout)
+        except Exception as e:
+            delay = _retry_delay(breaker, dependency, e, is_transient, attempt, attempts)
+            print(f"🔁 {dependency}: nuovo tentativo tra {delay:.2f}s dopo {type(e).__name__}: {e}")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+async def acall(dependency, function, is_transient, timeout, attempts=RETRY_MAX_ATTEMPTS, min_seconds=0.0):
+    """Come call, con function(timeout) coroutine."""
+    breaker = get_breaker(dependency)
+    for attempt in range(attempts):
+        attempt_timeout = _attempt_timeout(breaker, dependency, timeout, min_seconds)
+        try:
+            result = await function(attempt_timeout)
+        except Exception as e:
+            delay = _retry_delay(breaker, dependency, e, is_transient, attempt, attempts)
+            print(f"🔁 {dependency}: nuovo tentativo tra {delay:.2f}s dopo {type(e).__name__}: {e}")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
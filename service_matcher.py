@@ -0,0 +1,103 @@
+# service_matcher.py - Riconoscimento del servizio richiesto dall'utente
+
+import re
+import unicodedata
+from functools import lru_cache
+from thefuzz import process
+
+# Parole che non aiutano a distinguere un servizio dall'altro
+ITALIAN_STOPWORDS = {
+    'il', 'lo', 'la', 'i', 'gli', 'le', 'l', 'un', 'uno', 'una',
+    'di', 'del', 'dello', 'della', 'dei', 'degli', 'delle', 'd',
+    'a', 'al', 'allo', 'alla', 'ai', 'agli', 'alle',
+    'da', 'dal', 'dalla', 'in', 'nel', 'nella', 'con', 'su', 'per', 'tra', 'fra',
+    'e', 'ed', 'o', 'mi', 'ti', 'si', 'ci', 'me', 'te',
+    'vorrei', 'voglio', 'fare', 'farmi', 'prenotare', 'prenotazione', 'appuntamento',
+    'servizio', 'solo', 'anche', 'po', 'grazie', 'favore',
+}
+
+FUZZY_THRESHOLD = 75
+
+
+def normalize(text):
+    """Minuscolo, senza accenti né punteggiatura, senza stopword italiane."""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    tokens = re.findall(r"[a-z0-9]+", text)
+    return ' '.join(t for t in tokens if t not in ITALIAN_STOPWORDS)
+
+
+class ServiceMatcher:
+    """
+    Indice dei servizi di un business, costruito una sola volta dalla configurazione.
+    Ordine di ricerca: nome/alias normalizzato esatto, parola chiave che identifica un solo
+    servizio, infine ricerca fuzzy. I risultati delle query recenti restano in un LRU.
+    """
+
+    def __init__(self, services, cache_size=256):
+        self.services = services
+        self._token_index = {}
+        self._choices = {}
+
+        for service in services:
+            names = [service.get('name', '')] + list(service.get('aliases') or [])
+            for name in names:
+                key = normalize(name)
+                if not key:
+                    continue
+                self._choices.setdefault(key, service)
+                for token in key.split():
+                    self._token_index.setdefault(token, [])
+                    if service not in self._token_index[token]:
+                        self._token_index[token].append(service)
+
+        self._choice_keys = list(self._choices)
+        self._match_normalized = lru_cache(maxsize=cache_size)(self._match_uncached)
+
+    def match(self, query):
+        """Restituisce il dict del servizio più adatto alla richiesta, o None."""
+        if not query:
+            return None
+        return self._match_normalized(normalize(query))
+
+    def match_strict(self, query):
+        """Come match, ma senza ricerca fuzzy: solo nome/alias esatto o parola chiave univoca."""
+        key = normalize(query)
+        if not key:
+            return None
+        return self._choices.get(key) or self._match_keywords(key)
+
+    def cache_info(self):
+        return self._match_normalized.cache_info()
+
+    def _match_uncached(self, key):
+        if not key:
+            return None
+
+        # 1. Nome o alias identico dopo la normalizzazione
+        service = self._choices.get(key)
+        if service:
+            return service
+
+        # 2. Le parole note della richiesta puntano a un solo servizio ("taglio capelli" -> "Taglio uomo")
+        service = self._match_keywords(key)
+        if service:
+            return service
+
+        # 3. Ricerca fuzzy con soglia di confidenza per evitare match errati
+        if not self._choice_keys:
+            return None
+        best_match, score = process.extractOne(key, self._choice_keys)
+        if score >= FUZZY_THRESHOLD:
+            return self._choices[best_match]
+        return None
+
+    def _match_keywords(self, key):
+        candidates = None
+        for token in key.split():
+            services = self._token_index.get(token)
+            if services is None:
+                continue
+            candidates = [s for s in candidates if s in services] if candidates is not None else list(services)
+        if candidates and len(candidates) == 1:
+            return candidates[0]
+        return None
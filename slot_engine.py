@@ -0,0 +1,73 @@
+# slot_engine.py - Calcolo degli slot liberi con sweep sugli intervalli occupati
+
+"""
+Tutti i tempi sono espressi in minuti dalla mezzanotte (orario locale del business),
+così il calcolo lavora solo con interi e non tocca datetime né strftime.
+"""
+
+
+def merge_intervals(intervals, lower=None, upper=None):
+    """
+    Ordina e fonde gli intervalli (inizio, fine) sovrapposti o adiacenti,
+    tagliandoli opzionalmente a [lower, upper].
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if lower is not None: start = max(start, lower)
+        if upper is not None: end = min(end, upper)
+        if end <= start: continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def free_gaps(work_start, work_end, busy):
+    """Intervalli liberi dentro l'orario di lavoro, dati gli occupati già fusi e ordinati."""
+    gaps = []
+    cursor = work_start
+    for start, end in busy:
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < work_end:
+        gaps.append((cursor, work_end))
+    return gaps
+
+
+def find_free_slots(work_start, work_end, busy_by_calendar, durations, step=30, not_before=None):
+    """
+    Calcola in un solo passaggio gli slot liberi per più durate.
+
+    busy_by_calendar: {calendar_id: [(inizio, fine), ...]} in minuti.
+    Gli inizi degli slot stanno sulla griglia work_start + k*step; uno slot è libero se
+    almeno un calendario è libero per tutta la durata. not_before scarta gli slot che
+    non iniziano strettamente dopo quel minuto.
+
+    Restituisce {durata: [(inizio, [calendar_id liberi]), ...]} ordinato per inizio.
+    """
+    results = {}
+    gaps_by_calendar = {
+        calendar_id: free_gaps(work_start, work_end, merge_intervals(busy, work_start, work_end))
+        for calendar_id, busy in busy_by_calendar.items()
+    }
+    for duration in durations:
+        starts = {}
+        for calendar_id, gaps in gaps_by_calendar.items():
+            for gap_start, gap_end in gaps:
+                # Primo inizio sulla griglia dentro il buco libero
+                offset = gap_start - work_start
+                first = work_start + -(-offset // step) * step
+                if not_before is not None and first <= not_before:
+                    first = work_start + ((not_before - work_start) // step + 1) * step
+                for slot_start in range(first, gap_end - duration + 1, step):
+                    starts.setdefault(slot_start, []).append(calendar_id)
+        results[duration] = sorted(starts.items())
+    return results
+
+
+def format_minutes(minutes):
+    """Minuti dalla mezzanotte -> 'HH:MM'."""
+    return '%02d:%02d' % divmod(minutes, 60)
@@ -0,0 +1,155 @@
+# slot_reservations.py - Slot tenuti in pending_bookings prima della scrittura su Google Calendar
+#
+# Una hold è un documento con chiave univoca (business_id, calendar_id, start): se due utenti
+# confermano lo stesso orario un solo inserimento passa, l'altro riceve DuplicateKeyError, anche
+# tra worker diversi. Le hold scadono da sole (indice TTL su expires_at). Lo slot che il percorso
+# veloce propone esplicitamente a un utente ("Confermi la prenotazione?") resta suo per qualche
+# minuto, così la sua conferma non deve ricalcolare le disponibilità.
+
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+SLOT_HOLD_SECONDS = int(os.getenv("SLOT_HOLD_SECONDS", "300"))
+# Dopo la scrittura su Google la hold resta ancora un po', finché i mirror degli altri worker vedono l'evento
+SLOT_BOOKED_GRACE_SECONDS = int(os.getenv("SLOT_BOOKED_GRACE_SECONDS", "120"))
+
+SLOT_FORMAT = '%Y-%m-%dT%H:%M'
+
+
+def slot_bounds(date, time, duration_minutes):
+    """Inizio e fine dello slot come stringhe 'AAAA-MM-GGTHH:MM' (ora locale, confrontabili tra loro)."""
+    start = datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M')
+    end = start + timedelta(minutes=duration_minutes)
+    return start.strftime(SLOT_FORMAT), end.strftime(SLOT_FORMAT)
+
+
+def _hold_document(business_id, calendar_id, user_id, service_name, date, time, duration_minutes, seconds, now):
+    start, end = slot_bounds(date, time, duration_minutes)
+    return {
+        "_id": ObjectId(),
+        "business_id": business_id,
+        "calendar_id": calendar_id,
+        "start": start,
+        "end": end,
+        "user_id": user_id,
+        "service": service_name,
+        "status": "held",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=seconds),
+    }
+
+
+def _takeover(hold, now):
+    """Filtro e update per riprendere uno slot già tenuto: solo se la hold è scaduta o è dello stesso utente."""
+    slot_filter = {
+        "business_id": hold["business_id"], "calendar_id": hold["calendar_id"], "start": hold["start"],
+        "$or": [{"expires_at": {"$lte": now}}, {"user_id": hold["user_id"], "status": "held"}],
+    }
+    fields = {key: value for key, value in hold.items() if key != "_id"}
+    return slot_filter, {"$set": fields}
+
+
+def _overlap_filter(hold, now):
+    """Hold attive di altri utenti sullo stesso calendario che si sovrappongono (durate diverse)."""
+    return {
+        "business_id": hold["business_id"],
+        "calendar_id": hold["calendar_id"],
+        "start": {"$lt": hold["end"]},
+        "end": {"$gt": hold["start"]},
+        "user_id": {"$ne": hold["user_id"]},
+        "expires_at": {"$gt": now},
+    }
+
+
+def _user_hold_filter(business_id, user_id, date, time, duration_minutes, now):
+    start, end = slot_bounds(date, time, duration_minutes)
+    return {
+        "business_id": business_id, "user_id": user_id, "start": start, "end": end,
+        "status": "held", "expires_at": {"$gt": now},
+    }
+
+
+def _release_update(booked, now):
+    return {"$set": {"status": "booked", "expires_at": now + timedelta(seconds=SLOT_BOOKED_GRACE_SECONDS)}} if booked else None
+
+
+def reserve(collection, business_id, calendar_ids, user_id, service_name, date, time, duration_minutes, seconds=SLOT_HOLD_SECONDS):
+    """
+    Tiene lo slot sul primo dei calendar_ids che riesce a riservare.
+    Restituisce il documento della hold, oppure None se lo slot è già tenuto da altri su tutti.
+    """
+    for calendar_id in calendar_ids:
+        now = datetime.utcnow()
+        hold = _hold_document(business_id, calendar_id, user_id, service_name, date, time, duration_minutes, seconds, now)
+        try:
+            collection.insert_one(hold)
+        except DuplicateKeyError:
+            slot_filter, update = _takeover(hold, now)
+            hold = collection.find_one_and_update(slot_filter, update, return_document=ReturnDocument.AFTER)
+            if not hold:
+                continue
+        # La chiave univoca copre solo lo stesso inizio: uno slot più lungo che si accavalla cede il posto
+        if collection.find_one(_overlap_filter(hold, now), {"_id": 1}):
+            collection.delete_one({"_id": hold["_id"]})
+            continue
+        return hold
+    return None
+
+
+def find_hold(collection, business_id, user_id, date, time, duration_minutes):
+    """Hold ancora valida dell'utente per esattamente questo slot, o None."""
+    return collection.find_one(_user_hold_filter(business_id, user_id, date, time, duration_minutes, datetime.utcnow()))
+
+
+def release(collection, hold, booked=False):
+    """Libera la hold; se l'appuntamento è stato creato la lascia scadere dopo un breve margine."""
+    update = _release_update(booked, datetime.utcnow())
+    if update:
+        collection.update_one({"_id": hold["_id"]}, update)
+    else:
+        collection.delete_one({"_id": hold["_id"]})
+
+
+def free_slot(collection, business_id, calendar_id, date, time, duration_minutes):
+    """Rimuove la hold rimasta su uno slot (es. appuntamento appena cancellato), così è subito prenotabile."""
+    start, _ = slot_bounds(date, time, duration_minutes)
+    collection.delete_one({"business_id": business_id, "calendar_id": calendar_id, "start": start})
+
+
+async def areserve(collection, business_id, calendar_ids, user_id, service_name, date, time, duration_minutes, seconds=SLOT_HOLD_SECONDS):
+    for calendar_id in calendar_ids:
+        now = datetime.utcnow()
+        hold = _hold_document(business_id, calendar_id, user_id, service_name, date, time, duration_minutes, seconds, now)
+        try:
+            await collection.insert_one(hold)
+        except DuplicateKeyError:
+            slot_filter, update = _takeover(hold, now)
+            hold = await collection.find_one_and_update(slot_filter, update, return_document=ReturnDocument.AFTER)
+            if not hold:
+                continue
+        if await collection.find_one(_overlap_filter(hold, now), {"_id": 1}):
+            await collection.delete_one({"_id": hold["_id"]})
+            continue
+        return hold
+    return None
+
+
+async def afind_hold(collection, business_id, user_id, date, time, duration_minutes):
+    return await collection.find_one(_user_hold_filter(business_id, user_id, date, time, duration_minutes, datetime.utcnow()))
+
+
+async def arelease(collection, hold, booked=False):
+    update = _release_update(booked, datetime.utcnow())
+    if update:
+        await collection.update_one({"_id": hold["_id"]}, update)
+    else:
+        await collection.delete_one({"_id": hold["_id"]})
+
+
+async def afree_slot(collection, business_id, calendar_id, date, time, duration_minutes):
+    start, _ = slot_bounds(date, time, duration_minutes)
+    await collection.delete_one({"business_id": business_id, "calendar_id": calendar_id, "start": start})
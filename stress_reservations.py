@@ -0,0 +1,120 @@
+# stress_reservations.py - Molti clienti confermano lo stesso slot nello stesso istante
+#
+# Verifica che le hold di slot_reservations lascino passare un solo cliente per slot: ogni thread
+# prova a riservare e, se ci riesce, crea l'appuntamento sulla finta API di fake_calendar.py.
+# Alla fine sul calendario deve esserci un solo evento per slot, anche con durate che si accavallano.
+# Usa un database separato sul MONGO_URI indicato (di default 'remindly_stress'), svuotato all'inizio.
+# Uso: MONGO_URI=... python stress_reservations.py [--clients 50] [--calendars 1] [--latency-ms 80]
+
+import argparse
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+import slot_reservations
+from calendar_service import CalendarService
+from db_indexes import INDEX_SPECS
+from fake_calendar import FakeCalendarAPI
+
+
+def make_collection(db_name):
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        raise SystemExit("Imposta MONGO_URI (verrà usato il database di prova, non quello di produzione)")
+    collection = MongoClient(uri)[db_name].pending_bookings
+    collection.drop()
+    collection.create_indexes(INDEX_SPECS["pending_bookings"])
+    return collection
+
+
+def book(collection, calendar_service, client_id, date, time, duration, results):
+    calendar_ids = calendar_service.calendar_ids
+    hold = slot_reservations.reserve(collection, "stress-business", calendar_ids, f"cliente{client_id}", "Taglio", date, time, duration)
+    if not hold:
+        results.append(("rifiutato", None))
+        return
+    event_id = None
+    try:
+        event_id = calendar_service.create_appointment(
+            date=date, start_time=time, duration_minutes=duration, customer_name=f"Cliente {client_id}",
+            customer_phone=f"cliente{client_id}", service_type="Taglio", calendar_id=hold["calendar_id"]
+        )
+    finally:
+        slot_reservations.release(collection, hold, booked=bool(event_id))
+    results.append(("prenotato" if event_id else "errore", hold["calendar_id"]))
+
+
+def hammer(collection, calendar_service, clients, date, requests):
+    """Lancia i clienti insieme (barriera) e restituisce gli esiti."""
+    results = []
+    barrier = threading.Barrier(clients)
+
+    def _run(client_id):
+        time, duration = requests[client_id % len(requests)]
+        barrier.wait()
+        book(collection, calendar_service, client_id, date, time, duration, results)
+
+    threads = [threading.Thread(target=_run, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def calendar_events(api, calendar_ids):
+    response = {}
+    for calendar_id in calendar_ids:
+        items = api.events().list(calendarId=calendar_id).execute()['items']
+        response[calendar_id] = [(e['start']['dateTime'][11:16], e['end']['dateTime'][11:16]) for e in items]
+    return response
+
+
+def overlapping(intervals):
+    intervals = sorted(intervals)
+    return any(prev[1] > curr[0] for prev, curr in zip(intervals, intervals[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--calendars', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=80, help="latenza simulata di ogni chiamata a Google")
+    parser.add_argument('--db', default=os.getenv("STRESS_DB", "remindly_stress"))
+    args = parser.parse_args()
+
+    collection = make_collection(args.db)
+    date = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
+    scenarios = [
+        ("stesso slot", [("10:00", 30)]),
+        ("durate che si accavallano", [("15:00", 60), ("15:30", 30), ("14:30", 60)]),
+    ]
+
+    failed = False
+    for name, requests in scenarios:
+        calendar_ids = [f"staff{c}" for c in range(args.calendars)]
+        api = FakeCalendarAPI({calendar_id: [] for calendar_id in calendar_ids}, latency_seconds=args.latency_ms / 1000)
+        calendar_service = CalendarService(calendar_id=calendar_ids)
+        calendar_service.service = api
+
+        results = hammer(collection, calendar_service, args.clients, date, requests)
+        outcomes = Counter(outcome for outcome, _ in results)
+        events = calendar_events(api, calendar_ids)
+        booked = sum(len(items) for items in events.values())
+        clash = any(overlapping(items) for items in events.values())
+        ok = outcomes["prenotato"] == booked and 1 <= booked <= args.calendars * len(requests) and not clash
+
+        print(f"{'✅' if ok else '❌'} {name}: {args.clients} clienti, esiti {dict(outcomes)}, eventi creati {booked}")
+        for calendar_id, items in events.items():
+            print(f"   {calendar_id}: {sorted(items)}")
+        failed = failed or not ok
+
+    collection.drop()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
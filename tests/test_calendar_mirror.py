@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from bench_mirror import make_service, query_all, random_events
+from calendar_mirror import MirroredCalendarService
+from calendar_service import CalendarService
+from fake_calendar import FakeCalendarAPI
+
+TIMEZONE = pytz.timezone('Europe/Rome')
+CALENDAR_IDS = ["staff0", "staff1", "staff2"]
+
+
+def _at(days, hour):
+    day = datetime.now(TIMEZONE).date() + timedelta(days=days)
+    return TIMEZONE.localize(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour)).isoformat()
+
+
+@pytest.fixture
+def api():
+    return FakeCalendarAPI(random_events(len(CALENDAR_IDS), 60, 14, seed=42))
+
+
+@pytest.fixture
+def services(api):
+    return make_service(CalendarService, api, CALENDAR_IDS), make_service(MirroredCalendarService, api, CALENDAR_IDS)
+
+
+@pytest.fixture
+def dates():
+    today = datetime.now(TIMEZONE).date()
+    return [(today + timedelta(days=i)).isoformat() for i in range(14)]
+
+
+def test_mirror_matches_direct_reads(services, dates):
+    live, mirrored = services
+    mirrored.mirror.sync_all()
+    assert query_all(mirrored, dates) == query_all(live, dates)
+
+
+def test_mirror_follows_incremental_changes(api, services, dates):
+    live, mirrored = services
+    mirrored.mirror.sync_all()
+    api.add_event('staff0', {'summary': 'Appuntamento', 'start': {'dateTime': _at(1, 9)}, 'end': {'dateTime': _at(1, 12)}})
+    api.delete_event('staff1', next(iter(api._events['staff1'])))
+    mirrored.mirror.sync_all()
+
+    assert mirrored.mirror.stats["incremental_syncs"] == len(CALENDAR_IDS)
+    assert query_all(mirrored, dates) == query_all(live, dates)
+
+
+def test_mirror_resyncs_after_sync_token_is_gone(api, services, dates):
+    live, mirrored = services
+    mirrored.mirror.sync_all()
+    api.invalidate_sync_tokens()
+    api.delete_event('staff0', next(iter(api._events['staff0'])))
+    mirrored.mirror.sync_all()
+
+    assert mirrored.mirror.stats["full_syncs"] == 2 * len(CALENDAR_IDS)
+    assert query_all(mirrored, dates) == query_all(live, dates)
+
+
+def test_full_sync_skips_past_events():
+    api = FakeCalendarAPI({"staff0": [
+        {'summary': 'Passato', 'start': {'dateTime': _at(-30, 10)}, 'end': {'dateTime': _at(-30, 11)}},
+        {'summary': 'Futuro', 'start': {'dateTime': _at(2, 10)}, 'end': {'dateTime': _at(2, 11)}},
+    ]})
+    mirrored = make_service(MirroredCalendarService, api, ["staff0"])
+    items, _ = mirrored.mirror._list_changes("staff0", None)
+    assert [event['summary'] for event in items] == ['Futuro']
+
+
+def test_aged_mirror_syncs_before_answering_without_push(api, dates):
+    mirrored = make_service(MirroredCalendarService, api, CALENDAR_IDS)
+    mirrored.mirror.refresh_seconds = 0
+    mirrored.mirror.sync_all()
+    api.add_event('staff0', {'summary': 'Appuntamento', 'start': {'dateTime': _at(1, 9)}, 'end': {'dateTime': _at(1, 18)}})
+
+    live = make_service(CalendarService, api, CALENDAR_IDS)
+    assert query_all(mirrored, dates[1:2]) == query_all(live, dates[1:2])
+    assert mirrored.mirror.stats["background_refreshes"] == 0
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from calendar_watch import CalendarWatchManager
+
+mongomock = pytest.importorskip("mongomock")
+
+CHANNEL = {"channel_id": "ch1", "token": "segreto", "business_id": "b1", "calendar_id": "cal"}
+
+
+def _headers(token="segreto", state="exists"):
+    return {"X-Goog-Channel-ID": "ch1", "X-Goog-Channel-Token": token, "X-Goog-Resource-State": state}
+
+
+@pytest.fixture
+def database():
+    database = mongomock.MongoClient().db
+    database.calendar_channels.insert_one(dict(CHANNEL))
+    database.businesses.insert_one({"_id": "b1", "business_name": "Salone"})
+    return database
+
+
+def _manager(database, changed):
+    manager = CalendarWatchManager(database.calendar_channels, database.calendar_changes, address="https://x/calendar/notifications")
+    manager.add_change_listener(changed.append)
+    return manager
+
+
+def test_change_is_recorded_without_touching_the_business(database):
+    changed = []
+    assert _manager(database, changed).handle_notification(_headers()) == "b1"
+
+    assert changed == ["b1"]
+    assert database.calendar_changes.find_one({"_id": "b1"})["changed_at"]
+    assert database.businesses.find_one({"_id": "b1"}) == {"_id": "b1", "business_name": "Salone"}
+
+
+def test_sync_handshake_and_wrong_token_change_nothing(database):
+    changed = []
+    manager = _manager(database, changed)
+    assert manager.handle_notification(_headers(state="sync")) is None
+    assert manager.handle_notification(_headers(token="sbagliato")) is None
+
+    assert changed == []
+    assert database.calendar_changes.count_documents({}) == 0
+    assert manager.stats["rejected"] == 1
+
+
+def test_async_notification_records_the_change():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient().db
+    changed = []
+
+    async def _run():
+        await database.calendar_channels.insert_one(dict(CHANNEL))
+        manager = _manager(database, changed)
+        business_id = await manager.ahandle_notification(_headers())
+        return business_id, await database.calendar_changes.count_documents({"_id": "b1"})
+
+    assert asyncio.run(_run()) == ("b1", 1)
+    assert changed == ["b1"]
@@ -0,0 +1,110 @@
+from datetime import date
+
+import booking_logic
+import intent_router
+
+TODAY = date(2026, 10, 16)
+BOOKING_CONFIRMED = [
+    {"role": "user", "content": "prenota taglio domani alle 10"},
+    {"role": "assistant", "content": "Perfetto, appuntamento confermato! Ti aspetto per 'Taglio' il 2026-10-17 alle 10:00."},
+]
+
+
+def test_opening_ciao_is_left_to_the_model():
+    assert intent_router.classify("ciao", None, [], TODAY) is None
+    assert intent_router.classify("Ciao!", None, [], TODAY) is None
+
+
+def test_ciao_after_a_booking_is_a_closing():
+    intent = intent_router.classify("ciao", None, BOOKING_CONFIRMED, TODAY)
+    assert intent["name"] == "closing"
+
+
+def test_thanks_is_a_closing_even_without_history():
+    intent = intent_router.classify("Grazie mille, ciao!", None, [], TODAY)
+    assert intent["name"] == "closing"
+    assert intent_router.render(intent, None) == intent_router.CLOSING_REPLY
+
+
+def test_ciao_while_awaiting_an_answer_is_left_to_the_model():
+    history = [{"role": "assistant", "content": "Per quale servizio?"}]
+    assert intent_router.classify("ciao", None, history, TODAY) is None
+
+
+class FakeTools:
+    """Tool del percorso veloce: registra le chiamate invece di toccare calendario e database."""
+
+    def __init__(self, next_booking=None):
+        self.calls = []
+        self.next_booking = next_booking
+
+    def get_next_booking(self, **kwargs):
+        self.calls.append(("get_next_booking", kwargs))
+        if not self.next_booking:
+            return booking_logic.no_upcoming_booking_message()
+        return booking_logic.booking_summary(self.next_booking)
+
+    def cancel_booking(self, **kwargs):
+        self.calls.append(("cancel_booking", kwargs))
+        return booking_logic.booking_cancelled_message(self.next_booking)
+
+    def create_or_update_booking(self, **kwargs):
+        self.calls.append(("create_or_update_booking", kwargs))
+        return "Perfetto, appuntamento confermato!"
+
+
+NEXT_BOOKING = {"service": "Taglio", "date": "2026-10-20", "time": "10:00"}
+
+
+def _route(message, history, tools, config=None):
+    return intent_router.route(message, "b1", "whatsapp:+39", "Mario", config, history, tools, TODAY)
+
+
+def test_bare_cancel_asks_for_confirmation_without_cancelling():
+    tools = FakeTools(NEXT_BOOKING)
+    reply = _route("annulla", [], tools)
+
+    assert reply == intent_router.CANCEL_PROPOSAL_TEMPLATE.format(**NEXT_BOOKING)
+    assert [name for name, _ in tools.calls] == ["get_next_booking"]
+
+
+def test_cancel_is_executed_only_after_the_yes():
+    tools = FakeTools(NEXT_BOOKING)
+    history = [{"role": "assistant", "content": _route("disdici", [], tools)}]
+    reply = _route("sì, confermo", history, tools)
+
+    assert reply.startswith(booking_logic.BOOKING_CANCELLED_PREFIX)
+    assert tools.calls[-1] == ("cancel_booking", {
+        "date": "2026-10-20", "time": "10:00", "business_id": "b1", "user_id": "whatsapp:+39", "user_name": "Mario",
+    })
+
+
+def test_cancel_without_upcoming_booking_says_so():
+    tools = FakeTools()
+    assert _route("annulla", [], tools) == booking_logic.no_upcoming_booking_message()
+
+
+def test_bare_cancel_with_a_pending_question_is_left_to_the_model():
+    history = [{"role": "assistant", "content": "Per quale giorno vuoi prenotare?"}]
+    tools = FakeTools(NEXT_BOOKING)
+    assert _route("annulla", history, tools) is None
+    assert tools.calls == []
+
+
+def test_explicit_cancel_with_a_pending_question_still_asks_for_confirmation():
+    history = [{"role": "assistant", "content": "Per quale giorno vuoi prenotare?"}]
+    intent = intent_router.classify("annulla la prenotazione", None, history, TODAY)
+    assert intent["name"] == "cancel_check"
+    assert intent["tool"] == "get_next_booking"
+
+
+def test_yes_to_a_slot_proposal_books_exactly_that_slot():
+    proposal = intent_router.PROPOSAL_TEMPLATE.format(service="Taglio", date="2026-10-20", time="10:00")
+    intent = intent_router.classify("ok va bene", None, [{"role": "assistant", "content": proposal}], TODAY)
+    assert intent["tool"] == "create_or_update_booking"
+    assert intent["args"] == {"service_name": "Taglio", "date": "2026-10-20", "time": "10:00"}
+
+
+def test_yes_without_a_proposal_is_left_to_the_model():
+    history = [{"role": "assistant", "content": "Ecco gli orari liberi: 10:00, 11:00."}]
+    assert intent_router.classify("ok", None, history, TODAY) is None
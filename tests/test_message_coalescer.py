@@ -0,0 +1,32 @@
+import threading
+import time
+
+from message_coalescer import MessageCoalescer
+
+
+def test_burst_starts_processing_after_the_quiet_window():
+    coalescer = MessageCoalescer(window_seconds=0.1, max_seconds=1)
+    burst = coalescer.join("u1", "ciao")
+    with burst:
+        assert burst.processing_at - burst.started_at >= 0.1
+
+
+def test_burst_waiting_for_the_previous_turn_starts_when_it_is_released():
+    coalescer = MessageCoalescer(window_seconds=0.05, max_seconds=1)
+    released = {}
+    second = {}
+
+    def _second_turn():
+        second["burst"] = coalescer.join("u1", "alle 10")
+
+    with coalescer.join("u1", "vorrei un taglio"):
+        thread = threading.Thread(target=_second_turn)
+        thread.start()
+        time.sleep(0.3)
+        released["at"] = time.monotonic()
+    thread.join()
+
+    burst = second["burst"]
+    assert burst.text == "alle 10"
+    assert burst.processing_at >= released["at"]
+    assert burst.processing_at - burst.started_at >= 0.25
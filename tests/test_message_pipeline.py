@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+import message_pipeline
+import resilience
+
+
+def test_parse_webhook_requires_body_and_numbers():
+    inbound = message_pipeline.parse_webhook({"Body": " ciao ", "From": "whatsapp:+39", "To": "whatsapp:+1", "MessageSid": "SM1"})
+    assert inbound == {"body": "ciao", "from_number": "whatsapp:+39", "to_number": "whatsapp:+1",
+                       "user_name": "Cliente", "message_sid": "SM1"}
+    assert message_pipeline.parse_webhook({"Body": "  ", "From": "whatsapp:+39", "To": "whatsapp:+1"}) is None
+
+
+def test_duplicate_reply_is_repeated_only_when_done_and_not_sent_via_rest():
+    done = {"status": "done", "reply": "Ciao!"}
+    assert message_pipeline.duplicate_reply(done) == "Ciao!"
+    assert message_pipeline.duplicate_reply(done, reply_sent_separately=True) is None
+    assert message_pipeline.duplicate_reply({"status": "processing"}) is None
+
+
+def test_last_model_request_has_no_tools():
+    assert "tools" in message_pipeline.model_request([], message_pipeline.MAX_TOOL_ITERATIONS)
+    assert "tools" not in message_pipeline.model_request([], message_pipeline.MAX_TOOL_ITERATIONS + 1)
+
+
+def test_tool_calls_are_appended_to_the_model_conversation():
+    tool_call = SimpleNamespace(id="1", function=SimpleNamespace(name="get_business_info", arguments="{}"))
+    message = SimpleNamespace(content=None, tool_calls=[tool_call])
+    response = SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+    api_messages = []
+    assert message_pipeline.read_model_response(response, api_messages, 1) == [tool_call]
+    assert api_messages == [message]
+
+
+def test_degraded_reply_and_conversation_update():
+    turn = message_pipeline.MessageTurn("ciao", "whatsapp:+39", "Mario")
+    turn.start({"_id": "b1", "business_name": "Salone"})
+    turn.fail(resilience.DeadlineExceeded("tempo esaurito"))
+    messages, new_state = turn.conversation_update()
+    assert messages[-1] == {"role": "assistant", "content": turn.reply}
+    assert turn.reply != message_pipeline.GENERAL_ERROR_REPLY
+    assert new_state is None
+
+
+def test_conversation_is_not_saved_without_a_business():
+    turn = message_pipeline.MessageTurn("ciao", "whatsapp:+39", "Mario")
+    with pytest.raises(ValueError):
+        turn.conversation_update()
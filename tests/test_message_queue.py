@@ -0,0 +1,74 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import inbound_dedupe
+from message_queue import MongoQueue
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.inbound_jobs
+
+
+def _queue(collection, handler=lambda job: None, visibility_timeout=120):
+    return MongoQueue(handler, collection, visibility_timeout=visibility_timeout)
+
+
+def _enqueue(collection, message_sid="SM1"):
+    collection.insert_one({"job": {"message_sid": message_sid}, "status": "queued", "created_at": datetime.utcnow()})
+
+
+def test_job_still_processing_is_not_redelivered(collection):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_handler(job):
+        started.set()
+        release.wait(5)
+
+    _enqueue(collection)
+    worker = _queue(collection, slow_handler, visibility_timeout=0.3)
+    thread = threading.Thread(target=worker._process, args=(worker._claim(),))
+    thread.start()
+    started.wait(5)
+    time.sleep(0.6)
+
+    assert _queue(collection, visibility_timeout=0.3)._claim() is None
+    release.set()
+    thread.join()
+    assert collection.count_documents({}) == 0
+
+
+def test_complete_after_redelivery_keeps_the_new_claim(collection):
+    _enqueue(collection)
+    first = _queue(collection)._claim()
+    collection.update_one({"_id": first["_id"]}, {"$set": {"claimed_at": datetime.utcnow() - timedelta(seconds=300)}})
+    second = _queue(collection)._claim()
+
+    _queue(collection)._complete(first)
+    assert collection.count_documents({"_id": first["_id"], "claim": second["claim"]}) == 1
+    _queue(collection)._complete(second)
+    assert collection.count_documents({}) == 0
+
+
+def test_redelivered_job_reports_its_deliveries(collection):
+    received = []
+    _enqueue(collection)
+    first = _queue(collection)._claim()
+    collection.update_one({"_id": first["_id"]}, {"$set": {"claimed_at": datetime.utcnow() - timedelta(seconds=300)}})
+    worker = _queue(collection, received.append)
+    worker._process(worker._claim())
+
+    assert received == [{"message_sid": "SM1", "deliveries": 2}]
+
+
+def test_inbound_record_tells_if_the_message_was_already_answered():
+    inbound_messages = mongomock.MongoClient().db.inbound_messages
+    assert inbound_dedupe.claim(inbound_messages, "SM1", "whatsapp:+39333", "whatsapp:+390000") is None
+    assert not inbound_dedupe.is_done(inbound_messages, "SM1")
+    inbound_dedupe.complete(inbound_messages, "SM1", "Ciao!")
+    assert inbound_dedupe.is_done(inbound_messages, "SM1")
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import reminders
+from fake_twilio import FakeTwilioSender
+
+mongomock = pytest.importorskip("mongomock")
+
+NOW = datetime(2026, 10, 17, 9, 0)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    # Le UpdateOne di pymongo recenti passano anche sort, che mongomock non conosce
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, "add_update",
+                        lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+    database = mongomock.MongoClient().db
+    database.businesses.insert_one({"_id": "b1", "business_name": "Salone Prova", "twilio_phone_number": "whatsapp:+390000"})
+    database.bookings.insert_one({
+        "business_id": "b1", "user_id": "whatsapp:+39333", "user_name": "Mario", "service": "Taglio",
+        "date": "2026-10-18", "time": "10:00", "start": NOW + timedelta(hours=3),
+        "status": "confirmed", "reminder_status": "pending",
+    })
+    return database
+
+
+def _scheduler(database, sender):
+    return reminders.ReminderScheduler(database.bookings, database.businesses, sender, rate_per_second=1000)
+
+
+def test_reminder_is_sent_as_approved_template(database, monkeypatch):
+    monkeypatch.setattr(reminders, "REMINDER_CONTENT_SID", "HXdefault")
+    database.businesses.update_one({"_id": "b1"}, {"$set": {"reminder_content_sid": "HXsalone"}})
+    sender = FakeTwilioSender()
+
+    assert _scheduler(database, sender).run_once(NOW) == 1
+    message = sender.sent[0]
+    assert message["content_sid"] == "HXsalone"
+    assert message["content_variables"] == {"1": "Mario", "2": "Taglio", "3": "Salone Prova", "4": "2026-10-18", "5": "10:00"}
+    booking = database.bookings.find_one()
+    assert (booking["reminder_status"], booking["reminder_sid"]) == ("sent", message["sid"])
+
+
+def test_missing_template_is_recorded_as_failure(database, monkeypatch):
+    monkeypatch.setattr(reminders, "REMINDER_CONTENT_SID", None)
+    sender = FakeTwilioSender()
+    scheduler = _scheduler(database, sender)
+
+    for attempt in range(reminders.REMINDER_MAX_ATTEMPTS):
+        scheduler.run_once(NOW + timedelta(seconds=attempt * (reminders.REMINDER_SCAN_SECONDS + 1)))
+
+    booking = database.bookings.find_one()
+    assert sender.sent == []
+    assert booking["reminder_status"] == "failed"
+    assert "template" in booking["reminder_error"]
+    assert scheduler.stats["failed"] == 1
+
+
+def test_message_already_failed_at_twilio_raises():
+    sender = object.__new__(reminders.TwilioReminderSender)
+    message = SimpleNamespace(sid="SM1", status="failed", error_code=63016, error_message="Fuori dalla finestra di 24 ore")
+    sender.client = SimpleNamespace(messages=SimpleNamespace(create=lambda **kwargs: message))
+    with pytest.raises(RuntimeError, match="63016"):
+        sender.send("whatsapp:+390000", "whatsapp:+39333", "HX1", {"1": "Mario"})
+
+
+def test_undelivered_status_callback_marks_reminder_failed(database, monkeypatch):
+    monkeypatch.setattr(reminders, "REMINDER_CONTENT_SID", "HXdefault")
+    sender = FakeTwilioSender()
+    _scheduler(database, sender).run_once(NOW)
+    sid = sender.sent[0]["sid"]
+
+    assert not reminders.record_delivery_status(database.bookings, {"MessageSid": sid, "MessageStatus": "delivered"})
+    assert reminders.record_delivery_status(database.bookings, {"MessageSid": sid, "MessageStatus": "undelivered", "ErrorCode": "63016"})
+    booking = database.bookings.find_one()
+    assert booking["reminder_status"] == "failed"
+    assert booking["reminder_error"] == "Twilio undelivered (codice 63016)"
@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("thefuzz")
+
+from service_matcher import ServiceMatcher, normalize
+
+SERVICES = [
+    {"name": "Taglio uomo", "duration": 30, "aliases": ["taglio capelli", "sforbiciata"]},
+    {"name": "Taglio donna", "duration": 45},
+    {"name": "Piega", "duration": 30},
+    {"name": "Colore e piega", "duration": 90},
+]
+
+
+@pytest.fixture
+def matcher():
+    return ServiceMatcher(SERVICES)
+
+
+def _name(service):
+    return service["name"] if service else None
+
+
+def test_normalize_drops_accents_punctuation_and_stopwords():
+    assert normalize("Vorrei fare un TAGLIO, per favore!") == "taglio"
+    assert normalize("Più colore") == "piu colore"
+
+
+def test_exact_name_and_alias(matcher):
+    assert _name(matcher.match("taglio uomo")) == "Taglio uomo"
+    assert _name(matcher.match("Vorrei una sforbiciata")) == "Taglio uomo"
+
+
+def test_keyword_that_identifies_a_single_service(matcher):
+    assert _name(matcher.match("colore")) == "Colore e piega"
+    assert _name(matcher.match("taglio per donna")) == "Taglio donna"
+
+
+def test_ambiguous_keyword_is_not_guessed_strictly(matcher):
+    assert matcher.match_strict("taglio") is None
+    assert matcher.match_strict("piega") is not None
+
+
+def test_fuzzy_match_for_typos(matcher):
+    assert _name(matcher.match("tagio uomo")) == "Taglio uomo"
+
+
+def test_unrelated_request_matches_nothing(matcher):
+    assert matcher.match("manicure gel") is None
+    assert matcher.match("") is None
+    assert matcher.match_strict("vorrei prenotare") is None
+
+
+def test_repeated_queries_hit_the_cache(matcher):
+    matcher.match("sforbiciata")
+    matcher.match("Sforbiciata!")
+    assert matcher.cache_info().hits == 1
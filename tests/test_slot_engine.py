@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+
+from bench_slots import legacy_slots, random_day, sweep_slots
+from slot_engine import find_free_slots, format_minutes, free_gaps, merge_intervals
+
+NINE, SIX_PM = 9 * 60, 18 * 60
+
+
+def _starts(slots):
+    return [format_minutes(start) for start, _ in slots]
+
+
+def test_merge_fuses_overlapping_and_adjacent_intervals():
+    assert merge_intervals([(600, 630), (540, 570), (570, 600), (700, 720), (710, 715)]) == [(540, 630), (700, 720)]
+
+
+def test_merge_clips_to_bounds_and_drops_empty_intervals():
+    assert merge_intervals([(480, 560), (1050, 1140), (1100, 1090), (400, 470)], NINE, SIX_PM) == [(540, 560), (1050, 1080)]
+
+
+def test_free_gaps_between_busy_intervals():
+    assert free_gaps(NINE, SIX_PM, [(540, 600), (700, 720)]) == [(600, 700), (720, SIX_PM)]
+    assert free_gaps(NINE, SIX_PM, [(500, SIX_PM)]) == []
+
+
+def test_adjacent_bookings_leave_no_slot_between_them():
+    busy = {"cal": [(600, 630), (630, 660)]}
+    slots = find_free_slots(NINE, 12 * 60, busy, [30])[30]
+    assert _starts(slots) == ["09:00", "09:30", "11:00", "11:30"]
+
+
+def test_busy_period_spanning_closing_time():
+    busy = {"cal": [(17 * 60 + 30, 19 * 60)]}
+    slots = find_free_slots(17 * 60, SIX_PM, busy, [30])[30]
+    assert _starts(slots) == ["17:00"]
+
+
+def test_not_before_keeps_only_later_starts():
+    slots = find_free_slots(NINE, 11 * 60, {"cal": []}, [30], not_before=10 * 60)[30]
+    assert _starts(slots) == ["10:30"]
+    slots = find_free_slots(NINE, 11 * 60, {"cal": []}, [30], not_before=10 * 60 + 5)[30]
+    assert _starts(slots) == ["10:30"]
+
+
+def test_mixed_durations_and_calendars():
+    busy = {"main": [(600, 660)], "staff": [(540, 600)]}
+    results = find_free_slots(NINE, 12 * 60, busy, [30, 90])
+
+    assert results[30] == [
+        (540, ["main"]), (570, ["main"]), (600, ["staff"]), (630, ["staff"]), (660, ["main", "staff"]), (690, ["main", "staff"]),
+    ]
+    assert results[90] == [(600, ["staff"]), (630, ["staff"])]
+
+
+def test_gap_off_the_grid_starts_at_the_next_grid_point():
+    slots = find_free_slots(NINE, 11 * 60, {"cal": [(540, 585)]}, [30])[30]
+    assert _starts(slots) == ["10:00", "10:30"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("step", [5, 15, 30])
+def test_sweep_matches_the_legacy_scan(seed, step):
+    target_date = date(2026, 10, 20)
+    durations = [30, 45, 60, 90]
+    busy_dt, busy_min = random_day(target_date, 3, 20, 8, 21, seed=seed)
+
+    results = sweep_slots(busy_min, durations, 8, 21, step)
+    for duration in durations:
+        assert results[duration] == legacy_slots(target_date, busy_dt, duration, 8, 21, step)
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import slot_reservations
+from db_indexes import INDEX_SPECS
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def pending_bookings():
+    collection = mongomock.MongoClient().db.pending_bookings
+    for model in INDEX_SPECS["pending_bookings"]:
+        document = dict(model.document)
+        collection.create_index(list(document.pop("key").items()), **document)
+    return collection
+
+
+def _reserve(collection, user_id, time="10:00", duration=30, calendar_ids=("cal",), seconds=300):
+    return slot_reservations.reserve(
+        collection, "b1", list(calendar_ids), user_id, "Taglio", "2026-10-20", time, duration, seconds=seconds
+    )
+
+
+def test_second_user_cannot_take_a_held_slot(pending_bookings):
+    assert _reserve(pending_bookings, "alice")["user_id"] == "alice"
+    assert _reserve(pending_bookings, "bob") is None
+    assert pending_bookings.count_documents({}) == 1
+
+
+def test_same_user_renews_the_hold(pending_bookings):
+    first = _reserve(pending_bookings, "alice", seconds=60)
+    renewed = _reserve(pending_bookings, "alice", seconds=300)
+    assert renewed["_id"] == first["_id"]
+    assert renewed["expires_at"] > first["expires_at"]
+
+
+def test_expired_hold_is_taken_over(pending_bookings):
+    _reserve(pending_bookings, "alice")
+    pending_bookings.update_many({}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    hold = _reserve(pending_bookings, "bob")
+    assert hold["user_id"] == "bob"
+    assert pending_bookings.count_documents({}) == 1
+
+
+def test_overlapping_hold_with_another_start_gives_way(pending_bookings):
+    _reserve(pending_bookings, "alice", time="10:00", duration=60)
+    assert _reserve(pending_bookings, "bob", time="10:30", duration=30) is None
+    # La hold rifiutata non resta nella collection
+    assert pending_bookings.count_documents({"user_id": "bob"}) == 0
+    assert _reserve(pending_bookings, "bob", time="11:00", duration=30)["user_id"] == "bob"
+
+
+def test_next_calendar_is_used_when_the_first_is_held(pending_bookings):
+    _reserve(pending_bookings, "alice", calendar_ids=("staff1",))
+    hold = _reserve(pending_bookings, "bob", calendar_ids=("staff1", "staff2"))
+    assert hold["calendar_id"] == "staff2"
+
+
+def test_released_booking_keeps_the_slot_until_the_grace_period(pending_bookings):
+    hold = _reserve(pending_bookings, "alice")
+    slot_reservations.release(pending_bookings, hold, booked=True)
+    assert _reserve(pending_bookings, "bob") is None
+    slot_reservations.release(pending_bookings, _reserve(pending_bookings, "alice", time="11:00"))
+    assert _reserve(pending_bookings, "bob", time="11:00")["user_id"] == "bob"
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import tool_dispatcher
+
+
+def _tool_call(call_id, name, **arguments):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+class SlowTools:
+    """Prenotazione lenta (deve essere attesa) e ricerca lenta (può scadere)."""
+
+    def __init__(self):
+        self.bookings = []
+
+    def create_or_update_booking(self, **kwargs):
+        time.sleep(0.3)
+        self.bookings.append(kwargs["time"])
+        return "Perfetto, appuntamento confermato!"
+
+    def get_available_slots(self, **kwargs):
+        time.sleep(1)
+        return "[]"
+
+
+class AsyncSlowTools:
+    def __init__(self):
+        self.bookings = []
+
+    async def create_or_update_booking(self, **kwargs):
+        await asyncio.sleep(0.3)
+        self.bookings.append(kwargs["time"])
+        return "Perfetto, appuntamento confermato!"
+
+    async def get_available_slots(self, **kwargs):
+        await asyncio.sleep(1)
+        return "[]"
+
+
+TOOL_CALLS = [
+    _tool_call("1", "create_or_update_booking", service_name="taglio", date="2026-10-20", time="10:00"),
+    _tool_call("2", "get_available_slots", service_name="taglio", date="2026-10-21"),
+]
+CONTEXT = {"business_id": "b1", "user_id": "whatsapp:+39", "user_name": "Mario"}
+
+
+def test_slow_booking_is_awaited_past_the_turn_timeout():
+    tools = SlowTools()
+    messages = tool_dispatcher.run_tool_calls(TOOL_CALLS, tools, CONTEXT, timeout=0.05)
+
+    assert tools.bookings == ["10:00"]
+    assert messages[0]["content"] == "Perfetto, appuntamento confermato!"
+    assert messages[1]["content"] == tool_dispatcher.TIMEOUT_MESSAGE
+
+
+def test_async_slow_booking_is_awaited_and_not_cancelled():
+    tools = AsyncSlowTools()
+    messages = asyncio.run(tool_dispatcher.arun_tool_calls(TOOL_CALLS, tools, CONTEXT, timeout=0.05))
+
+    assert tools.bookings == ["10:00"]
+    assert messages[0]["content"] == "Perfetto, appuntamento confermato!"
+    assert messages[1]["content"] == tool_dispatcher.TIMEOUT_MESSAGE
+
+
+class BookingThenCancelTools:
+    """Registra inizio e fine di ogni scrittura, per verificare che non si sovrappongano."""
+
+    def __init__(self):
+        self.log = []
+
+    def create_or_update_booking(self, **kwargs):
+        self.log.append("create:start")
+        time.sleep(0.2)
+        self.log.append("create:end")
+        return "Perfetto, appuntamento confermato!"
+
+    def cancel_booking(self, **kwargs):
+        self.log.append("cancel:start")
+        self.log.append("cancel:end")
+        return "La tua prenotazione è stata cancellata"
+
+    def get_business_info(self, **kwargs):
+        return "Salone"
+
+
+class AsyncBookingThenCancelTools(BookingThenCancelTools):
+    async def create_or_update_booking(self, **kwargs):
+        self.log.append("create:start")
+        await asyncio.sleep(0.2)
+        self.log.append("create:end")
+        return "Perfetto, appuntamento confermato!"
+
+    async def cancel_booking(self, **kwargs):
+        return BookingThenCancelTools.cancel_booking(self)
+
+    async def get_business_info(self, **kwargs):
+        return "Salone"
+
+
+WRITE_CALLS = [
+    _tool_call("1", "create_or_update_booking", service_name="taglio", date="2026-10-20", time="10:00"),
+    _tool_call("2", "get_business_info"),
+    _tool_call("3", "cancel_booking"),
+]
+ORDERED_LOG = ["create:start", "create:end", "cancel:start", "cancel:end"]
+
+
+def test_writes_of_one_turn_run_in_the_model_order():
+    tools = BookingThenCancelTools()
+    messages = tool_dispatcher.run_tool_calls(WRITE_CALLS, tools, CONTEXT, timeout=5)
+
+    assert tools.log == ORDERED_LOG
+    assert [m["content"] for m in messages] == [
+        "Perfetto, appuntamento confermato!", "Salone", "La tua prenotazione è stata cancellata",
+    ]
+
+
+def test_async_writes_of_one_turn_run_in_the_model_order():
+    tools = AsyncBookingThenCancelTools()
+    messages = asyncio.run(tool_dispatcher.arun_tool_calls(WRITE_CALLS, tools, CONTEXT, timeout=5))
+
+    assert tools.log == ORDERED_LOG
+    assert [m["tool_call_id"] for m in messages] == ["1", "2", "3"]
@@ -0,0 +1,166 @@
+# tool_dispatcher.py - Esecuzione concorrente dei tool_calls di un turno del modello
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metrics
+import resilience
+
+TOOL_POOL_SIZE = int(os.getenv("TOOL_POOL_SIZE", "8"))
+TOOL_TURN_TIMEOUT_SECONDS = float(os.getenv("TOOL_TURN_TIMEOUT_SECONDS", "8"))
+
+TIMEOUT_MESSAGE = "Il servizio sta impiegando troppo tempo a rispondere. Riprova tra poco."
+ERROR_MESSAGE = "Si è verificato un errore imprevisto. Riprova a formulare la richiesta."
+
+# Tool che scrivono su Calendar e database: non si possono interrompere né dare per scaduti,
+# altrimenti l'utente riprova mentre la prima prenotazione va comunque a buon fine, e non devono
+# incrociarsi tra loro. Girano in sequenza e se ne attende sempre l'esito (le chiamate a Calendar
+# al loro interno sono già limitate dal tempo del messaggio).
+NON_IDEMPOTENT_TOOLS = {"create_or_update_booking", "cancel_booking"}
+
+# Pool condiviso e limitato: i thread nascono al primo submit, quindi dopo il fork di gunicorn
+_executor = ThreadPoolExecutor(max_workers=TOOL_POOL_SIZE, thread_name_prefix="tool")
+
+
+def _prepare_call(tool_call, tools_module, context, iteration):
+    """Risolve funzione e argomenti di un tool_call; gli argomenti di contesto sovrascrivono quelli del modello."""
+    function_name = tool_call.function.name
+    function_args = json.loads(tool_call.function.arguments or "{}")
+    function_args.update(context)
+    print(f"🛠️ Iter. {iteration}: Eseguo {function_name}({function_args.get('service_name', '')}, {function_args.get('date', '')})")
+    return getattr(tools_module, function_name), function_args
+
+
+def _tool_message(tool_call, content):
+    return {
+        "tool_call_id": tool_call.id,
+        "role": "tool",
+        "name": tool_call.function.name,
+        "content": str(content),
+    }
+
+
+def _call_safely(function_to_call, function_args):
+    try:
+        with metrics.span("tool", function_to_call.__name__):
+            return function_to_call(**function_args)
+    except Exception:
+        traceback.print_exc()
+        return ERROR_MESSAGE
+
+
+def run_tool_calls(tool_calls, tools_module, context, iteration=1, timeout=None):
+    """
+    Esegue i tool_calls di un turno e restituisce i messaggi 'tool' nello stesso ordine delle chiamate.
+    Le letture vanno in parallelo sul pool: quelle non concluse entro timeout secondi (di default
+    TOOL_TURN_TIMEOUT_SECONDS, o meno se il messaggio ha meno tempo) ricevono un messaggio di attesa,
+    così il modello può comunque rispondere. Le chiamate in NON_IDEMPOTENT_TOOLS girano invece una
+    dopo l'altra, nell'ordine del modello (una disdetta non deve incrociare la prenotazione appena
+    chiesta), e vengono sempre attese fino alla fine.
+    """
+    if timeout is None:
+        timeout = resilience.budget(TOOL_TURN_TIMEOUT_SECONDS)
+    started = time.monotonic()
+    prepared = []
+    for tool_call in tool_calls:
+        try:
+            prepared.append(_prepare_call(tool_call, tools_module, context, iteration))
+        except Exception as e:
+            print(f"⚠️ Tool call non valida ({tool_call.function.name}): {e}")
+            prepared.append(None)
+
+    futures = [
+        _executor.submit(metrics.in_current_context(_call_safely), *call)
+        if call and tool_call.function.name not in NON_IDEMPOTENT_TOOLS else None
+        for tool_call, call in zip(tool_calls, prepared)
+    ]
+    # Scritture in sequenza nel thread del messaggio, mentre le letture procedono sul pool
+    written = {
+        index: _call_safely(*call) for index, (tool_call, call) in enumerate(zip(tool_calls, prepared))
+        if call and tool_call.function.name in NON_IDEMPOTENT_TOOLS
+    }
+    wait([f for f in futures if f], timeout=max(0.0, timeout - (time.monotonic() - started)))
+
+    messages = []
+    for index, (tool_call, future) in enumerate(zip(tool_calls, futures)):
+        if index in written:
+            content = written[index]
+        elif future is None:
+            content = ERROR_MESSAGE
+        elif future.done():
+            content = future.result()
+        else:
+            print(f"⏱️ Tool {tool_call.function.name} oltre il limite di {timeout:.1f}s")
+            content = TIMEOUT_MESSAGE
+        messages.append(_tool_message(tool_call, content))
+    return messages
+
+
+def tool_events(tool_calls, tool_messages):
+    """Coppie chiamata/esito come (nome, argomenti del modello, contenuto), per aggiornare lo stato della conversazione."""
+    events = []
+    for tool_call, message in zip(tool_calls, tool_messages):
+        try:
+            args = json.loads(tool_call.function.arguments or "{}")
+        except ValueError:
+            continue
+        events.append((tool_call.function.name, args, message["content"]))
+    return events
+
+
+async def _acall_safely(function_to_call, function_args):
+    try:
+        with metrics.span("tool", function_to_call.__name__):
+            return await function_to_call(**function_args)
+    except Exception:
+        traceback.print_exc()
+        return ERROR_MESSAGE
+
+
+async def arun_tool_calls(tool_calls, tools_module, context, iteration=1, timeout=None):
+    """Come run_tool_calls, per tool asyncio: le letture procedono insieme sull'event loop, le scritture in sequenza."""
+    if timeout is None:
+        timeout = resilience.budget(TOOL_TURN_TIMEOUT_SECONDS)
+    started = time.monotonic()
+    tasks = []
+    writes = []
+    for index, tool_call in enumerate(tool_calls):
+        try:
+            function_to_call, function_args = _prepare_call(tool_call, tools_module, context, iteration)
+        except Exception as e:
+            print(f"⚠️ Tool call non valida ({tool_call.function.name}): {e}")
+            tasks.append(None)
+            continue
+        if tool_call.function.name in NON_IDEMPOTENT_TOOLS:
+            writes.append((index, function_to_call, function_args))
+            tasks.append(None)
+        else:
+            tasks.append(asyncio.ensure_future(_acall_safely(function_to_call, function_args)))
+
+    # Scritture una alla volta, nell'ordine del modello, e mai cancellate
+    written = {}
+    for index, function_to_call, function_args in writes:
+        written[index] = await _acall_safely(function_to_call, function_args)
+
+    pending_tasks = [t for t in tasks if t]
+    if pending_tasks:
+        await asyncio.wait(pending_tasks, timeout=max(0.0, timeout - (time.monotonic() - started)))
+
+    messages = []
+    for index, (tool_call, task) in enumerate(zip(tool_calls, tasks)):
+        if index in written:
+            content = written[index]
+        elif task is None:
+            content = ERROR_MESSAGE
+        elif task.done():
+            content = task.result()
+        else:
+            task.cancel()
+            print(f"⏱️ Tool {tool_call.function.name} oltre il limite di {timeout:.1f}s")
+            content = TIMEOUT_MESSAGE
+        messages.append(_tool_message(tool_call, content))
+    return messages